@@ -4,97 +4,2330 @@
 # Configuration
 import os
 import time
+import json
+import zlib
+import heapq
+import queue
+import struct
+import shutil
+import hashlib
+import tempfile
+import threading
+import contextvars
 import numpy as np
 import pandas as pd
 import pickle as pk
 from copy import deepcopy
 from collections import defaultdict
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
 
 
 class NaviPath:
+    '''
+    The paths of the program. The inputs (i.e., templates, data, and components) are shared,
+    while the outputs (i.e., "proj" and "schedule") are resolved through the current RunContext.
+    '''
+
     root = os.path.dirname(os.path.abspath(__file__))
     
     fdir_template = os.path.sep.join((root, 'template'))
     fdir_component = os.path.sep.join((root, 'component'))
     fdir_data = os.path.sep.join((root, 'data'))
-    fdir_proj = os.path.sep.join((root, 'proj'))
-    fdir_schedule = os.path.sep.join((root, 'schedule'))
+    fdir_cache = os.path.sep.join((fdir_component, 'cache'))
+    fdir_runs = os.path.sep.join((root, 'runs'))
+
+    activity_table = os.path.sep.join((fdir_template, 'activity_table.xlsx'))
+    activity_order = os.path.sep.join((fdir_template, 'activity_order.xlsx'))
+    activity_pre_dist = os.path.sep.join((fdir_template, 'activity_pre_dist.xlsx')) #choi 추가
+
+    navisystem = os.path.sep.join((fdir_component, 'navisystem.pk'))
+
+    @property
+    def fdir_proj(self):
+        return RunContext.current().fdir_proj
+
+    @property
+    def fdir_schedule(self):
+        return RunContext.current().fdir_schedule
+
+    def case(self, case_num):
+        return os.path.sep.join((self.fdir_data, 'case_{}.xlsx'.format(case_num)))
+
+    def proj(self, case_num):
+        return os.path.sep.join((self.fdir_proj, 'proj_{}.pk'.format(case_num)))
+
+    def schedule(self, case_num, note):
+        return os.path.sep.join((self.fdir_schedule, 'schedule_N-{}_C-{}.xlsx'.format(case_num, note)))
+
+    def iteration_log(self, case_num):
+        return os.path.sep.join((self.fdir_schedule, 'C-{}'.format(case_num), 'iterations.navilog'))
+
+    def metrics_log(self, case_num):
+        return os.path.sep.join((self.fdir_schedule, 'C-{}'.format(case_num), 'metrics.jsonl'))
+
+
+class RunContext:
+    '''
+    A run of the program, which owns its output directories so that many runs (e.g., the same case with different flags) can execute simultaneously.
+    NaviPath and NaviIO resolve the outputs through the current run context, which is activated by "with RunContext(...):".
+    Without an active run context, the default one writes into "proj/" and "schedule/" of the root as before (with a new run_id for each process, so that the temporary files do not collide),
+    or into "runs/{run_id}/" if the environment variable "NAVI_RUN_ID" is set.
+
+    Attributes
+    ----------
+    run_id : str
+        | The unique id of the run.
+    fdir : str
+        | The output directory of the run.
+    fdir_proj : str
+        | The directory of the project files of the run.
+    fdir_schedule : str
+        | The directory of the schedule files of the run.
+
+    Methods
+    -------
+    current
+        | Return the active run context.
+    temporary_path
+        | Return the temporary path of the run for a target path.
+    atomic_path
+        | Yield a temporary path that is renamed to the target path when the writing succeeds.
+    open_atomic
+        | Open a temporary file that is renamed to the target path when it is closed without errors.
+    '''
+
+    __active = contextvars.ContextVar('navi_run_context', default=None)
+    __default = None
+
+    def __init__(self, run_id=None, fdir=None):
+        self.run_id = run_id or self.new_run_id()
+        self.fdir = fdir or os.path.sep.join((NaviPath.fdir_runs, self.run_id))
+        self.fdir_proj = os.path.sep.join((self.fdir, 'proj'))
+        self.fdir_schedule = os.path.sep.join((self.fdir, 'schedule'))
+
+        self.__tokens = []
+
+    def __enter__(self):
+        self.__tokens.append(RunContext.__active.set(self))
+        return self
+
+    def __exit__(self, *args):
+        RunContext.__active.reset(self.__tokens.pop())
+
+    @staticmethod
+    def new_run_id():
+        return '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), os.urandom(3).hex())
+
+    @classmethod
+    def current(cls):
+        context = cls.__active.get()
+        if context is not None:
+            return context
+        elif cls.__default is None:
+            run_id = os.environ.get('NAVI_RUN_ID', '')
+            if run_id:
+                cls.__default = cls(run_id=run_id)
+            else:
+                cls.__default = cls(fdir=NaviPath.root)
+        else:
+            pass
+
+        return cls.__default
+
+    def temporary_path(self, fpath):
+        '''
+        The temporary file is in the same directory (so that the rename is atomic) and keeps the extension (e.g., for pandas.to_excel).
+        '''
+
+        fdir, fname = os.path.split(fpath)
+        name, ext = os.path.splitext(fname)
+        os.makedirs(fdir, exist_ok=True)
+        return os.path.sep.join((fdir, '.{}.{}.tmp{}'.format(name, self.run_id, ext)))
+
+    @contextmanager
+    def atomic_path(self, fpath):
+        fpath_tmp = self.temporary_path(fpath)
+        try:
+            yield fpath_tmp
+            os.replace(fpath_tmp, fpath)
+        finally:
+            if os.path.exists(fpath_tmp):
+                os.remove(fpath_tmp)
+            else:
+                pass
+
+    @contextmanager
+    def open_atomic(self, fpath, mode='wb', **kwargs):
+        with self.atomic_path(fpath) as fpath_tmp:
+            with open(fpath_tmp, mode, **kwargs) as f:
+                yield f
+
+
+class NaviIO:
+    def import_activity_book(self, **kwargs):
+        fdir = kwargs.get('fdir', NaviPath().fdir_component)
+        fname = kwargs.get('fname', 'activity_book.pk')
+        fpath = kwargs.get('fpath', '')
+
+        if not fpath:
+            fpath = os.path.sep.join((fdir, fname))
+
+        try:
+            with open(fpath, 'rb') as f:
+                activity_book = pk.load(f)
+        except FileNotFoundError:
+            print('Error: You should run "init.py" first to build "activity_book.pk"')
+            activity_book = None
+
+        return activity_book
+
+    def import_activity_network(self, **kwargs):
+        fdir = kwargs.get('fdir', NaviPath().fdir_component)
+        fname = kwargs.get('fname', 'activity_network.pk')
+        fpath = kwargs.get('fpath', '')
+
+        if not fpath:
+            fpath = os.path.sep.join((fdir, fname))
+
+        try:
+            with open(fpath, 'rb') as f:
+                activity_network = pk.load(f)
+        except FileNotFoundError:
+            print('Error: You should run "init.py" first to build "activity_network.pk"')
+            activity_network = None
+
+        return activity_network
+
+    def schedule2xlsx(self, schedule, fname, verbose=True):
+        '''
+        Convert the schedule into a DataFrame format.
+        '''
+
+        if not isinstance(schedule, Schedule):
+            schedule = Schedule.from_dict(schedule)
+        else:
+            pass
+
+        days = schedule.duration
+        codes = np.array(schedule.codes+[np.nan], dtype=object)
+        schedule_df = pd.DataFrame(codes[schedule.cells[:, :days]], index=schedule.locations, columns=range(days))
+        schedule_df = schedule_df.dropna(axis=0, how='all').dropna(axis=1, how='all')
+        schedule_df = schedule_df.sort_index()
+
+        with RunContext.current().atomic_path(os.path.sep.join((NaviPath().fdir_schedule, fname))) as fpath:
+            schedule_df.to_excel(fpath, na_rep='', header=True, index=True)
+
+        if verbose:
+            print('Save Schedule')
+            print('  | fdir : {}'.format(NaviPath().fdir_schedule))
+            print('  | fname: {}'.format(fname))
+
+    def xlsx2schedule(self, activity_book, **kwargs):
+        fpath = kwargs.get('fpath', '')
+        fname = kwargs.get('fname', '')
+
+        if not fpath:
+            fpath = os.path.sep.join((NaviPath().fdir_schedule, fname))
+
+        schedule_df = pd.read_excel(fpath, index_col=0)
+        activity_codes = list(activity_book.keys())
+        days = np.array([int(day) for day in schedule_df.columns], dtype='i4')
+
+        schedule = Schedule(locations=schedule_df.index, codes=activity_codes, days=int(days.max())+1 if len(days) else 0)
+        categories = pd.Categorical(schedule_df.to_numpy(dtype=object).ravel(), categories=activity_codes).codes.reshape(schedule_df.shape)
+        category2id = np.array([schedule.code2id[code] for code in activity_codes]+[Schedule.EMPTY], dtype='i4')
+        activity_ids = category2id[categories]
+        schedule.cells[:, days] = activity_ids
+
+        filled = schedule.cells != Schedule.EMPTY
+        schedule.lengths = np.where(filled.any(axis=1), schedule.cells.shape[1]-np.argmax(filled[:, ::-1], axis=1), 0).astype('i4')
+        return schedule
+
+
+    def import_compiled_activity_book(self, **kwargs):
+        '''
+        Load the compiled activity book of the current templates from the cache, which is built by "init.py".
+        '''
+
+        fpaths = kwargs.get('fpaths', [NaviPath().activity_table, NaviPath().activity_order])
+        fdir_cache = kwargs.get('fdir_cache', NaviPath().fdir_cache)
+
+        key = CompiledActivityBook.template_key(fpaths)
+        if CompiledActivityBook.exists(key, fdir_cache=fdir_cache):
+            return CompiledActivityBook.load(key, fdir_cache=fdir_cache)
+        else:
+            print('Error: You should run "init.py" first to build the compiled activity book')
+            return None
+
+    def iteration_log2xlsx(self, case_num, verbose=True):
+        '''
+        Export the snapshots of the iteration log into "I-{iteration}_{stage}.xlsx" files after the update.
+        '''
+
+        for iteration, stage, schedule in IterationLog.read(NaviPath().iteration_log(case_num)):
+            self.schedule2xlsx(schedule, fname='C-{}/I-{:04d}_{}.xlsx'.format(case_num, iteration, stage), verbose=False)
+
+        if verbose:
+            print('Export iteration log')
+            print('  | fdir : {}'.format(os.path.sep.join((NaviPath().fdir_schedule, 'C-{}'.format(case_num)))))
+        else:
+            pass
+
+
+class IterationLog:
+    '''
+    An append-only binary log of the schedule after each stage of the update, recorded as keyframes and deltas.
+    A "T" record holds the location and code tables (written whenever the tables change),
+    a "K" record (keyframe) holds the zlib-compressed lengths and cells of the schedule,
+    and a "D" record (delta) holds only the lengths and cells that have been changed after the former record.
+    A keyframe is written every "keyframe_interval" records, and an index of the records is written to "{fpath}.idx" on close().
+
+    The records are encoded and written by a background thread, so that the update keeps iterating while the former stages are written.
+    write() only copies the arrays into a bounded queue, and blocks when the writer falls behind by "max_pending" records.
+    The records are written in the order of write() calls.
+
+    Attributes
+    ----------
+    fpath : str
+        | The path of the log file.
+    max_pending : int
+        | The maximum number of records waiting for the writer thread.
+    background : bool
+        | Whether the records are written by a background thread (True) or in write() (False).
+    keyframe_interval : int
+        | The maximum number of records from a keyframe to the next keyframe.
+
+    Methods
+    -------
+    write
+        | Append the schedule of a stage.
+    flush
+        | Wait until all records are written.
+    close
+        | Flush and close the log file, and write the index.
+    read
+        | Iterate the (iteration, stage, schedule) records of a log file.
+    '''
+
+    MAGIC = b'NAVILOG\x02'
+    MAGIC_INDEX = b'NAVIIDX\x03'
+    RECORD = struct.Struct('<cI')
+    SNAPSHOT = struct.Struct('<IHIIII')
+    INDEX = struct.Struct('<QQQIH')
+
+    def __init__(self, fpath, max_pending=64, background=True, keyframe_interval=64):
+        self.fpath = fpath
+        self.max_pending = max_pending
+        self.background = background
+        self.keyframe_interval = keyframe_interval
+
+        ## The log is written into a temporary file and renamed on close(), so readers never see a log in progress.
+        self.context = RunContext.current()
+        self.fpath_tmp = self.context.temporary_path(fpath)
+        self.f = open(self.fpath_tmp, 'wb')
+        self.f.write(self.MAGIC)
+
+        self.locations = None
+        self.num_locations = None
+        self.codes = None
+        self.error = None
+
+        ## The states below are only used by the writer.
+        self.index = []
+        self.tables_offset = None
+        self.keyframe_offset = None
+        self.num_deltas = 0
+        self.previous = None
+
+        if self.background:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.writer = threading.Thread(target=self.__run_writer, name='IterationLog', daemon=True)
+            self.writer.start()
+        else:
+            self.queue = None
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __run_writer(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                elif self.error is None:
+                    self.__write_record(*record)
+                else:
+                    pass
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def __raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        else:
+            pass
+
+    def __append(self, record_type, payload):
+        offset = self.f.tell()
+        self.f.write(self.RECORD.pack(record_type, len(payload)))
+        self.f.write(payload)
+        return offset
+
+    def __write_record(self, record_type, payload):
+        if record_type == b'T':
+            self.tables_offset = self.__append(b'T', payload)
+            self.previous = None
+            return
+        else:
+            iteration, stage_bytes, lengths, cells = payload
+
+        num_locations, days = cells.shape
+        if self.previous is None or self.num_deltas+1 >= self.keyframe_interval:
+            header = self.SNAPSHOT.pack(iteration, len(stage_bytes), num_locations, days, 0, 0)
+            offset = self.__append(b'K', header+stage_bytes+zlib.compress(lengths.tobytes()+cells.tobytes(), 1))
+            self.keyframe_offset = offset
+            self.num_deltas = 0
+        else:
+            previous_lengths, previous_cells = self.previous
+            width = max(days, previous_cells.shape[1])
+            before = np.full((num_locations, width), Schedule.EMPTY, dtype='<i4')
+            before[:, :previous_cells.shape[1]] = previous_cells
+            after = np.full((num_locations, width), Schedule.EMPTY, dtype='<i4')
+            after[:, :days] = cells
+
+            rows = np.flatnonzero(lengths != previous_lengths).astype('<i4')
+            cell_rows, cell_days = np.nonzero(before != after)
+            arrays = [rows, lengths[rows], cell_rows.astype('<i4'), cell_days.astype('<i4'), after[cell_rows, cell_days]]
+            header = self.SNAPSHOT.pack(iteration, len(stage_bytes), num_locations, days, len(rows), len(cell_rows))
+            offset = self.__append(b'D', header+stage_bytes+zlib.compress(b''.join([array.tobytes() for array in arrays]), 1))
+            self.num_deltas += 1
+
+        self.previous = (lengths, cells)
+        self.index.append((offset, self.keyframe_offset, self.tables_offset, iteration, stage_bytes))
+
+    def __put(self, record_type, payload):
+        if self.background:
+            self.queue.put((record_type, payload))
+        else:
+            self.__write_record(record_type, payload)
+
+    def write(self, iteration, stage, schedule):
+        self.__raise_error()
+
+        ## The tables are compared by their lengths as well, since the location list may grow in place.
+        tables_changed = (self.locations is not schedule.locations
+                          or self.num_locations != len(schedule.locations)
+                          or self.codes != len(schedule.codes))
+        if tables_changed:
+            tables = {'locations': list(schedule.locations), 'codes': list(schedule.codes)}
+            self.__put(b'T', json.dumps(tables, ensure_ascii=False).encode('utf-8'))
+            self.locations = schedule.locations
+            self.num_locations = len(schedule.locations)
+            self.codes = len(schedule.codes)
+        else:
+            pass
+
+        lengths = schedule.lengths.astype('<i4')
+        cells = np.array(schedule.cells[:, :schedule.duration], dtype='<i4')
+        self.__put(b'S', (iteration, stage.encode('utf-8'), lengths, cells))
+
+    def flush(self):
+        if self.background:
+            self.queue.join()
+        else:
+            pass
+
+        self.__raise_error()
+        self.f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        else:
+            pass
+
+        if self.background:
+            self.queue.put(None)
+            self.writer.join()
+        else:
+            pass
+
+        log_size = self.f.tell()
+        self.f.close()
+        if self.error is not None:
+            os.remove(self.fpath_tmp)
+            self.__raise_error()
+        else:
+            os.replace(self.fpath_tmp, self.fpath)
+
+        ## The index records the size of the log, so that an index of another log is ignored by the reader.
+        with self.context.open_atomic(self.fpath+'.idx', 'wb') as f:
+            f.write(self.MAGIC_INDEX)
+            f.write(struct.pack('<Q', log_size))
+            for offset, keyframe_offset, tables_offset, iteration, stage_bytes in self.index:
+                f.write(self.INDEX.pack(offset, keyframe_offset, tables_offset, iteration, len(stage_bytes)))
+                f.write(stage_bytes)
+
+    @classmethod
+    def read(cls, fpath):
+        with IterationHistory(fpath) as history:
+            for position in range(len(history)):
+                schedule = history.get(position).copy()
+                yield history.current+(schedule,)
+
+
+class IterationHistory:
+    '''
+    A random-access reader of an IterationLog.
+    A record is decoded from the nearest former keyframe, and the decoded record is kept so that stepping forward only applies a delta.
+
+    Attributes
+    ----------
+    fpath : str
+        | The path of the log file.
+    entries : list
+        | A list of (offset, keyframe offset, tables offset, iteration, stage) of the records, which is loaded from the index.
+    position : int
+        | The position of the current record (-1 before the first record).
+
+    Methods
+    -------
+    get
+        | Return the schedule of a record.
+    seek
+        | Move to the first record of an iteration.
+    step
+        | Move forward (or backward) by some records.
+    current
+        | The (iteration, stage) of the current record.
+    '''
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.f = open(fpath, 'rb')
+        if self.f.read(len(IterationLog.MAGIC)) != IterationLog.MAGIC:
+            raise ValueError('Not an iteration log: {}'.format(fpath))
+        else:
+            pass
+
+        try:
+            self.entries = self.__load_index()
+        except (FileNotFoundError, ValueError):
+            self.entries = self.__scan()
+
+        self.position = -1
+        self.schedule = None
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self.f.close()
+
+    def __load_index(self):
+        entries = []
+        with open(self.fpath+'.idx', 'rb') as f:
+            if f.read(len(IterationLog.MAGIC_INDEX)) != IterationLog.MAGIC_INDEX:
+                raise ValueError('Not an iteration log index: {}'.format(self.fpath+'.idx'))
+            elif struct.unpack('<Q', f.read(8))[0] != os.path.getsize(self.fpath):
+                raise ValueError('The index does not match the log: {}'.format(self.fpath+'.idx'))
+            else:
+                pass
+
+            while True:
+                entry = f.read(IterationLog.INDEX.size)
+                if len(entry) < IterationLog.INDEX.size:
+                    break
+                else:
+                    offset, keyframe_offset, tables_offset, iteration, stage_size = IterationLog.INDEX.unpack(entry)
+                    entries.append((offset, keyframe_offset, tables_offset, iteration, f.read(stage_size).decode('utf-8')))
+
+        return entries
+
+    def __scan(self):
+        '''
+        Rebuild the index from the record headers when the log has not been closed (e.g., the update was interrupted).
+        '''
+
+        entries = []
+        tables_offset = keyframe_offset = None
+        file_size = os.path.getsize(self.fpath)
+        while True:
+            offset = self.f.tell()
+            record_header = self.f.read(IterationLog.RECORD.size)
+            if len(record_header) < IterationLog.RECORD.size:
+                break
+            else:
+                record_type, size = IterationLog.RECORD.unpack(record_header)
+
+            if offset+IterationLog.RECORD.size+size > file_size:
+                break
+            else:
+                pass
+
+            payload_header = self.f.read(min(size, IterationLog.SNAPSHOT.size))
+            if record_type == b'T':
+                tables_offset = offset
+            elif len(payload_header) == IterationLog.SNAPSHOT.size:
+                if record_type == b'K':
+                    keyframe_offset = offset
+                else:
+                    pass
+
+                iteration, stage_size = IterationLog.SNAPSHOT.unpack(payload_header)[:2]
+                stage = self.f.read(stage_size).decode('utf-8')
+                entries.append((offset, keyframe_offset, tables_offset, iteration, stage))
+            else:
+                break
+
+            self.f.seek(offset+IterationLog.RECORD.size+size)
+
+        return entries
+
+    def __read_payload(self, offset):
+        self.f.seek(offset)
+        record_type, size = IterationLog.RECORD.unpack(self.f.read(IterationLog.RECORD.size))
+        return record_type, self.f.read(size)
+
+    def __tables(self, tables_offset):
+        if tables_offset not in self.tables:
+            _, payload = self.__read_payload(tables_offset)
+            self.tables[tables_offset] = json.loads(payload.decode('utf-8'))
+        else:
+            pass
+
+        return self.tables[tables_offset]
+
+    def __apply(self, position):
+        offset, _, tables_offset, _, _ = self.entries[position]
+        record_type, payload = self.__read_payload(offset)
+        _, stage_size, num_locations, days, num_rows, num_cells = IterationLog.SNAPSHOT.unpack_from(payload)
+        arrays = np.frombuffer(zlib.decompress(payload[IterationLog.SNAPSHOT.size+stage_size:]), dtype='<i4')
+
+        if record_type == b'K':
+            tables = self.__tables(tables_offset)
+            self.schedule = Schedule(locations=tables['locations'], codes=tables['codes'], days=days)
+            self.schedule.lengths = arrays[:num_locations].astype('i4')
+            self.schedule.cells[:, :days] = arrays[num_locations:].reshape(num_locations, days)
+        else:
+            rows, lengths, cell_rows, cell_days, values = np.split(arrays, np.cumsum([num_rows, num_rows, num_cells, num_cells]))
+            self.schedule.reserve(days)
+            self.schedule.lengths[rows] = lengths
+            self.schedule.cells[cell_rows, cell_days] = values
+            self.schedule.dirty_rows.update(rows.tolist())
+            self.schedule.touch_rows(rows)
+
+        self.position = position
+
+    def get(self, position):
+        '''
+        Return the schedule of the record at the position, which is reused by the next call (copy it to keep).
+        '''
+
+        if not 0 <= position < len(self.entries):
+            raise IndexError('No record at position {} (0 to {})'.format(position, len(self.entries)-1))
+        else:
+            _, keyframe_offset, _, _, _ = self.entries[position]
+
+        if self.schedule is None or not (self.entries[self.position][1] == keyframe_offset and self.position <= position):
+            start = position
+            while self.entries[start][0] != keyframe_offset:
+                start -= 1
+            self.__apply(start)
+        else:
+            pass
+
+        for next_position in range(self.position+1, position+1):
+            self.__apply(next_position)
+
+        return self.schedule
+
+    @property
+    def current(self):
+        '''
+        The (iteration, stage) of the current record.
+        '''
+
+        return self.entries[self.position][3:]
+
+    def seek(self, iteration):
+        '''
+        Move to the first record of the iteration (or the last record if the iteration is beyond the log) and return its schedule.
+        '''
+
+        for position, entry in enumerate(self.entries):
+            if entry[3] >= iteration:
+                return self.get(position)
+        else:
+            return self.get(len(self.entries)-1)
+
+    def step(self, records=1):
+        '''
+        Move forward (or backward if "records" is negative) and return the schedule, staying within the log.
+        '''
+
+        return self.get(min(max(self.position+records, 0), len(self.entries)-1))
+
+
+class MetricsLog:
+    '''
+    A JSON-lines file of the metrics records of the update (e.g., the stage timers and violation counts), one record per line.
+    The records are written into a temporary file that is renamed on close(), and the instance itself is a hook of ConstraintPropagator.
+
+    Attributes
+    ----------
+    fpath : str
+        | The path of the metrics file.
+
+    Methods
+    -------
+    write
+        | Append a record (i.e., a dictionary of JSON values).
+    close
+        | Close the file and rename it to the path.
+    read
+        | Iterate the records of a metrics file.
+    '''
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.fpath_tmp = RunContext.current().temporary_path(fpath)
+        self.f = open(self.fpath_tmp, 'w', encoding='utf-8')
+
+    def __call__(self, record):
+        self.write(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, record):
+        self.f.write(json.dumps(record))
+        self.f.write('\n')
+
+    def close(self):
+        if self.f.closed:
+            return
+        else:
+            self.f.close()
+            os.replace(self.fpath_tmp, self.fpath)
+
+    @classmethod
+    def read(cls, fpath):
+        with open(fpath, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+                else:
+                    continue
+
+
+class ScheduleSnapshot:
+    '''
+    A version of a Schedule that shares the unchanged location timelines with the schedule.
+    Only the timelines that are changed after the snapshot are saved in the trail of the schedule.
+
+    Attributes
+    ----------
+    schedule : Schedule
+        | The schedule of which version is kept.
+    generation : int
+        | The generation of the schedule when the snapshot was taken.
+    position : int
+        | The length of the trail when the snapshot was taken.
+    num_locations : int
+        | The number of locations when the snapshot was taken.
+    fingerprint : int
+        | The fingerprint of the schedule when the snapshot was taken.
+    '''
+
+    def __init__(self, schedule, generation, position, num_locations):
+        self.schedule = schedule
+        self.generation = generation
+        self.position = position
+        self.num_locations = num_locations
+        self.fingerprint = schedule.fingerprint
+
+
+class ScheduleRow(MutableMapping):
+    '''
+    A write-through view of the local schedule of a location (i.e., {day: activity_code}), which Schedule.__getitem__ returns.
+    The assignments (e.g., schedule[location][day] = activity_code) are written in the schedule, and a copy is a plain dict.
+
+    Attributes
+    ----------
+    schedule : Schedule
+        | The schedule of the location.
+    location : str
+        | The location of the view. It is added to the schedule on the first assignment.
+    '''
+
+    __slots__ = ('schedule', 'location')
+
+    def __init__(self, schedule, location):
+        self.schedule = schedule
+        self.location = location
+
+    def __getitem__(self, day):
+        activity_code = self.schedule.get(self.location, day)
+        if activity_code is None:
+            raise KeyError(day)
+        else:
+            return activity_code
+
+    def __setitem__(self, day, activity_code):
+        self.schedule.set(self.location, day, activity_code)
+
+    def __delitem__(self, day):
+        if self.schedule.get(self.location, day) is None:
+            raise KeyError(day)
+        else:
+            self.schedule.set(self.location, day, None)
+
+    def __iter__(self):
+        return iter(list(self.copy().keys()))
+
+    def __len__(self):
+        return len(self.copy())
+
+    def copy(self):
+        '''
+        Return the local schedule as a dict.
+        '''
+
+        if self.location not in self.schedule:
+            return {}
+        else:
+            local_schedule = self.schedule.local(self.location)
+
+        days = np.flatnonzero(local_schedule != Schedule.EMPTY)
+        return {int(day): self.schedule.codes[local_schedule[day]] for day in days}
+
+    def keys(self):
+        return self.copy().keys()
+
+    def values(self):
+        return self.copy().values()
+
+    def items(self):
+        return self.copy().items()
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class Schedule:
+    '''
+    A schedule of the project backed by an integer matrix of activity ids.
+    It behaves like the former dict of dicts (i.e., schedule[location][day] = activity_code), of which local schedules are write-through views (see ScheduleRow).
+
+    Attributes
+    ----------
+    locations : list
+        | A list of location strings (i.e., "x_y_z") that index the rows of the matrix.
+    codes : list
+        | A list of activity codes that index the activity ids. The id 0 is reserved for the gap ("------").
+    cells : numpy.ndarray
+        | A (locations x days) matrix of activity ids. The empty cells are filled with -1.
+    lengths : numpy.ndarray
+        | The number of days (i.e., the last workday + 1) of each location.
+    fingerprint : int
+        | A Zobrist-style hash of the (location, day, activity) cells, which is updated on every assignment and shift.
+    version : int
+        | A counter of the changes of the schedule.
+    row_versions : numpy.ndarray
+        | The version of the last change of each location, so that the derived indices (e.g., ActivityIndex) refresh only the changed locations.
+
+    Methods
+    -------
+    set
+        | Assign an activity code to a location on a day.
+    local
+        | Return the activity ids of a location.
+    column
+        | Return the activity ids of all locations on a day.
+    get
+        | Return the activity code of a location on a day.
+    shift
+        | Push the workdays of locations from a day by some days in place.
+    insert_gap
+        | Push the workdays of a location from a day by inserting a gap.
+    snapshot
+        | Take a copy-on-write snapshot of the schedule.
+    rollback
+        | Restore the schedule to a snapshot.
+    changed_locations
+        | Return the indices of locations that have been changed after a snapshot.
+    '''
+
+    EMPTY = -1
+    GAP = 0
+    GAP_CODE = '------'
+
+    def __init__(self, locations=None, codes=None, days=0):
+        self.locations = list(locations) if locations is not None else []
+        self.location2idx = {location: idx for idx, location in enumerate(self.locations)}
+
+        self.codes = [self.GAP_CODE]
+        self.code2id = {self.GAP_CODE: self.GAP}
+        for code in (codes or []):
+            self.code_id(code)
+
+        self.cells = np.full((len(self.locations), max(days, 1)), self.EMPTY, dtype='i4')
+        self.lengths = np.zeros(len(self.locations), dtype='i4')
+
+        self.generation = 0
+        self.trail = []
+        self.snapshots = []
+        self.saved_generation = np.full(len(self.locations), -1, dtype='i8')
+
+        self.row_hashes = None
+        self.dirty_rows = set()
+
+        self.version = 0
+        self.row_versions = np.zeros(len(self.locations), dtype='i8')
+
+    @classmethod
+    def from_dict(cls, schedule, codes=None):
+        '''
+        Build a Schedule from a dict of dicts (i.e., schedule[location][day] = activity_code).
+        '''
+
+        obj = cls(locations=schedule.keys(), codes=codes)
+        for location in schedule:
+            obj[location] = schedule[location]
+
+        return obj
+
+    def to_dict(self):
+        schedule = defaultdict(dict)
+        for location in self.locations:
+            schedule[location] = self[location].copy()
+
+        return schedule
+
+    def code_id(self, activity_code):
+        try:
+            return self.code2id[activity_code]
+        except KeyError:
+            self.code2id[activity_code] = len(self.codes)
+            self.codes.append(activity_code)
+            return self.code2id[activity_code]
+
+    def add_location(self, location):
+        if location in self.location2idx:
+            return self.location2idx[location]
+        else:
+            pass
+
+        ## The location tables are shared between copies, so they are replaced rather than modified.
+        self.location2idx = dict(self.location2idx)
+        self.location2idx[location] = len(self.locations)
+        self.locations = self.locations+[location]
+        self.cells = np.vstack((self.cells, np.full((1, self.cells.shape[1]), self.EMPTY, dtype='i4')))
+        self.lengths = np.append(self.lengths, np.int32(0))
+        self.saved_generation = np.append(self.saved_generation, -1)
+        self.row_versions = np.append(self.row_versions, 0)
+        if self.row_hashes is not None:
+            self.row_hashes = np.append(self.row_hashes, np.uint64(0))
+
+        self.touch_rows([len(self.locations)-1])
+        return self.location2idx[location]
+
+    def reserve(self, days):
+        '''
+        Extend the matrix so that it can hold the input number of days.
+        '''
+
+        capacity = self.cells.shape[1]
+        if days <= capacity:
+            return
+        else:
+            pass
+
+        capacity = max(days, capacity*2)
+        extension = np.full((self.cells.shape[0], capacity-self.cells.shape[1]), self.EMPTY, dtype='i4')
+        self.cells = np.hstack((self.cells, extension))
+
+    @property
+    def duration(self):
+        '''
+        The number of days of the longest location.
+        '''
+
+        if len(self.lengths) == 0:
+            return 0
+        else:
+            return int(self.lengths.max())
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __contains__(self, location):
+        return location in self.location2idx
+
+    def keys(self):
+        return self.location2idx.keys()
+
+    def values(self):
+        return [self[location] for location in self.locations]
+
+    def items(self):
+        return [(location, self[location]) for location in self.locations]
+
+    def __getitem__(self, location):
+        '''
+        Return a local schedule of the location as a write-through view (i.e., {day: activity_code}).
+        Like the former defaultdict, an absent location is added on the first assignment.
+        '''
+
+        return ScheduleRow(self, location)
+
+    def __setitem__(self, location, local_schedule):
+        idx = self.add_location(location)
+        length = max(local_schedule.keys())+1 if local_schedule else 0
+        self.reserve(length)
+
+        self.save_rows([idx])
+        self.cells[idx, :] = self.EMPTY
+        for day, activity_code in local_schedule.items():
+            self.cells[idx, day] = self.code_id(activity_code)
+        self.lengths[idx] = length
+        self.dirty_rows.add(idx)
+        self.touch_rows([idx])
+
+    def set(self, location, day, activity_code):
+        '''
+        Assign the activity code to the location on the day, or empty the cell with None.
+        '''
+
+        idx = self.add_location(location)
+        self.reserve(day+1)
+        self.save_rows([idx])
+
+        self.cells[idx, day] = self.EMPTY if activity_code is None else self.code_id(activity_code)
+        filled = np.flatnonzero(self.cells[idx, :max(int(self.lengths[idx]), day+1)] != self.EMPTY)
+        self.lengths[idx] = filled[-1]+1 if len(filled) else 0
+        self.dirty_rows.add(idx)
+        self.touch_rows([idx])
+
+    def local(self, location):
+        '''
+        Return the activity ids of the location as a read-only view of the matrix.
+        '''
+
+        idx = self.location2idx[location]
+        local_schedule = self.cells[idx, :self.lengths[idx]]
+        local_schedule.flags.writeable = False
+        return local_schedule
+
+    def edit(self, location):
+        '''
+        Return the activity ids of the location as a writable view of the matrix.
+        The timeline is saved first if a snapshot needs it.
+        '''
+
+        idx = self.location2idx[location]
+        self.save_rows([idx])
+        self.dirty_rows.add(idx)
+        self.touch_rows([idx])
+        return self.cells[idx, :self.lengths[idx]]
+
+    def column(self, day):
+        '''
+        Return the activity ids of all locations on the day.
+        '''
+
+        if day < self.cells.shape[1]:
+            return self.cells[:, day]
+        else:
+            return np.full(len(self.locations), self.EMPTY, dtype='i4')
+
+    def get(self, location, day):
+        '''
+        Return the activity code of the location on the day, or None for an empty cell.
+        '''
+
+        try:
+            idx = self.location2idx[location]
+        except KeyError:
+            return None
+
+        if 0 <= day < self.lengths[idx] and self.cells[idx, day] != self.EMPTY:
+            return self.codes[self.cells[idx, day]]
+        else:
+            return None
+
+    def shift(self, locations, after, days=1):
+        '''
+        Push the workdays of the locations from the "after" day by the input days in place, and leave gaps on the pushed days.
+        It costs only the tail length of each location, and several locations are pushed in a single call.
+
+        Attributes
+        ----------
+        locations : list
+            | A list of locations (or a single location) to be pushed.
+        after : int
+            | The first day to be pushed.
+        days : int
+            | The number of days to push. (default : 1)
+        '''
+
+        if isinstance(locations, str):
+            locations = [locations]
+        else:
+            pass
+
+        idxs = np.array([self.location2idx[location] for location in locations], dtype='i8')
+        if len(idxs) == 0 or days <= 0:
+            return
+        else:
+            lengths = self.lengths[idxs].astype('i8')
+            self.reserve(int(max(lengths.max(), after))+days)
+
+        self.save_rows(idxs)
+        tails = np.maximum(lengths-after, 0)
+        rows = np.repeat(idxs, tails)
+        cols = np.arange(tails.sum())-np.repeat(np.cumsum(tails)-tails, tails)+after
+        gap_rows = np.repeat(idxs, days)
+        gap_cols = np.tile(np.arange(after, after+days), len(idxs))
+
+        self.update_row_hashes(rows, cols)
+        self.cells[rows, cols+days] = self.cells[rows, cols]
+        self.cells[gap_rows, gap_cols] = self.GAP
+        self.lengths[idxs] = np.maximum(lengths, after)+days
+        self.update_row_hashes(np.concatenate((rows, gap_rows)), np.concatenate((cols+days, gap_cols)))
+        self.touch_rows(idxs)
+
+    def insert_gap(self, location, after):
+        '''
+        Push the workdays of the location from the "after" day by one day and leave a gap on the "after" day.
+        '''
+
+        self.shift([location], after, days=1)
+
+    def copy(self):
+        obj = Schedule.__new__(Schedule)
+        obj.locations = self.locations
+        obj.location2idx = self.location2idx
+        obj.codes = list(self.codes)
+        obj.code2id = dict(self.code2id)
+        obj.cells = self.cells.copy()
+        obj.lengths = self.lengths.copy()
+
+        obj.generation = 0
+        obj.trail = []
+        obj.snapshots = []
+        obj.saved_generation = np.full(len(obj.locations), -1, dtype='i8')
+
+        obj.row_hashes = None if self.row_hashes is None else self.row_hashes.copy()
+        obj.dirty_rows = set(self.dirty_rows)
+
+        obj.version = self.version
+        obj.row_versions = self.row_versions.copy()
+        return obj
+
+    def touch_rows(self, idxs):
+        '''
+        Mark the locations as changed with a new version.
+        '''
+
+        self.version += 1
+        self.row_versions[idxs] = self.version
+
+    @staticmethod
+    def cell_keys(rows, days, activity_ids):
+        '''
+        Return the Zobrist keys of (location, day, activity) cells, mixed with splitmix64.
+        '''
+
+        keys = (np.asarray(rows).astype('u8') << np.uint64(42)) ^ (np.asarray(days).astype('u8') << np.uint64(21)) ^ (np.asarray(activity_ids).astype('i8')+1).astype('u8')
+        keys = keys+np.uint64(0x9E3779B97F4A7C15)
+        keys = (keys ^ (keys >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        keys = (keys ^ (keys >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        return keys ^ (keys >> np.uint64(31))
+
+    def update_row_hashes(self, rows, cols):
+        '''
+        Toggle the keys of the cells in the row hashes. It is called before and after the cells are changed.
+        '''
+
+        if self.row_hashes is None:
+            return
+        else:
+            pass
+
+        activity_ids = self.cells[rows, cols]
+        filled = activity_ids != self.EMPTY
+        np.bitwise_xor.at(self.row_hashes, rows[filled], self.cell_keys(rows[filled], cols[filled], activity_ids[filled]))
+
+    def refresh_rows(self, idxs):
+        for idx in idxs:
+            local_schedule = self.cells[idx, :self.lengths[idx]]
+            days = np.flatnonzero(local_schedule != self.EMPTY)
+            self.row_hashes[idx] = np.bitwise_xor.reduce(self.cell_keys(np.full(len(days), idx), days, local_schedule[days]), initial=np.uint64(0))
+
+    @property
+    def fingerprint(self):
+        '''
+        The fingerprint of the schedule. Only the rows that have been edited since the last call are hashed again.
+        '''
+
+        if self.row_hashes is None:
+            self.row_hashes = np.zeros(len(self.locations), dtype='u8')
+            self.refresh_rows(range(len(self.locations)))
+            self.dirty_rows = set()
+        elif self.dirty_rows:
+            self.refresh_rows(sorted(self.dirty_rows))
+            self.dirty_rows = set()
+        else:
+            pass
+
+        return int(np.bitwise_xor.reduce(self.row_hashes, initial=np.uint64(0)))
+
+    def save_rows(self, idxs):
+        '''
+        Save the timelines of the locations in the trail before they are changed, once per snapshot generation.
+        '''
+
+        if not self.snapshots:
+            return
+        else:
+            pass
+
+        for idx in idxs:
+            if self.saved_generation[idx] != self.generation and idx < self.snapshots[-1].num_locations:
+                self.trail.append((int(idx), self.cells[idx, :self.lengths[idx]].copy()))
+                self.saved_generation[idx] = self.generation
+            else:
+                continue
+
+    def snapshot(self):
+        '''
+        Take a copy-on-write snapshot. It costs O(1), and each timeline is saved only when it is changed afterwards.
+        '''
+
+        self.generation += 1
+        snapshot = ScheduleSnapshot(self, self.generation, len(self.trail), len(self.locations))
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def release(self, snapshot):
+        '''
+        Release a snapshot that is no longer needed. The trail is cleared when no snapshot remains.
+        '''
+
+        if snapshot in self.snapshots:
+            self.snapshots.remove(snapshot)
+        else:
+            pass
+
+        if not self.snapshots:
+            self.trail = []
+        else:
+            pass
+
+    def __saved_rows(self, snapshot):
+        '''
+        Return the oldest saved timeline of each location that has been changed after the snapshot.
+        '''
+
+        saved_rows = {}
+        for idx, local_schedule in reversed(self.trail[snapshot.position:]):
+            if idx < snapshot.num_locations:
+                saved_rows[idx] = local_schedule
+            else:
+                continue
+
+        return saved_rows
+
+    def changed_locations(self, snapshot):
+        '''
+        Return the indices of locations that have been changed after the snapshot, in O(changed locations).
+        '''
+
+        changed = [idx for idx in range(snapshot.num_locations, len(self.locations))]
+        for idx, local_schedule in self.__saved_rows(snapshot).items():
+            if not np.array_equal(local_schedule, self.cells[idx, :self.lengths[idx]]):
+                changed.append(idx)
+            else:
+                continue
+
+        return sorted(changed)
+
+    def rollback(self, snapshot):
+        '''
+        Restore the schedule to the snapshot in O(changed locations). The snapshot remains available.
+        '''
+
+        for idx, local_schedule in self.__saved_rows(snapshot).items():
+            self.cells[idx, :] = self.EMPTY
+            self.cells[idx, :len(local_schedule)] = local_schedule
+            self.lengths[idx] = len(local_schedule)
+            self.dirty_rows.add(idx)
+            self.touch_rows([idx])
+
+        if len(self.locations) > snapshot.num_locations:
+            self.locations = self.locations[:snapshot.num_locations]
+            self.location2idx = {location: idx for idx, location in enumerate(self.locations)}
+            self.cells = self.cells[:snapshot.num_locations].copy()
+            self.lengths = self.lengths[:snapshot.num_locations].copy()
+            self.saved_generation = self.saved_generation[:snapshot.num_locations].copy()
+            self.row_versions = self.row_versions[:snapshot.num_locations].copy()
+            self.row_hashes = None
+            self.version += 1
+        else:
+            pass
+
+        del self.trail[snapshot.position:]
+        self.snapshots = self.snapshots[:self.snapshots.index(snapshot)+1]
+        self.generation += 1
+
+    def materialize(self, snapshot):
+        '''
+        Return the schedule of the snapshot as an independent Schedule.
+        '''
+
+        obj = self.copy()
+        for idx, local_schedule in self.__saved_rows(snapshot).items():
+            obj.cells[idx, :] = self.EMPTY
+            obj.cells[idx, :len(local_schedule)] = local_schedule
+            obj.lengths[idx] = len(local_schedule)
+            obj.dirty_rows.add(idx)
+            obj.touch_rows([idx])
+
+        if len(obj.locations) > snapshot.num_locations:
+            obj.locations = obj.locations[:snapshot.num_locations]
+            obj.location2idx = {location: idx for idx, location in enumerate(obj.locations)}
+            obj.cells = obj.cells[:snapshot.num_locations]
+            obj.lengths = obj.lengths[:snapshot.num_locations]
+            obj.saved_generation = obj.saved_generation[:snapshot.num_locations]
+            obj.row_versions = obj.row_versions[:snapshot.num_locations]
+            obj.row_hashes = None
+            obj.version += 1
+        else:
+            pass
+
+        return obj
+
+    def equals(self, other):
+        '''
+        Compare the locations and the workdays of two schedules.
+        '''
+
+        if set(self.locations) != set(other.locations):
+            return False
+        elif self.codes != other.codes or self.locations != other.locations:
+            return self.to_dict() == other.to_dict()
+        else:
+            pass
+
+        if not np.array_equal(self.lengths, other.lengths):
+            return False
+        else:
+            days = self.duration
+            return np.array_equal(self.cells[:, :days], other.cells[:, :days])
+
+
+class ActivityIndex:
+    '''
+    An inverted index of a Schedule from activity codes to their (location, day) cells.
+    It is refreshed on each query, and only the locations that have been changed since the last query (see Schedule.row_versions) are indexed again.
+
+    Attributes
+    ----------
+    schedule : Schedule
+        | The indexed schedule.
+    version : int
+        | The version of the schedule when the index was refreshed.
+    counts : numpy.ndarray
+        | The number of cells of each activity id.
+    day_counts : numpy.ndarray
+        | A (days x activity ids) matrix of the number of locations of each activity on each day.
+    cells : dict
+        | A set of (location index, day) cells of each activity id.
+
+    Methods
+    -------
+    search
+        | Return the (location, day) cells of an activity.
+    count
+        | Return the number of cells of an activity.
+    start
+        | Return the first workday of an activity.
+    finish
+        | Return the last workday of an activity.
+    span
+        | Return the first and the last workdays of several activities.
+    major_span
+        | Return the first and the last workdays of the activities of a major activity (i.e., the prefix of the codes).
+    timeline
+        | Return the number of locations of an activity on each day.
+    '''
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.rebuild()
+
+    def __getstate__(self):
+        '''
+        The index is not pickled but rebuilt on the first query.
+        '''
+
+        return {'schedule': self.schedule}
+
+    def __setstate__(self, state):
+        self.schedule = state['schedule']
+        self.rows = None
+
+    def rebuild(self):
+        schedule = self.schedule
+        self.version = schedule.version
+        self.rows = [schedule.cells[idx, :length].copy() for idx, length in enumerate(schedule.lengths.tolist())]
+        self.counts = np.zeros(len(schedule.codes), dtype='i8')
+        self.day_counts = np.zeros((max(schedule.duration, 1), len(schedule.codes)), dtype='i4')
+        self.cells = defaultdict(set)
+        self.bounds = {}
+
+        rows, days = np.nonzero(schedule.cells[:, :schedule.duration] > Schedule.GAP)
+        within = days < schedule.lengths[rows]
+        rows, days = rows[within], days[within]
+        self.__update(rows, days, schedule.cells[rows, days], 1)
+
+    def refresh(self):
+        '''
+        Index again the locations that have been changed (or removed by Schedule.rollback) since the last refresh.
+        '''
+
+        schedule = self.schedule
+        if self.rows is None:
+            self.rebuild()
+            return
+        elif schedule.version == self.version:
+            return
+        else:
+            pass
+
+        idxs = np.flatnonzero(schedule.row_versions > self.version).tolist()+list(range(len(schedule.locations), len(self.rows)))
+        changes = {-1: ([], [], []), 1: ([], [], [])}
+        for idx in idxs:
+            before = self.rows[idx] if idx < len(self.rows) else np.zeros(0, dtype='i4')
+            after = schedule.cells[idx, :schedule.lengths[idx]].copy() if idx < len(schedule.locations) else np.zeros(0, dtype='i4')
+
+            length = max(len(before), len(after))
+            before = np.pad(before, (0, length-len(before)), constant_values=Schedule.EMPTY)
+            after_padded = np.pad(after, (0, length-len(after)), constant_values=Schedule.EMPTY)
+            days = np.flatnonzero(before != after_padded)
+            for sign, local_schedule in ((-1, before), (1, after_padded)):
+                changes[sign][0].append(np.full(len(days), idx))
+                changes[sign][1].append(days)
+                changes[sign][2].append(local_schedule[days])
+
+            if idx < len(self.rows):
+                self.rows[idx] = after
+            else:
+                self.rows.append(after)
+
+        del self.rows[len(schedule.locations):]
+        if idxs:
+            for sign, (rows, days, activity_ids) in changes.items():
+                self.__update(np.concatenate(rows), np.concatenate(days), np.concatenate(activity_ids), sign)
+        else:
+            pass
+
+        self.version = schedule.version
+
+    def __update(self, rows, days, activity_ids, sign):
+        filled = activity_ids > Schedule.GAP
+        rows, days, activity_ids = rows[filled], days[filled], activity_ids[filled]
+        if len(activity_ids) == 0:
+            return
+        else:
+            pass
+
+        num_codes = max(len(self.schedule.codes), int(activity_ids.max())+1)
+        if num_codes > self.counts.shape[0]:
+            self.counts = np.append(self.counts, np.zeros(num_codes-self.counts.shape[0], dtype='i8'))
+            self.day_counts = np.hstack((self.day_counts, np.zeros((self.day_counts.shape[0], num_codes-self.day_counts.shape[1]), dtype='i4')))
+        else:
+            pass
+
+        num_days = int(days.max())+1
+        if num_days > self.day_counts.shape[0]:
+            capacity = max(num_days, self.day_counts.shape[0]*2)
+            self.day_counts = np.vstack((self.day_counts, np.zeros((capacity-self.day_counts.shape[0], self.day_counts.shape[1]), dtype='i4')))
+        else:
+            pass
 
-    activity_table = os.path.sep.join((fdir_template, 'activity_table.xlsx'))
-    activity_order = os.path.sep.join((fdir_template, 'activity_order.xlsx'))
-    activity_pre_dist = os.path.sep.join((fdir_template, 'activity_pre_dist.xlsx')) #choi 추가
+        np.add.at(self.counts, activity_ids, sign)
+        np.add.at(self.day_counts, (days, activity_ids), sign)
+        for idx, day, activity_id in zip(rows.tolist(), days.tolist(), activity_ids.tolist()):
+            if sign > 0:
+                self.cells[activity_id].add((idx, day))
+            else:
+                self.cells[activity_id].discard((idx, day))
 
-    navisystem = os.path.sep.join((fdir_component, 'navisystem.pk'))
+        for activity_id in np.unique(activity_ids).tolist():
+            self.bounds.pop(activity_id, None)
 
-    def case(self, case_num):
-        return os.path.sep.join((self.fdir_data, 'case_{}.xlsx'.format(case_num)))
+    def __activity_id(self, activity_code):
+        self.refresh()
+        activity_id = self.schedule.code2id.get(activity_code)
+        if activity_id is None or activity_id == Schedule.GAP or activity_id >= self.counts.shape[0]:
+            return None
+        else:
+            return activity_id
 
-    def proj(self, case_num):
-        return os.path.sep.join((self.fdir_proj, 'proj_{}.pk'.format(case_num)))
+    def __bounds(self, activity_id):
+        '''
+        Return the first and the last workdays of the activity, which are cached until the activity is changed.
+        '''
 
-    def schedule(self, case_num, note):
-        return os.path.sep.join((self.fdir_schedule, 'schedule_N-{}_C-{}.xlsx'.format(case_num, note)))
+        try:
+            return self.bounds[activity_id]
+        except KeyError:
+            pass
 
+        days = np.flatnonzero(self.day_counts[:, activity_id])
+        self.bounds[activity_id] = (int(days[0]), int(days[-1])) if len(days) else (None, None)
+        return self.bounds[activity_id]
 
-class NaviIO:
-    def import_activity_book(self, **kwargs):
-        fdir = kwargs.get('fdir', NaviPath().fdir_component)
-        fname = kwargs.get('fname', 'activity_book.pk')
-        fpath = kwargs.get('fpath', '')
+    def search(self, activity_code):
+        '''
+        Return the (location, day) cells of the activity in order of the days.
+        '''
 
-        if not fpath:
-            fpath = os.path.sep.join((fdir, fname))
+        activity_id = self.__activity_id(activity_code)
+        if activity_id is None:
+            return []
+        else:
+            return [(self.schedule.locations[idx], day) for idx, day in sorted(self.cells[activity_id], key=lambda x:(x[1], x[0]))]
+
+    def count(self, activity_code):
+        activity_id = self.__activity_id(activity_code)
+        return 0 if activity_id is None else int(self.counts[activity_id])
+
+    def start(self, activity_code):
+        activity_id = self.__activity_id(activity_code)
+        return None if activity_id is None else self.__bounds(activity_id)[0]
+
+    def finish(self, activity_code):
+        activity_id = self.__activity_id(activity_code)
+        return None if activity_id is None else self.__bounds(activity_id)[1]
+
+    def span(self, activity_codes):
+        '''
+        Return the first and the last workdays of the activities, or (None, None) if none of them is scheduled.
+        '''
+
+        bounds = []
+        for activity_code in activity_codes:
+            activity_id = self.__activity_id(activity_code)
+            if activity_id is not None and self.counts[activity_id] > 0:
+                bounds.append(self.__bounds(activity_id))
+            else:
+                continue
+
+        if bounds:
+            return min(start for start, _ in bounds), max(finish for _, finish in bounds)
+        else:
+            return None, None
+
+    def major_span(self, major_code):
+        '''
+        Return the first and the last workdays of the activities of which code starts with the major code (e.g., "T100" for "T10010").
+        '''
+
+        return self.span([activity_code for activity_code in self.schedule.codes if activity_code.startswith(major_code)])
+
+    def timeline(self, activity_code):
+        '''
+        Return the number of locations of the activity on each day.
+        '''
+
+        activity_id = self.__activity_id(activity_code)
+        timeline = np.zeros(self.schedule.duration, dtype='i4')
+        if activity_id is not None:
+            days = min(len(timeline), self.day_counts.shape[0])
+            timeline[:days] = self.day_counts[:days, activity_id]
+        else:
+            pass
+
+        return timeline
+
+
+class DurationTracker:
+    '''
+    The last workday of a Schedule (i.e., Project.duration_expected), maintained with a max-heap of the last workday of each location.
+    Only the locations that have been changed since the last query (see Schedule.row_versions) are pushed again, and the outdated entries are dropped when they reach the top.
+
+    Attributes
+    ----------
+    schedule : Schedule
+        | The tracked schedule.
+    version : int
+        | The version of the schedule when the tracker was refreshed.
+    finish_days : numpy.ndarray
+        | The last workday of each location (-1 for an empty location).
+    heap : list
+        | A heap of (-last workday, location index), which may include outdated entries.
+    '''
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.rebuild()
+
+    def rebuild(self):
+        self.version = self.schedule.version
+        self.finish_days = self.schedule.lengths.astype('i8')-1
+        self.heap = [(-day, idx) for idx, day in enumerate(self.finish_days.tolist()) if day >= 0]
+        heapq.heapify(self.heap)
+
+    def refresh(self):
+        schedule = self.schedule
+        if schedule.version == self.version:
+            return
+        elif len(schedule.locations) < len(self.finish_days) or len(self.heap) > 2*len(schedule.locations)+64:
+            self.rebuild()
+            return
+        else:
+            pass
+
+        num_added = len(schedule.locations)-len(self.finish_days)
+        self.finish_days = np.append(self.finish_days, np.full(num_added, -1, dtype='i8'))
+        for idx in np.flatnonzero(schedule.row_versions > self.version).tolist():
+            day = int(schedule.lengths[idx])-1
+            self.finish_days[idx] = day
+            if day >= 0:
+                heapq.heappush(self.heap, (-day, idx))
+            else:
+                continue
+
+        self.version = schedule.version
+
+    @property
+    def last(self):
+        '''
+        The last workday of the schedule (0 for an empty schedule).
+        '''
+
+        self.refresh()
+        while self.heap and self.finish_days[self.heap[0][1]] != -self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+        if self.heap:
+            return -self.heap[0][0]
+        else:
+            return 0
+
+
+class PrecedenceOracle:
+    '''
+    A dense matrix of the order relations between activities, built once from the activity book.
+    Each entry holds the SUCCESSOR and PREDECESSOR flags, so that an order check is a single lookup.
+
+    Attributes
+    ----------
+    codes : list
+        | A list of activity codes that index the matrix.
+    code2idx : dict
+        | A dictionary of which keys are activity codes and values are their indices.
+    relation : numpy.ndarray
+        | A (activities+1 x activities+1) matrix of relation flags. The last row and column stand for unknown activities (e.g., gaps).
+
+    Methods
+    -------
+    order
+        | Return the relation flags of an activity pair.
+    is_predecessor
+        | Check whether an activity should be done before another activity.
+    index
+        | Return an array that maps the activity ids of a schedule to the indices of the oracle.
+    classify
+        | Return the relation flags between an activity and many activities of a schedule (e.g., a day column or a local schedule).
+    '''
+
+    UNRELATED = 0
+    SUCCESSOR = 1
+    PREDECESSOR = 2
+
+    def __init__(self, activity_book):
+        self.codes = list(activity_book.keys())
+        self.code2idx = {code: idx for idx, code in enumerate(self.codes)}
+
+        self.relation = np.zeros((len(self.codes)+1, len(self.codes)+1), dtype='i1')
+        for idx, activity_code in enumerate(self.codes):
+            activity = activity_book[activity_code]
+            successors = [self.code2idx[code] for code in activity.successor if code in self.code2idx]
+            predecessors = [self.code2idx[code] for code in activity.predecessor if code in self.code2idx]
+            self.relation[idx, successors] |= self.SUCCESSOR
+            self.relation[idx, predecessors] |= self.PREDECESSOR
+
+        self.__index_codes = None
+        self.__index = None
+
+    @classmethod
+    def from_relation(cls, codes, relation):
+        '''
+        Build a PrecedenceOracle from a relation matrix (e.g., a compiled activity book) without copying it.
+        '''
 
+        obj = cls.__new__(cls)
+        obj.codes = list(codes)
+        obj.code2idx = {code: idx for idx, code in enumerate(obj.codes)}
+        obj.relation = relation
+        obj.__index_codes = None
+        obj.__index = None
+        return obj
+
+    def order(self, activity_code1, activity_code2):
+        '''
+        Return the relation flags of the activity_code2 from the viewpoint of the activity_code1.
+        '''
+
+        return int(self.relation[self.code2idx.get(activity_code1, -1), self.code2idx.get(activity_code2, -1)])
+
+    def is_predecessor(self, activity_code1, activity_code2):
+        '''
+        Return True if the activity_code2 should be done before the activity_code1.
+        '''
+
+        return bool(self.order(activity_code1, activity_code2) & self.PREDECESSOR)
+
+    def index(self, schedule):
+        '''
+        Return an array that maps the activity ids of the schedule to the indices of the oracle.
+        The empty cell (-1) and unknown activities are mapped to the last index.
+        '''
+
+        if self.__index_codes is schedule.codes and len(self.__index) == len(schedule.codes)+1:
+            return self.__index
+        else:
+            pass
+
+        self.__index_codes = schedule.codes
+        self.__index = np.array([self.code2idx.get(code, -1) for code in schedule.codes]+[-1], dtype='i4')
+        return self.__index
+
+    def classify(self, schedule, activity_id, activity_ids):
+        '''
+        Return the relation flags between an activity and many activities in a single lookup.
+
+        Attributes
+        ----------
+        schedule : Schedule
+            | The schedule of which activity ids are used.
+        activity_id : int
+            | The activity id of the current activity.
+        activity_ids : numpy.ndarray
+            | The activity ids to be classified (e.g., schedule.column(day) or schedule.local(location)).
+        '''
+
+        index = self.index(schedule)
+        return self.relation[index[activity_id], index[activity_ids]]
+
+
+class CompiledActivityBook(Mapping):
+    '''
+    A compiled activity book stored in a content-addressed cache (i.e., "component/cache/{key}/"), keyed by a hash of the template files.
+    The id-indexed arrays are saved as ".npy" files and loaded with memory mapping, so that worker processes share them without copying.
+    It behaves like the activity book (i.e., activity_book[activity_code] = Activity), of which Activity objects are built on demand.
+
+    Attributes
+    ----------
+    key : str
+        | The hash of the cache version and the template files.
+    fdir : str
+        | The cache directory of the compiled activity book.
+    codes : list
+        | A list of activity codes that index the arrays.
+    code2idx : dict
+        | A dictionary of which keys are activity codes and values are their indices.
+    productivity : numpy.ndarray
+        | The productivity of each activity (NaN if it is not defined).
+    pre_dist : numpy.ndarray
+        | The pre_dist of each activity (NaN if it is not defined).
+    precedence : numpy.ndarray
+        | The relation matrix of the PrecedenceOracle.
+    key_errors : list
+        | The activity codes of the ActivityOrder template that are absent in the activity book.
+    cycles : list
+        | The cycles of the activity network (see ActivityNetwork.cycles).
+    activity_class : type
+        | The class of the Activity objects built on demand, which is set by the object module (i.e., object.Activity).
+
+    Methods
+    -------
+    template_key
+        | Return the cache key of the template files.
+    exists
+        | Check whether the cache directory of a key has been built.
+    build
+        | Compile an activity book into the cache directory of a key.
+    load
+        | Load the compiled activity book of a key.
+    precedence_oracle
+        | Return a PrecedenceOracle that shares the precedence matrix.
+    '''
+
+    VERSION = 2
+    FILES = ('meta.json', 'productivity.npy', 'pre_dist.npy', 'precedence.npy', 'activity_book.pk', 'activity_network.pk')
+
+    activity_class = None
+
+    def __init__(self, fdir, mmap_mode='r', activity_class=None):
+        self.fdir = fdir
+        with open(os.path.sep.join((fdir, 'meta.json')), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        if meta['version'] != self.VERSION:
+            raise ValueError('Cache version {} is not supported (expected {}): {}'.format(meta['version'], self.VERSION, fdir))
+        else:
+            self.key = meta['key']
+            self.activities = meta['activities']
+            self.key_errors = meta['key_errors']
+            self.cycles = meta['cycles']
+
+        if activity_class is not None:
+            self.activity_class = activity_class
+        else:
+            pass
+
+        self.codes = [activity['code'] for activity in self.activities]
+        self.code2idx = {code: idx for idx, code in enumerate(self.codes)}
+        self.productivity = np.load(os.path.sep.join((fdir, 'productivity.npy')), mmap_mode=mmap_mode)
+        self.pre_dist = np.load(os.path.sep.join((fdir, 'pre_dist.npy')), mmap_mode=mmap_mode)
+        self.precedence = np.load(os.path.sep.join((fdir, 'precedence.npy')), mmap_mode=mmap_mode)
+
+        self.__activities = {}
+        self.__oracle = None
+
+    def __getitem__(self, activity_code):
         try:
+            return self.__activities[activity_code]
+        except KeyError:
+            idx = self.code2idx[activity_code]
+
+        parameters = dict(self.activities[idx])
+        for attribute in ('productivity', 'pre_dist'):
+            if parameters[attribute] is None:
+                parameters[attribute] = float('nan')
+            else:
+                pass
+
+        activity = self.activity_class(parameters=parameters)
+        activity.id = idx
+        activity.predecessor = set(self.codes[i] for i in np.flatnonzero(self.precedence[idx, :-1] & PrecedenceOracle.PREDECESSOR))
+        activity.successor = set(self.codes[i] for i in np.flatnonzero(self.precedence[idx, :-1] & PrecedenceOracle.SUCCESSOR))
+        self.__activities[activity_code] = activity
+        return activity
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, activity_code):
+        return activity_code in self.code2idx
+
+    @classmethod
+    def template_key(cls, fpaths):
+        hasher = hashlib.sha256('navi-activity-book-v{}'.format(cls.VERSION).encode('utf-8'))
+        for fpath in fpaths:
             with open(fpath, 'rb') as f:
-                activity_book = pk.load(f)
-        except FileNotFoundError:
-            print('Error: You should run "init.py" first to build "activity_book.pk"')
+                hasher.update(hashlib.sha256(f.read()).digest())
 
-        return activity_book
+        return hasher.hexdigest()
 
-    def schedule2xlsx(self, schedule, fname, verbose=True):
+    @classmethod
+    def exists(cls, key, fdir_cache=None):
+        fdir = os.path.sep.join((fdir_cache or NaviPath().fdir_cache, key))
+        return all(os.path.isfile(os.path.sep.join((fdir, fname))) for fname in cls.FILES)
+
+    @classmethod
+    def build(cls, activity_book, activity_network, key, key_errors=(), fdir_cache=None):
         '''
-        Convert the schedule into a DataFrame format.
+        Write the compiled activity book into a temporary directory, which is renamed to the cache directory when completed.
+        The key errors and the cycles of the activity order are kept in "meta.json", so that they are reported again when the cache is restored.
         '''
 
-        schedule_dict = defaultdict(dict)
-        for location in schedule:
-            for day, activity_code in schedule[location].items():
-                schedule_dict[day][location] = activity_code
+        fdir_cache = fdir_cache or NaviPath().fdir_cache
+        fdir = os.path.sep.join((fdir_cache, key))
 
-        schedule_df = pd.DataFrame(schedule_dict)
-        schedule_df = schedule_df.reindex(sorted(schedule_df.columns), axis=1)
-        schedule_df = schedule_df.sort_index()
+        def to_value(value):
+            try:
+                value = value.item()
+            except AttributeError:
+                pass
 
-        os.makedirs(NaviPath().fdir_schedule, exist_ok=True)
-        schedule_df.to_excel(os.path.sep.join((NaviPath().fdir_schedule, fname)), na_rep='', header=True, index=True)
+            if isinstance(value, float) and np.isnan(value):
+                return None
+            else:
+                return value
+
+        def to_float(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return np.nan
+
+        codes = list(activity_book.keys())
+        activities = []
+        for activity_code in codes:
+            activity = activity_book[activity_code]
+            activities.append({attribute: to_value(getattr(activity, attribute)) for attribute in ('code', 'category', 'major', 'minor', 'productivity', 'pre_dist')})
+
+        os.makedirs(fdir_cache, exist_ok=True)
+        fdir_tmp = tempfile.mkdtemp(prefix='.{}-'.format(key[:8]), dir=fdir_cache)
+        with open(os.path.sep.join((fdir_tmp, 'meta.json')), 'w', encoding='utf-8') as f:
+            json.dump({'version': cls.VERSION,
+                       'key': key,
+                       'activities': activities,
+                       'key_errors': [to_value(activity_code) for activity_code in key_errors],
+                       'cycles': [list(cycle) for cycle in activity_network.cycles]}, f, ensure_ascii=False)
+
+        np.save(os.path.sep.join((fdir_tmp, 'productivity.npy')), np.array([to_float(activity_book[code].productivity) for code in codes], dtype='f8'))
+        np.save(os.path.sep.join((fdir_tmp, 'pre_dist.npy')), np.array([to_float(activity_book[code].pre_dist) for code in codes], dtype='f8'))
+        np.save(os.path.sep.join((fdir_tmp, 'precedence.npy')), PrecedenceOracle(activity_book).relation)
+        with open(os.path.sep.join((fdir_tmp, 'activity_book.pk')), 'wb') as f:
+            pk.dump(activity_book, f)
+        with open(os.path.sep.join((fdir_tmp, 'activity_network.pk')), 'wb') as f:
+            pk.dump(activity_network, f)
 
-        if verbose:
-            print('Save Schedule')
-            print('  | fdir : {}'.format(NaviPath().fdir_schedule))
-            print('  | fname: {}'.format(fname))
+        try:
+            os.replace(fdir_tmp, fdir)
+        except OSError:
+            ## Another process has built the same key.
+            shutil.rmtree(fdir_tmp, ignore_errors=True)
 
-    def xlsx2schedule(self, activity_book, **kwargs):
-        fpath = kwargs.get('fpath', '')
-        fname = kwargs.get('fname', '')
+        return cls.load(key, fdir_cache=fdir_cache)
 
-        if not fpath:
-            fpath = os.path.sep.join((NaviPath().fdir_schedule, fname))
+    @classmethod
+    def load(cls, key, fdir_cache=None, mmap_mode='r', activity_class=None):
+        return cls(os.path.sep.join((fdir_cache or NaviPath().fdir_cache, key)), mmap_mode=mmap_mode, activity_class=activity_class)
 
-        schedule_df = pd.read_excel(fpath)
-        schedule = defaultdict(dict)
-        for row in schedule_df.iterrows():
-            location = row[1]['Unnamed: 0']
-            schedule[location] = {}
-            for day, activity_code in row[1].items():
-                if activity_code in activity_book.keys():
-                    schedule[location][day] = activity_code
+    def precedence_oracle(self):
+        if self.__oracle is None:
+            self.__oracle = PrecedenceOracle.from_relation(self.codes, self.precedence)
+        else:
+            pass
+
+        return self.__oracle
+
+
+class LocationArray:
+    '''
+    An array of the 3-dimensional integer locations (i.e., Grid.location_3d) of a project with batched distance kernels,
+    which replace the distances of location pairs one by one.
+    The coordinates are 64-bit integers, so the distances do not overflow on large sites.
+
+    Attributes
+    ----------
+    points : numpy.ndarray
+        | A (locations x 3) array of the locations.
+
+    Methods
+    -------
+    kernel
+        | Return the distances of coordinate differences for a metric (i.e., 'euclidean', 'sqeuclidean', 'chebyshev', or 'manhattan').
+    distance
+        | Return the distances from a point to the locations (one-to-many).
+    distance_matrix
+        | Return the distances between two sets of the locations (many-to-many).
+    distance_blocks
+        | Yield the distance matrix in blocks of rows, so that the whole matrix is never in memory.
+    within
+        | Return the indices of the locations within a radius from a point.
+    pairs_within
+        | Return all (location, location) index pairs within a radius.
+    '''
+
+    METRICS = ('euclidean', 'sqeuclidean', 'chebyshev', 'manhattan')
+
+    def __init__(self, locations_3d):
+        self.points = np.array(locations_3d, dtype='i8').reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.points)
+
+    @classmethod
+    def from_locations(cls, locations):
+        '''
+        Build a LocationArray from location strings (i.e., "x_y_z").
+        '''
+
+        return cls([[int(value) for value in location.split('_')] for location in locations])
+
+    @classmethod
+    def from_grids(cls, grids):
+        return cls([grid.location_3d for grid in grids])
+
+    @staticmethod
+    def kernel(differences, metric='euclidean'):
+        '''
+        The last axis of "differences" holds the coordinate differences.
+        '''
+
+        differences = np.asarray(differences, dtype='i8')
+        if metric == 'euclidean':
+            return np.sqrt((differences**2).sum(axis=-1))
+        elif metric == 'sqeuclidean':
+            return (differences**2).sum(axis=-1)
+        elif metric == 'chebyshev':
+            return np.abs(differences).max(axis=-1)
+        elif metric == 'manhattan':
+            return np.abs(differences).sum(axis=-1)
+        else:
+            raise ValueError('Unknown metric: {} (available: {})'.format(metric, ', '.join(LocationArray.METRICS)))
+
+    def __select(self, idxs):
+        if idxs is None:
+            return self.points
+        else:
+            return self.points[np.asarray(idxs, dtype='i8')]
+
+    def distance(self, point, idxs=None, metric='euclidean'):
+        return self.kernel(self.__select(idxs)-np.asarray(point, dtype='i8'), metric)
+
+    def distance_matrix(self, sources=None, targets=None, metric='euclidean'):
+        return self.kernel(self.__select(sources)[:, None, :]-self.__select(targets)[None, :, :], metric)
+
+    def distance_blocks(self, sources=None, targets=None, metric='euclidean', block_size=1024):
+        '''
+        Yield (the position of the first row, the block of rows) of the distance matrix between the sources and the targets.
+        '''
+
+        source_points = self.__select(sources)
+        target_points = self.__select(targets)
+        for start in range(0, len(source_points), block_size):
+            yield start, self.kernel(source_points[start:start+block_size, None, :]-target_points[None, :, :], metric)
+
+    def within(self, point, radius, idxs=None, metric='euclidean'):
+        '''
+        Return the indices of the locations (or of "idxs") of which distance from the point is not larger than the radius.
+        '''
+
+        candidates = np.arange(len(self.points)) if idxs is None else np.asarray(idxs, dtype='i8')
+        return candidates[self.distance(point, idxs=candidates, metric=metric) <= radius]
+
+    def pairs_within(self, radius, metric='chebyshev', axes=(0, 1, 2)):
+        '''
+        Return the (source, target) index pairs of different locations within the radius, measured on the axes (e.g., (0, 1) for x and y).
+        The coordinates of the other axes should be the same (e.g., the same floor).
+        Since the locations are integers, the targets are looked up by the offsets within the radius over the sorted keys of the locations, not by comparing every pair.
+        '''
+
+        if len(self.points) == 0:
+            return np.array([], dtype='i8'), np.array([], dtype='i8')
+        else:
+            reach = int(np.floor(radius))
+
+        padding = np.array([reach if axis in axes else 0 for axis in range(3)], dtype='i8')
+        lower = self.points.min(axis=0)-padding
+        extents = self.points.max(axis=0)+padding-lower+1
+        strides = np.array([1, extents[0], extents[0]*extents[1]], dtype='i8')
+        keys = (self.points-lower) @ strides
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+
+        ranges = [range(-reach, reach+1) if axis in axes else range(0, 1) for axis in range(3)]
+        offsets = np.array(np.meshgrid(*ranges, indexing='ij'), dtype='i8').reshape(3, -1).T
+        offsets = offsets[(offsets != 0).any(axis=1)]
+        if metric == 'euclidean':
+            offsets = offsets[self.kernel(offsets, 'sqeuclidean') <= radius**2]
+        else:
+            offsets = offsets[self.kernel(offsets, metric) <= radius]
+
+        sources, targets = [np.array([], dtype='i8')], [np.array([], dtype='i8')]
+        for offset in offsets:
+            candidates = keys+offset @ strides
+            positions = np.minimum(np.searchsorted(sorted_keys, candidates), len(sorted_keys)-1)
+            found = sorted_keys[positions] == candidates
+            sources.append(np.flatnonzero(found))
+            targets.append(order[positions[found]])
+
+        return np.concatenate(sources), np.concatenate(targets)
+
+
+class NeighbourhoodIndex:
+    '''
+    A sparse adjacency of the influence locations for each distinct pre_dist value, built once per project.
+    A location is influenced by the current location if it is on the same floor (z) within the pre_dist in both x and y,
+    excluding the current location and the x (or y) that is not larger than both the current one and zero.
+
+    Attributes
+    ----------
+    location_array : LocationArray
+        | The locations of grids, of which pairs within the pre_dist are found.
+    locations_3d : numpy.ndarray
+        | A (locations x 3) array of the 3-dimensional locations of grids.
+    pre_dists : list
+        | A list of the distinct pre_dist values.
+    indptr : dict
+        | A dictionary of which keys are pre_dist values and values are the row pointers of the adjacency (CSR).
+    indices : dict
+        | A dictionary of which keys are pre_dist values and values are the influence location indices of the adjacency (CSR).
+
+    Methods
+    -------
+    neighbours
+        | Return the influence location indices of a location.
+    reverse_neighbours
+        | Return the location indices of which influence locations include a location.
+    pairs
+        | Return all (location, influence location) index pairs for a pre_dist value.
+    gather
+        | Return the (position, influence location) pairs of several locations for a pre_dist value.
+    '''
+
+    def __init__(self, locations_3d, pre_dists):
+        self.location_array = LocationArray(locations_3d)
+        self.locations_3d = self.location_array.points
+        self.pre_dists = sorted(set([int(pre_dist) for pre_dist in pre_dists if pre_dist >= 0]))
+
+        self.indptr = {}
+        self.indices = {}
+        self.reverse_indptr = {}
+        self.reverse_indices = {}
+        for pre_dist in self.pre_dists:
+            sources, targets = self.__find_pairs(pre_dist)
+            self.indptr[pre_dist], self.indices[pre_dist] = self.__compress(sources, targets)
+            self.reverse_indptr[pre_dist], self.reverse_indices[pre_dist] = self.__compress(targets, sources)
+
+    @classmethod
+    def from_locations(cls, locations, pre_dists):
+        '''
+        Build a NeighbourhoodIndex from location strings (i.e., "x_y_z").
+        '''
+
+        return cls([[int(l) for l in location.split('_')] for location in locations], pre_dists)
+
+    @classmethod
+    def from_grids(cls, grids, pre_dists):
+        return cls([grid.location_3d for grid in grids], pre_dists)
+
+    def __find_pairs(self, pre_dist):
+        sources, targets = self.location_array.pairs_within(pre_dist, metric='chebyshev', axes=(0, 1))
+        x, y, _ = self.locations_3d[sources].T
+        target_x, target_y, _ = self.locations_3d[targets].T
+        valid = ((target_x > x) | (target_x > 0)) & ((target_y > y) | (target_y > 0))
+        return sources[valid], targets[valid]
+
+    def __compress(self, sources, targets):
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(len(self.locations_3d)+1, dtype='i8')
+        np.add.at(indptr, sources+1, 1)
+        return np.cumsum(indptr), targets[order]
+
+    def neighbours(self, idx, pre_dist):
+        try:
+            indptr = self.indptr[pre_dist]
+        except KeyError:
+            return np.array([], dtype='i8')
+
+        return self.indices[pre_dist][indptr[idx]:indptr[idx+1]]
+
+    def reverse_neighbours(self, idx, pre_dist):
+        try:
+            indptr = self.reverse_indptr[pre_dist]
+        except KeyError:
+            return np.array([], dtype='i8')
+
+        return self.reverse_indices[pre_dist][indptr[idx]:indptr[idx+1]]
+
+    def pairs(self, pre_dist):
+        try:
+            indptr = self.indptr[pre_dist]
+        except KeyError:
+            return np.array([], dtype='i8'), np.array([], dtype='i8')
+
+        return np.repeat(np.arange(len(self.locations_3d)), np.diff(indptr)), self.indices[pre_dist]
+
+    def gather(self, idxs, pre_dist):
+        '''
+        Return the positions in "idxs" and the influence location indices, which are paired in order.
+        '''
+
+        try:
+            indptr = self.indptr[pre_dist]
+        except KeyError:
+            return np.array([], dtype='i8'), np.array([], dtype='i8')
+
+        starts = indptr[idxs]
+        counts = indptr[np.asarray(idxs)+1]-starts
+        positions = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)
+        return positions, self.indices[pre_dist][np.repeat(starts, counts)+offsets]
+
+
+class VoxelGrid:
+    '''
+    A voxel grid of 3-dimensional integer locations (i.e., Grid.location_3d), in which each voxel holds the indices of the remaining locations at it.
+    The nearest remaining locations are found in boxes around a point that double in size, without comparing every location.
+
+    Attributes
+    ----------
+    points : numpy.ndarray
+        | A (points x 3) array of the locations, which may include duplicates.
+    origin : numpy.ndarray
+        | The smallest coordinates of the locations, i.e., the location of the first voxel.
+    slots : numpy.ndarray
+        | A 3-dimensional array of which values are the id of each occupied voxel (-1 for none).
+    members : list
+        | A list of the indices of the remaining locations in each occupied voxel (i.e., members[slot]).
+    remaining : int
+        | The number of remaining locations.
+
+    Methods
+    -------
+    remove
+        | Remove a location from the voxel grid.
+    nearest
+        | Return the indices of the remaining locations that are nearest to a point, and the squared distance.
+    '''
+
+    def __init__(self, points):
+        self.points = np.array(points, dtype='i8').reshape(-1, 3)
+        if len(self.points) > 0:
+            self.origin = self.points.min(axis=0)
+            voxels, slots = np.unique(self.points-self.origin, axis=0, return_inverse=True)
+            slots = slots.reshape(-1)
+            self.slots = np.full(tuple(self.points.max(axis=0)-self.origin+1), -1, dtype='i4')
+            self.slots[tuple(voxels.T)] = np.arange(len(voxels))
+
+            self.members = [[] for _ in range(len(voxels))]
+            for idx, slot in enumerate(slots.tolist()):
+                self.members[slot].append(idx)
+        else:
+            self.origin = np.zeros(3, dtype='i8')
+            self.slots = np.full((0, 0, 0), -1, dtype='i4')
+            self.members = []
+
+        self.remaining = len(self.points)
+
+    def remove(self, idx):
+        x, y, z = self.points[idx]-self.origin
+        slot = self.slots[x, y, z]
+        if slot >= 0 and idx in self.members[slot]:
+            self.members[slot].remove(idx)
+            self.remaining -= 1
+            if not self.members[slot]:
+                self.slots[x, y, z] = -1
+            else:
+                pass
+        else:
+            pass
+
+    def nearest(self, point):
+        '''
+        Every location within the Euclidean distance r of the point is in the box of the Chebyshev radius r,
+        so the nearest ones in a box are the nearest of all once their distance is not larger than the radius (or the box covers the voxel grid).
+        The indices are returned in ascending order, including the duplicated locations.
+        '''
+
+        if self.remaining == 0:
+            return np.zeros(0, dtype='i4'), None
+        else:
+            point = np.asarray(point, dtype='i8')-self.origin
+            shape = np.array(self.slots.shape)
+
+        radius = max(int(np.maximum(np.maximum(-point, point-(shape-1)), 0).max()), 1)
+        while True:
+            lower = np.maximum(point-radius, 0)
+            upper = np.minimum(point+radius+1, shape)
+            covered = np.all(lower == 0) and np.all(upper == shape)
+            box = self.slots[lower[0]:upper[0], lower[1]:upper[1], lower[2]:upper[2]]
+            slots = box[box >= 0]
+            if len(slots) > 0:
+                idxs = np.array([idx for slot in slots.tolist() for idx in self.members[slot]], dtype='i4')
+                distances = LocationArray.kernel(self.points[idxs]-self.origin-point, 'sqeuclidean')
+                distance = distances.min()
+                if distance <= radius**2 or covered:
+                    return np.sort(idxs[distances == distance]), int(distance)
+                else:
+                    pass
+            elif covered:
+                return np.zeros(0, dtype='i4'), None
+            else:
+                pass
+
+            radius *= 2
 
-        return schedule
-        
 
 class NaviFunc:
+    def precedence_oracle(self, activity_book):
+        '''
+        Return the PrecedenceOracle of the activity book, which is built once and reused.
+        '''
+
+        try:
+            if self.__oracle_book is activity_book:
+                return self.__oracle
+            else:
+                pass
+        except AttributeError:
+            pass
+
+        if isinstance(activity_book, CompiledActivityBook):
+            self.__oracle = activity_book.precedence_oracle()
+        else:
+            self.__oracle = PrecedenceOracle(activity_book)
+        self.__oracle_book = activity_book
+        return self.__oracle
+
+    def neighbourhood_index(self, activity_book, schedule):
+        '''
+        Return the NeighbourhoodIndex of the schedule locations, which is built once and reused.
+        '''
+
+        try:
+            book, locations = self.__neighbourhood_key
+            if book is activity_book and locations is schedule.locations:
+                return self.__neighbourhood_index
+            else:
+                pass
+        except AttributeError:
+            pass
+
+        pre_dists = []
+        for activity in activity_book.values():
+            try:
+                pre_dists.append(int(activity.pre_dist))
+            except (TypeError, ValueError):
+                continue
+
+        self.__neighbourhood_index = NeighbourhoodIndex.from_locations(schedule.locations, pre_dists)
+        self.__neighbourhood_key = (activity_book, schedule.locations)
+        return self.__neighbourhood_index
+
     def order_bw_activity(self, activity_book, activity_code1, activity_code2):
         '''
         Attributes
@@ -105,63 +2338,66 @@ class NaviFunc:
             | Another activity code to compare the order.
         '''
 
-        activity1 = activity_book[activity_code1]
-        activity2 = activity_book[activity_code2]
         STATUS = None
-        # consistency1 = self.check_order_consistency(activity1, activity2)
-        if activity_code2 in activity1.predecessor:
+        if self.precedence_oracle(activity_book).is_predecessor(activity_code1, activity_code2):
             STATUS = 'TO_BE_MOVED'
-        elif activity_code1 in activity2.predecessor:
-            STATUS = 'PASS'
         else:
             STATUS = 'PASS'
-        # consistency2 = self.check_order_consistency(activity2, activity1)
-
-
-        # if all([(consistency1=='FINE'), (consistency2=='FINE')]):
-        # if consistency1 == 'FINE':
-        #     STATUS = 'PASS'
-        # elif consistency1=='CONFLICT':
-        #     STATUS = 'TO_BE_MOVED'
-        # else:
-        #     STATUS = 'IRRELEVANT'
 
         return STATUS
 
     def check_order(self, activity_book, show_irrelevant=False, show_conflict=True, show_error=True):
         '''
+        Classify every activity pair at once from the predecessor and successor matrices of the PrecedenceOracle.
+        FINE: the order is consistent in both activities, IRRELEVANT: no order, CONFLICT: both orders (i.e., a cycle), ERROR: the order exists in only one of the activities.
+
         Attributes
         ----------
         show_irrelevant : bool
             | To show irrelevant activity pairs. (default : False)
         show_conflict : bool
-            | To show conflict activity pairs. (default : True)
+            | To show conflict activity components. (default : True)
         show_error : bool
             | To show errors in activity pairs. (default : True)
         '''
 
-        fines = []
-        irrelevants = []
-        conflicts = []
-        errors = []
-
-        pairs = list(itertools.combinations(activity_book.keys(), 2))
-        for activity_code1, activity_code2 in pairs:
-            STATUS = self.order_bw_activity(activity_book, activity_code1, activity_code2)
-
-            if STATUS == 'FINE':
-                fines.append((activity_code1, activity_code2))
-            elif STATUS == 'IRRELEVANT':
-                irrelevants.append((activity_code1, activity_code2))
-            elif STATUS == 'CONFLICT':
-                conflicts.append((activity_code1, activity_code2))
-            else:
-                errors.append((activity_code1, activity_code2))
-
-        print('Check orders (total: {:,} activities -> {:,} pairs)'.format(len(activity_book), len(pairs)))
+        precedence_oracle = self.precedence_oracle(activity_book)
+        codes = precedence_oracle.codes
+        relation = precedence_oracle.relation[:-1, :-1]
+        successor = (relation & PrecedenceOracle.SUCCESSOR).astype(bool)
+        predecessor = (relation & PrecedenceOracle.PREDECESSOR).astype(bool)
+
+        rows, cols = np.triu_indices(len(codes), k=1)
+        forward_succ, forward_pred = successor[rows, cols], predecessor[cols, rows]
+        backward_succ, backward_pred = successor[cols, rows], predecessor[rows, cols]
+        forward = forward_succ | forward_pred
+        backward = backward_succ | backward_pred
+
+        is_conflict = forward & backward
+        is_irrelevant = ~forward & ~backward
+        is_fine = (forward & forward_succ & forward_pred & ~backward) | (backward & backward_succ & backward_pred & ~forward)
+        is_error = ~(is_conflict | is_irrelevant | is_fine)
+
+        def to_pairs(mask):
+            return [(codes[row], codes[col]) for row, col in zip(rows[mask].tolist(), cols[mask].tolist())]
+
+        fines = to_pairs(is_fine)
+        irrelevants = to_pairs(is_irrelevant)
+        conflicts = to_pairs(is_conflict)
+        errors = to_pairs(is_error)
+
+        ## The conflict relation is closed over a strongly connected component, so the first member labels each component.
+        in_both = successor & predecessor.T & predecessor & successor.T
+        np.fill_diagonal(in_both, True)
+        cyclic = np.flatnonzero((successor & predecessor).any(axis=1))
+        components = defaultdict(list)
+        for idx in cyclic:
+            components[int(np.argmax(in_both[idx]))].append(codes[idx])
+
+        print('Check orders (total: {:,} activities -> {:,} pairs)'.format(len(codes), len(rows)))
         print('  | FINE:       {:,} pairs'.format(len(fines)))
         print('  | IRRELEVANT: {:,} pairs'.format(len(irrelevants)))
-        print('  | CONFLICT:  {:,} pairs'.format(len(conflicts)))
+        print('  | CONFLICT:  {:,} pairs ({:,} components)'.format(len(conflicts), len(components)))
         print('  | ERROR:     {:,} pairs'.format(len(errors)))
 
         if show_irrelevant and irrelevants:
@@ -169,10 +2405,10 @@ class NaviFunc:
             for irrelevant in irrelevants:
                 print('  | [{}] and [{}]'.format(irrelevant[0], irrelevant[1]))
 
-        if show_conflict and conflicts:
+        if show_conflict and components:
             print('WARNING: CONFLICT')
-            for conflict in conflicts:
-                print('  | [{}] <-> [{}]'.format(conflict[0], conflict[1]))
+            for members in components.values():
+                print('  | [{}]'.format('] <-> ['.join(members)))
 
         if show_error and errors:
             print('ERROR:')
@@ -225,17 +2461,10 @@ class NaviFunc:
         Set an initial schedule of the project.
         '''
 
-        schedule = defaultdict(dict)
-        for grid in grids:
-            schedule[grid.location] = {}
-
-            day = 0
-            while True:
-                try:
-                    schedule[grid.location][day] = grid.works[day].code
-                    day += 1
-                except IndexError:
-                    break
+        schedule = Schedule(locations=[grid.location for grid in grids], days=max([len(grid.works) for grid in grids], default=0))
+        for idx, grid in enumerate(grids):
+            schedule.cells[idx, :len(grid.works)] = [schedule.code_id(activity_code) for activity_code in grid.activity_codes()]
+            schedule.lengths[idx] = len(grid.works)
 
         return schedule
 
@@ -244,13 +2473,35 @@ class NaviFunc:
 
     def build_daily_work_plan(self, schedule):
         daily_work_plan = defaultdict(dict)
-        for location in schedule:
-            for day, activity_code in schedule[location].items():
-                daily_work_plan[day][location] = activity_code
+        if isinstance(schedule, Schedule):
+            for day in range(schedule.duration):
+                column = schedule.column(day)
+                for idx in np.flatnonzero(column != Schedule.EMPTY):
+                    daily_work_plan[day][schedule.locations[idx]] = schedule.codes[column[idx]]
+        else:
+            for location in schedule:
+                for day, activity_code in schedule[location].items():
+                    daily_work_plan[day][location] = activity_code
 
         return daily_work_plan
 
     def compare_schedule(self, schedule_1, schedule_2):
+        if isinstance(schedule_1, ScheduleSnapshot) and schedule_1.schedule is schedule_2:
+            if schedule_1.fingerprint == schedule_2.fingerprint:
+                return 'same'
+            else:
+                return 'different'
+        else:
+            pass
+
+        if isinstance(schedule_1, Schedule) and isinstance(schedule_2, Schedule):
+            if schedule_1.equals(schedule_2):
+                return 'same'
+            else:
+                return 'different'
+        else:
+            pass
+
         if schedule_1.keys() != schedule_2.keys():
             return 'different'
         else:
@@ -262,8 +2513,9 @@ class NaviFunc:
             else:
                 pass
 
+            local_schedule_2 = schedule_2[location]
             for day, activity_code_1 in schedule_1[location].items():
-                if activity_code_1 != schedule_2[location][day]:
+                if activity_code_1 != local_schedule_2.get(day):
                     return 'different'
                 else:
                     continue
@@ -284,11 +2536,64 @@ class NaviFunc:
 
         return 'same'
 
+    def nearest_neighbour_chain(self, points, start, chunk_size=256):
+        '''
+        Return the order of the points visited by moving to the nearest remaining point repeatedly, starting from the "start" point.
+        The ties are broken as repeated stable sorts by the distance from the last point do,
+        i.e., by the distances from the former visited points (the latest first) and then by the order of the points.
+
+        Attributes
+        ----------
+        points : list
+            | A list of 3-dimensional integer locations (the duplicated ones are visited one after another in their order).
+        start : tuple
+            | The location from which the chain starts (e.g., the last grid of the former chain), which is not visited.
+        chunk_size : int
+            | The number of former visited points of which the distances are computed at once to break the ties.
+        '''
+
+        points = np.array(points, dtype='i8').reshape(-1, 3)
+        voxel_grid = VoxelGrid(points)
+        lasts = np.empty((len(points)+1, 3), dtype='i8')
+        lasts[0] = start
+
+        order = []
+        for step in range(len(points)):
+            candidates, _ = voxel_grid.nearest(lasts[step])
+            if len(candidates) > 1:
+                for chunk_end in range(step, 0, -chunk_size):
+                    former_lasts = lasts[max(chunk_end-chunk_size, 0):chunk_end][::-1]
+                    distances = LocationArray.kernel(points[candidates][:, None, :]-former_lasts[None, :, :], 'sqeuclidean')
+                    column = 0
+                    while len(candidates) > 1:
+                        differences = np.flatnonzero((distances[:, column:] != distances[0, column:]).any(axis=0))
+                        if len(differences) == 0:
+                            break
+                        else:
+                            column += differences[0]
+                            nearest = distances[:, column] == distances[:, column].min()
+                            candidates, distances = candidates[nearest], distances[nearest]
+
+                    if len(candidates) == 1:
+                        break
+                    else:
+                        continue
+            else:
+                pass
+
+            idx = int(candidates[0])
+            voxel_grid.remove(idx)
+            lasts[step+1] = points[idx]
+            order.append(idx)
+
+        return order
+
     def euclidean_distance(self, x, y):
-        x_arr = np.array(x, dtype='i1')
-        y_arr = np.array(y, dtype='i1')
-        dist = np.linalg.norm(y_arr-x_arr)
-        return dist
+        '''
+        The distance of a location pair. Use LocationArray to compute the distances of many locations at once.
+        '''
+
+        return float(LocationArray.kernel(np.array(y, dtype='i8')-np.array(x, dtype='i8'), 'euclidean'))
 
     def assign_activity_to_grid(self, schedule):
         work_plan = defaultdict(list)
@@ -7,22 +7,25 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from naviutil import NaviFunc
+from naviutil import NaviFunc, Schedule, LocationArray, ActivityIndex, DurationTracker, CompiledActivityBook
 navifunc = NaviFunc()
 
 import random
-import itertools
+import numpy as np
 import pandas as pd
-from copy import deepcopy
 from collections import defaultdict
+from collections.abc import Sequence
 
 
 class Activity:
     '''
     A class of an individual construction activity.
+    The attributes are kept in slots (i.e., without a __dict__), and the code is interned so that the precedence sets share the strings of the activity book.
 
     Attributes
     ----------
+    id : int
+        | The index of the activity in the activity book (i.e., the id that Grid.works refers to).
     code : str
         | An unique code that represents the activity.
     category : str
@@ -33,25 +36,29 @@ class Activity:
         | Minor activity name.
     productivity : int
         | The predetermined number of enable works (i.e., productivity) of the activity.
-    predecessor : list
-        | A list of activity codes that should be done before the current activity.
-    successor : list
-        | A list of activity codes that should be done after the current activity.
+    predecessor : set
+        | A set of activity codes that should be done before the current activity.
+    successor : set
+        | A set of activity codes that should be done after the current activity.
     pre_dist : int
         | The minimum distance by which the predecessor activities should be completed to start the current activity.
 
     Methods
     -------
     add_predecessor
-        | Add an activity code on the "predecessor" list.
+        | Add an activity code on the "predecessor" set.
     add_successor
-        | Add an activity code on the "successor" list.
+        | Add an activity code on the "successor" set.
     check_order_consistency
         | Check order consistency between current activity and the input activity code.
     '''
 
+    __slots__ = ('id', 'code', 'category', 'major', 'minor', 'productivity', 'pre_dist', 'predecessor', 'successor')
+
     def __init__(self, parameters):
+        self.id = parameters.get('id', None)
         self.code = parameters.get('code', 'NA')
+        self.code = sys.intern(self.code) if isinstance(self.code, str) else self.code
 
         self.category = parameters.get('category', 'NA')
         self.major = parameters.get('major', 'NA')
@@ -60,8 +67,22 @@ class Activity:
         self.productivity = parameters.get('productivity', 'NA')
         self.pre_dist = parameters.get('pre_dist', 'NA')
 
-        self.predecessor = []
-        self.successor = []
+        self.predecessor = set()
+        self.successor = set()
+
+    def __getstate__(self):
+        return {attribute: getattr(self, attribute) for attribute in self.__slots__}
+
+    def __setstate__(self, state):
+        '''
+        Restore the slots from a pickled state, including the __dict__ of the activity books pickled before the slots (i.e., without "id" and with precedence lists).
+        '''
+
+        for attribute in self.__slots__:
+            setattr(self, attribute, state.get(attribute))
+
+        self.predecessor = set(self.predecessor or [])
+        self.successor = set(self.successor or [])
 
     def __str__(self):
         return '{}: {}'.format(self.code, self.minor)
@@ -74,8 +95,7 @@ class Activity:
             | A code of predecessor activity.
         '''
 
-        self.predecessor.append(activity_code)
-        self.predecessor = list(set(self.predecessor))
+        self.predecessor.add(sys.intern(activity_code))
 
     def add_successor(self, activity_code):
         '''
@@ -85,51 +105,461 @@ class Activity:
             | A code of successor activity.
         '''
 
-        self.successor.append(activity_code)
-        self.successor = list(set(self.successor))
+        self.successor.add(sys.intern(activity_code))
+
+
+## The compiled activity book builds Activity objects on demand, but naviutil cannot import this module.
+CompiledActivityBook.activity_class = Activity
+
+
+class ActivityNetwork:
+    '''
+    A class of the transitive order relations between activities.
+    The relations are computed in a single topological pass over the strongly connected components of the activity order template.
+
+    Attributes
+    ----------
+    codes : list
+        | A list of activity codes that index the bitsets.
+    code2idx : dict
+        | A dictionary of which keys are activity codes and values are their indices.
+    predecessor : list
+        | A list of bitsets (int) of the transitive predecessors of each activity.
+    successor : list
+        | A list of bitsets (int) of the transitive successors of each activity.
+    cycles : list
+        | A list of activity code lists that form cycles (i.e., strongly connected components) in the template.
+
+    Methods
+    -------
+    predecessors
+        | Return the transitive predecessor codes of an activity.
+    successors
+        | Return the transitive successor codes of an activity.
+    is_predecessor
+        | Check whether an activity should be done before another activity.
+    '''
+
+    def __init__(self, activity_book):
+        self.codes = list(activity_book.keys())
+        self.code2idx = {code: idx for idx, code in enumerate(self.codes)}
+
+        direct_successors = [[self.code2idx[code] for code in activity_book[activity_code].successor if code in self.code2idx] for activity_code in self.codes]
+        self.__build(direct_successors)
+
+    @classmethod
+    def from_edges(cls, codes, predecessor_ids, successor_ids):
+        '''
+        Build an ActivityNetwork from the (predecessor, successor) index pairs of direct orders, without Activity objects.
+
+        Attributes
+        ----------
+        codes : list
+            | A list of activity codes that the indices refer to.
+        predecessor_ids : numpy.ndarray
+            | The indices of predecessor activities.
+        successor_ids : numpy.ndarray
+            | The indices of successor activities, paired with the predecessor_ids.
+        '''
+
+        obj = cls.__new__(cls)
+        obj.codes = list(codes)
+        obj.code2idx = {code: idx for idx, code in enumerate(obj.codes)}
+
+        predecessor_ids = np.asarray(predecessor_ids, dtype='i8')
+        successor_ids = np.asarray(successor_ids, dtype='i8')
+        orders = np.argsort(predecessor_ids, kind='stable')
+        boundaries = np.searchsorted(predecessor_ids[orders], np.arange(len(obj.codes)+1))
+        direct_successors = [successor_ids[orders[boundaries[idx]:boundaries[idx+1]]].tolist() for idx in range(len(obj.codes))]
+        obj.__build(direct_successors)
+        return obj
+
+    def __build(self, direct_successors):
+        components = self.__find_components(direct_successors)
+
+        component_of = [0]*len(self.codes)
+        for component_idx, members in enumerate(components):
+            for idx in members:
+                component_of[idx] = component_idx
+
+        self.cycles = []
+        member_bits = []
+        is_cyclic = []
+        for members in components:
+            bits = 0
+            for idx in members:
+                bits |= 1 << idx
+            member_bits.append(bits)
+
+            cyclic = len(members) > 1 or members[0] in direct_successors[members[0]]
+            is_cyclic.append(cyclic)
+            if cyclic:
+                self.cycles.append([self.codes[idx] for idx in sorted(members)])
+            else:
+                pass
+
+        ## Components are found in reverse topological order, i.e., successors first.
+        successor_bits = [0]*len(components)
+        for component_idx, members in enumerate(components):
+            bits = member_bits[component_idx] if is_cyclic[component_idx] else 0
+            for idx in members:
+                for succ_idx in direct_successors[idx]:
+                    succ_component = component_of[succ_idx]
+                    if succ_component != component_idx:
+                        bits |= member_bits[succ_component] | successor_bits[succ_component]
+            successor_bits[component_idx] = bits
+
+        predecessor_bits = [member_bits[component_idx] if is_cyclic[component_idx] else 0 for component_idx in range(len(components))]
+        for component_idx in reversed(range(len(components))):
+            for idx in components[component_idx]:
+                for succ_idx in direct_successors[idx]:
+                    succ_component = component_of[succ_idx]
+                    if succ_component != component_idx:
+                        predecessor_bits[succ_component] |= member_bits[component_idx] | predecessor_bits[component_idx]
+
+        self.successor = [successor_bits[component_of[idx]] for idx in range(len(self.codes))]
+        self.predecessor = [predecessor_bits[component_of[idx]] for idx in range(len(self.codes))]
+
+    def __find_components(self, direct_successors):
+        '''
+        Find the strongly connected components with an iterative Tarjan's algorithm.
+        '''
+
+        index = [None]*len(direct_successors)
+        lowlink = [0]*len(direct_successors)
+        on_stack = [False]*len(direct_successors)
+        stack = []
+        components = []
+
+        counter = 0
+        for root in range(len(direct_successors)):
+            if index[root] is not None:
+                continue
+            else:
+                pass
+
+            work = [(root, 0)]
+            while work:
+                node, child = work.pop()
+                if child == 0:
+                    index[node] = counter
+                    lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+
+                recurse = False
+                for child_idx in range(child, len(direct_successors[node])):
+                    succ_idx = direct_successors[node][child_idx]
+                    if index[succ_idx] is None:
+                        work.append((node, child_idx+1))
+                        work.append((succ_idx, 0))
+                        recurse = True
+                        break
+                    elif on_stack[succ_idx]:
+                        lowlink[node] = min(lowlink[node], index[succ_idx])
+
+                if recurse:
+                    continue
+                else:
+                    pass
+
+                if lowlink[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        members.append(member)
+                        if member == node:
+                            break
+                    components.append(members)
+
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+        return components
+
+    def bits2codes(self, bits):
+        codes = []
+        while bits:
+            lowest = bits & -bits
+            codes.append(self.codes[lowest.bit_length()-1])
+            bits ^= lowest
+
+        return codes
+
+    def predecessors(self, activity_code):
+        return self.bits2codes(self.predecessor[self.code2idx[activity_code]])
+
+    def successors(self, activity_code):
+        return self.bits2codes(self.successor[self.code2idx[activity_code]])
+
+    def is_predecessor(self, activity_code1, activity_code2):
+        '''
+        Return True if the activity_code2 should be done before the activity_code1.
+        '''
+
+        return bool(self.predecessor[self.code2idx[activity_code1]] >> self.code2idx[activity_code2] & 1)
 
 
 class Grid:
     '''
-    A class that represents a single location.
+    A class that represents a single location, which is a view of a row of a GridTable.
+    The grids of a project share a single table, so that a grid only keeps the table and its row (see GridTable).
 
     Attributes
     ----------
+    table : GridTable
+        | The table that holds the location and the works of the grid.
+    row : int
+        | The row of the grid in the table.
     x : int
         | Horizontal location of the location.
     y : int
         | Vertical location of the location.
     z : int
         | Depth of the location.
+    location : str
+        | The location string (i.e., "x_y_z").
     location_2d : tuple
         | 2-dimensional location of a grid.
     location_3d : tuple
         | 3-dimensional location of a grid.
+    works : numpy.ndarray
+        | The activity ids of the works in order (a view of the table).
+    codes : list
+        | The code table that the activity ids refer to (e.g., the codes of the activity book).
+
+    Methods
+    -------
+    activity_codes
+        | Return the activity codes of the works in order.
     '''
 
-    def __init__(self, location, works):
-        self.location = location
+    __slots__ = ('table', 'row')
+
+    def __init__(self, location, works, codes=None):
+        '''
+        Build a grid with a table of its own. The grids of a project are rather built as the rows of a GridTable.
+
+        Attributes
+        ----------
+        location : str
+            | The location string (i.e., "x_y_z").
+        works : list
+            | The activity ids of the works (with "codes"), or the Activity objects (without "codes").
+        codes : list
+            | The code table of the activity ids.
+        '''
+
+        if codes is None:
+            activity_codes = [activity.code for activity in works]
+            codes = list(dict.fromkeys(activity_codes))
+            code2id = {activity_code: activity_id for activity_id, activity_code in enumerate(codes)}
+            works = [code2id[activity_code] for activity_code in activity_codes]
+        else:
+            pass
+
+        self.table = GridTable.from_works({location: works}, codes)
+        self.row = 0
+
+    @classmethod
+    def view(cls, table, row):
+        obj = cls.__new__(cls)
+        obj.table = table
+        obj.row = row
+        return obj
+
+    def __getstate__(self):
+        return {'table': self.table, 'row': self.row}
+
+    def __setstate__(self, state):
+        '''
+        Restore a pickled grid, including the grids pickled before the table,
+        of which state has the location (or x, y, z) with a list of Activity objects (or an array of activity ids with the codes).
+        '''
+
+        if isinstance(state, tuple):
+            state = state[1]
+        else:
+            pass
+
+        if 'table' in state:
+            self.table = state['table']
+            self.row = state['row']
+        else:
+            location = state.get('location') or '{}_{}_{}'.format(state['x'], state['y'], state['z'])
+            self.__init__(location=location, works=state['works'], codes=state.get('codes'))
+
+    @property
+    def x(self):
+        return int(self.table.points[self.row, 0])
+
+    @property
+    def y(self):
+        return int(self.table.points[self.row, 1])
+
+    @property
+    def z(self):
+        return int(self.table.points[self.row, 2])
+
+    @property
+    def location(self):
+        return '{}_{}_{}'.format(self.x, self.y, self.z)
 
-        self.x, self.y, self.z = [int(l) for l in self.location.split('_')]
-        self.location_2d = tuple((self.x, self.y))
-        self.location_3d = tuple((self.x, self.y, self.z))
+    @property
+    def location_2d(self):
+        return (self.x, self.y)
 
-        self.works = works
+    @property
+    def location_3d(self):
+        return (self.x, self.y, self.z)
+
+    @property
+    def works(self):
+        return self.table.works(self.row)
+
+    @property
+    def codes(self):
+        return self.table.codes
+
+    def activity_codes(self):
+        return [self.codes[activity_id] for activity_id in self.works.tolist()]
 
     def __len__(self):
-        return len(self.works)
+        return int(self.table.lengths[self.row])
+
+
+class GridTable(Sequence):
+    '''
+    The grids of a project in columns: the locations, and the works of all grids in a single array of activity ids that each grid slices by its start and length.
+    It behaves like a list of grids, of which Grid objects are views built on access.
+    A reordered table (e.g., Project.sorted_grids) shares the array of activity ids with the original table.
+
+    Attributes
+    ----------
+    points : numpy.ndarray
+        | A (grids x 3) array of the locations (i.e., Grid.location_3d).
+    starts : numpy.ndarray
+        | The position of the first work of each grid in "ids".
+    lengths : numpy.ndarray
+        | The number of works of each grid.
+    ids : numpy.ndarray
+        | The activity ids of the works of all grids.
+    codes : list
+        | The code table that the activity ids refer to.
+
+    Methods
+    -------
+    from_works
+        | Build a table from the arrays of activity ids of each location.
+    from_grids
+        | Build a table from grids (e.g., the grids of different tables).
+    works
+        | Return the activity ids of the works of a grid.
+    take
+        | Return a table of the grids in the given order.
+    '''
+
+    def __init__(self, points, starts, lengths, ids, codes):
+        self.points = points
+        self.starts = starts
+        self.lengths = lengths
+        self.ids = ids
+        self.codes = codes
+
+    @classmethod
+    def from_works(cls, works, codes):
+        '''
+        Attributes
+        ----------
+        works : dict
+            | A dictionary of which keys are location strings (i.e., "x_y_z") and values are the activity ids of the works.
+        codes : list
+            | The code table of the activity ids.
+        '''
+
+        points = [[int(l) for l in location.split('_')] for location in works]
+        return cls.__pack(points, list(works.values()), codes)
+
+    @classmethod
+    def from_grids(cls, grids):
+        '''
+        Build a table from grids. The grids of a single table are taken without copying the activity ids,
+        and the grids of different tables are mapped onto a single code table.
+        '''
+
+        grids = list(grids)
+        tables = {id(grid.table): grid.table for grid in grids}
+        if len(tables) == 1:
+            table = next(iter(tables.values()))
+            return table.take([grid.row for grid in grids])
+        else:
+            pass
+
+        codes = []
+        code2id = {}
+        works = []
+        for grid in grids:
+            for activity_code in grid.codes:
+                if activity_code not in code2id:
+                    code2id[activity_code] = len(codes)
+                    codes.append(activity_code)
+                else:
+                    pass
+
+            id_map = np.array([code2id[activity_code] for activity_code in grid.codes], dtype='i4')
+            works.append(id_map[grid.works])
+
+        return cls.__pack([grid.location_3d for grid in grids], works, codes)
+
+    @classmethod
+    def __pack(cls, points, works, codes):
+        points = np.array(points, dtype='i4').reshape(-1, 3)
+        lengths = np.array([len(activity_ids) for activity_ids in works], dtype='i4')
+        starts = np.cumsum(lengths, dtype='i8')-lengths
+        ids = np.concatenate([np.asarray(activity_ids, dtype='i4') for activity_ids in works]+[np.empty(0, dtype='i4')])
+        return cls(points, starts, lengths, ids, codes)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.take(np.arange(len(self))[idx])
+        elif idx < 0:
+            idx += len(self)
+        else:
+            pass
+
+        if not 0 <= idx < len(self):
+            raise IndexError('Grid index out of range: {}'.format(idx))
+        else:
+            return Grid.view(self, idx)
+
+    def works(self, row):
+        start = self.starts[row]
+        return self.ids[start:start+self.lengths[row]]
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype='i8')
+        return GridTable(self.points[rows], self.starts[rows], self.lengths[rows], self.ids, self.codes)
 
 
 class Project:
     '''
     A class to represent the whole construction project that consists of several works.
+    The sorted grids, the schedule, and the expected duration are built on the first access and cached until the grids (or the schedule) are replaced.
 
     Attributes
     ----------
     activities : dict
         | A dictionary of activities of which keys are activity_code and values are activity (i.e., the class of Activity).
-    grids : list
-        | A list of grids (i.e., the class of Grid).
+    grids : GridTable
+        | The grids (i.e., the class of Grid) in a table, which shares the activity ids of all grids.
+    location_array : LocationArray
+        | The 3-dimensional locations of the grids in order, with the distance kernels.
     duration : int
         | The duration of the project that determined by the user.
     duration_expected : int
@@ -138,92 +568,192 @@ class Project:
         | A list of activity codes that have been used in the project.
     schedule : list
         | A list of works (i.e., the class of Work).
-    sorted_grids : list
-        | A list of grids that are sorted based on the distance from the grid with the longest workday.
+    activity_index : ActivityIndex
+        | An inverted index of the schedule from activity codes to (location, day) cells, which follows the changes of the schedule.
+    sorted_grids : GridTable
+        | The grids that are sorted based on the distance from the grid with the longest workday, which share the activity ids of the grids.
 
     Methods
     -------
     search
         | To find location and workday for an activity.
+    start, finish, count
+        | The first workday, the last workday, and the number of locations of an activity.
+    major_span
+        | The first and the last workdays of a major activity (e.g., "T100").
+    is_delayed
+        | Check whether the expected duration exceeds the planned duration.
     '''
 
     def __init__(self, grids, duration):
+        self.duration = duration
         self.grids = grids
-        self.sorted_grids = []
 
-        self.duration = duration
-        self.duration_expected = ''
+    @property
+    def grids(self):
+        return self.__grids
+
+    @grids.setter
+    def grids(self, grids):
+        '''
+        Replace the grids (a GridTable, or a list of grids that is packed into a GridTable).
+        The sorted grids, the schedule, and the other derived attributes are built again on demand.
+        '''
 
-        self.schedule = ''
+        if isinstance(grids, GridTable):
+            self.__grids = grids
+        else:
+            self.__grids = GridTable.from_grids(grids)
+
+        self.__location_array = None
+        self.__sorted_grids = None
+        self.__num_activities = None
+        self.schedule = None
 
-        self.__sort_grids()
-        self.__update_schedule()
-        self.__estimate_duration()
-        
     def __len__(self):
         '''
         Total number of activities to be conducted for the project.
         '''
 
-        return len(list(itertools.chain(*[[activity for activity in grid.works] for grid in self.grids])))
+        if self.__num_activities is None:
+            self.__num_activities = int(self.grids.lengths.sum())
+        else:
+            pass
+
+        return self.__num_activities
 
-    def __sort_grids(self):
+    @property
+    def location_array(self):
+        if self.__location_array is None:
+            self.__location_array = LocationArray(self.grids.points)
+        else:
+            pass
+
+        return self.__location_array
+
+    @property
+    def sorted_grids(self):
+        if self.__sorted_grids is None:
+            self.__sorted_grids = self.__sort_grids()
+        else:
+            pass
+
+        return self.__sorted_grids
+
+    @property
+    def schedule(self):
+        if self.__schedule is None:
+            self.schedule = navifunc.grids2schedule(grids=self.sorted_grids)
+        else:
+            pass
+
+        return self.__schedule
+
+    @schedule.setter
+    def schedule(self, schedule):
         '''
-        Sort the grids by starting at a grid with the longest workdays and move to the nearest grid.
+        Replace the schedule. The in-place changes of the schedule are followed by the activity index and the duration tracker without a replacement.
         '''
 
-        sorted_by_work_len = sorted(self.grids, key=lambda x:len(x.works), reverse=True)
-        worklen2grid = defaultdict(list)
-        for grid in sorted_by_work_len:
-            worklen2grid[len(grid.works)].append(grid)
+        self.__schedule = schedule
+        self.__activity_index = None
+        self.__duration_tracker = None
 
-        sorted_by_dist = []
-        for worklen, grids_same_worklen in sorted(worklen2grid.items(), key=lambda x:x[0], reverse=True):
-            while len(grids_same_worklen) > 0:
-                try:
-                    last_grid = sorted_by_dist[-1]
-                except IndexError:
-                    last_grid = grids_same_worklen[0]
+    @property
+    def activity_index(self):
+        if self.__activity_index is None:
+            self.__activity_index = ActivityIndex(self.schedule)
+        else:
+            pass
+
+        return self.__activity_index
 
-                grids_same_worklen = sorted(grids_same_worklen, key=lambda x:navifunc.euclidean_distance(x.location_3d, last_grid.location_3d), reverse=False)
-                sorted_by_dist.append(grids_same_worklen[0])
-                grids_same_worklen.pop(0)
+    @property
+    def duration_expected(self):
+        '''
+        The last workday of the current schedule, maintained with a max-heap of the last workday of each location (see DurationTracker).
+        '''
+
+        if self.__duration_tracker is None:
+            self.__duration_tracker = DurationTracker(self.schedule)
+        else:
+            pass
 
-        self.sorted_grids = deepcopy(sorted_by_dist)
+        return self.__duration_tracker.last
 
-    def __update_schedule(self):
-        self.schedule = navifunc.grids2schedule(grids=self.sorted_grids)
+    def is_delayed(self):
+        '''
+        Check whether the project cannot finish within the planned duration with the current schedule (i.e., the productivity should be adjusted, see run/recommend.py).
+        '''
+
+        return self.duration_expected > self.duration
 
-    def __estimate_duration(self):
+    def __setstate__(self, state):
         '''
-        Estimate the project duration based on the current schedule.
+        Restore a pickled project.
+        The former projects kept the grids, the schedule (a dict of dicts), and the derived attributes as plain attributes.
+        The grids and the schedule are mapped onto the private attributes, and the derived attributes (e.g., the sorted grids, which were copies of the grids) are built again on demand.
         '''
 
-        duration_expected = 0
-        for location in self.schedule:
-            last_day = max(list(self.schedule[location].keys()))
-            if duration_expected <= last_day:
-                duration_expected = deepcopy(last_day)
+        if '_Project__grids' in state:
+            self.__dict__.update(state)
+            return
+        else:
+            pass
 
-        self.duration_expected = deepcopy(duration_expected)
+        legacy_attributes = ('grids', 'location_array', 'sorted_grids', 'duration_expected', 'schedule', 'activity_index')
+        self.__dict__.update({attribute: value for attribute, value in state.items() if attribute not in legacy_attributes})
+        self.grids = state['grids']
 
-    def summary(self):
+        schedule = state.get('schedule')
+        if isinstance(schedule, Schedule):
+            self.schedule = schedule
+        elif schedule:
+            self.schedule = Schedule.from_dict(schedule)
+        else:
+            pass
+
+    def __sort_grids(self):
         '''
-        Summarize the project schedule.
+        Sort the grids by starting at a grid with the longest workdays and move to the nearest grid.
+        The nearest grids of the same worklen are chained on a voxel grid (see NaviFunc.nearest_neighbour_chain), and the sorted table shares the activity ids of the grids.
+        '''
+
+        sorted_by_work_len = np.argsort(-self.grids.lengths.astype('i8'), kind='stable').tolist()
+        worklen2idx = defaultdict(list)
+        for idx in sorted_by_work_len:
+            worklen2idx[int(self.grids.lengths[idx])].append(idx)
+
+        sorted_by_dist = []
+        for worklen, idxs_same_worklen in sorted(worklen2idx.items(), key=lambda x:x[0], reverse=True):
+            try:
+                last_idx = sorted_by_dist[-1]
+            except IndexError:
+                last_idx = idxs_same_worklen[0]
+
+            order = navifunc.nearest_neighbour_chain(self.location_array.points[idxs_same_worklen], self.location_array.points[last_idx])
+            sorted_by_dist.extend([idxs_same_worklen[position] for position in order])
+
+        return self.grids.take(sorted_by_dist)
+
+    def summary(self, sorted_grids=True):
+        '''
+        Summarize the project schedule. The sorted grids are listed only if "sorted_grids" is True.
         '''
 
         print('============================================================')
         print('Project Summary')
 
-        self.__estimate_duration()
         print('Duration')
         print('  | Planned : {:,} days'.format(self.duration))
         print('  | Expected: {:,} days'.format(self.duration_expected))
 
-        self.__sort_grids()
-        print('Sorted Grids')
-        for grid in self.sorted_grids:
-            print('  | Location: ({:>2} {:>2} {:>2}) -> WorkLen: {:>3,}'.format(grid.x, grid.y, grid.z, len(grid.works)))
+        if sorted_grids:
+            print('Sorted Grids')
+            for grid in self.sorted_grids:
+                print('  | Location: ({:>2} {:>2} {:>2}) -> WorkLen: {:>3,}'.format(grid.x, grid.y, grid.z, len(grid.works)))
+        else:
+            pass
 
     def search(self, activity_code, verbose=False):
         '''
@@ -236,22 +766,30 @@ class Project:
             | The predetermined code of the activity that the user wants to search.
         '''
 
-        here = []
-        for location in self.schedule:
-            if activity_code in self.schedule[location].keys():
-                day = self.schedule[location][activity_code]
-                here.append((location, day))
+        here = self.activity_index.search(activity_code)
 
         if verbose:
             print('Find {}:'.format(activity_code))
             print('  | LOCATION | DAY |')
-            for location, day in sorted(here, key=lambda x:x[1], reverse=False):
+            for location, day in here:
                 print('  | {:<7} | {:>3} |'.format(location, day))
         else:
             pass
 
         return here
 
+    def start(self, activity_code):
+        return self.activity_index.start(activity_code)
+
+    def finish(self, activity_code):
+        return self.activity_index.finish(activity_code)
+
+    def count(self, activity_code):
+        return self.activity_index.count(activity_code)
+
+    def major_span(self, major_code):
+        return self.activity_index.major_span(major_code)
+
 
 #########
 #7월22일 수도코드
@@ -382,7 +920,4 @@ class Project:
                 # if id앞 5자리가 같으면 맨뒤자리 순서에 따라 다음날 작업으로 필히 배정한다.
                 # 예) 레미콘타설 후 양생은 필연적인 연속후행관계
 
-        # 전체일정 내 완료 불가시
-                # 생산성 조정 알림
-                # 조정전 결과 보여주기
-                # 추천 생산성 조정 안 1,2,3 보여주기
\ No newline at end of file
+        # 전체일정 내 완료 불가시 생산성 조정 알림 및 추천 생산성 조정 안 1,2,3: Project.is_delayed(), run/recommend.py 참고
\ No newline at end of file
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Run "init.py" and "update.py" for many cases on a process pool.
+The activity book is compiled once and shared (read-only, memory-mapped) by the workers,
+and each case runs in its own RunContext (i.e., "batch/{batch_id}/C-{case}/") so that the cases do not collide in "proj/" and "schedule/".
+
+Usage:
+    python run/batch.py <duration> <case or glob> [<case or glob> ...] [--workers N] [--save-log] [--max-iteration N] [--time-limit SEC]
+
+    e.g., python run/batch.py 100 01 10 "data/case_00*.xlsx"
+'''
+
+# Configuration
+import os
+import sys
+rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
+sys.path.append(rootpath)
+
+from naviutil import NaviPath, NaviFunc, NaviIO, RunContext, CompiledActivityBook, DurationTracker
+navipath = NaviPath()
+navifunc = NaviFunc()
+naviio = NaviIO()
+
+import re
+import glob
+import time
+import argparse
+import traceback
+import pandas as pd
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import init
+import update
+
+
+def find_cases(patterns):
+    '''
+    Return the case ids of the input case ids and glob patterns (e.g., "data/case_00*.xlsx"), in order without duplicates.
+    '''
+
+    cases = []
+    for pattern in patterns:
+        if any(character in pattern for character in '*?[') or pattern.endswith('.xlsx'):
+            fpaths = sorted(glob.glob(pattern if os.path.isabs(pattern) else os.path.sep.join((rootpath, pattern))))
+            case_ids = [re.sub(r'^case_(.*)\.xlsx$', r'\1', os.path.basename(fpath)) for fpath in fpaths]
+        else:
+            case_ids = [pattern]
+
+        for case_id in case_ids:
+            if case_id not in cases:
+                cases.append(case_id)
+            else:
+                continue
+
+    return cases
+
+def prepare_activity_book():
+    '''
+    Build (or reuse) the compiled activity book of the current templates once, before the workers start.
+    '''
+
+    init.fname_activity_book = 'activity_book.pk'
+    init.fname_activity_network = 'activity_network.pk'
+
+    key = CompiledActivityBook.template_key([navipath.activity_table, navipath.activity_order])
+    if CompiledActivityBook.exists(key):
+        init.restore_activity_book(key)
+    else:
+        init.init_activity_book()
+        key_errors = init.set_orders_in_activity_book()
+        init.compile_activity_book(key, key_errors)
+
+    return key
+
+def run_case(case_id, duration, key, run_id, fdir_workspace, options):
+    '''
+    Run a case in its own run context (i.e., workspace) and return the summary. The messages of the case are written in "run.log" of the workspace.
+    '''
+
+    summary = {
+        'case': case_id,
+        'status': 'error',
+        'duration_planned': duration,
+        'duration_expected': None,
+        'duration_updated': None,
+        'iterations': None,
+        'time_init': None,
+        'time_update': None,
+        'workspace': fdir_workspace,
+    }
+
+    os.makedirs(fdir_workspace, exist_ok=True)
+    with RunContext(run_id=run_id, fdir=fdir_workspace), open(os.path.sep.join((fdir_workspace, 'run.log')), 'w', encoding='utf-8') as log, redirect_stdout(log):
+        try:
+            activity_book = CompiledActivityBook.load(key)
+
+            start_time = time.time()
+            project = init.initiate_project(case_id, duration, activity_book=activity_book)
+            init.export_initial_schedule(case_id)
+            summary['duration_expected'] = project.duration_expected
+            summary['time_init'] = time.time()-start_time
+
+            start_time = time.time()
+            update.activity_book = activity_book
+            update.case_id = case_id
+            schedule = update.import_schedule(case_id)
+            schedule_normalized = update.normallize_duplicated_activity(schedule)
+            schedule_updated, status, iteration = update.update_with_status(schedule_original=schedule_normalized,
+                                                                            do_order=True,
+                                                                            do_pre_dist=True,
+                                                                            do_productivity=True,
+                                                                            do_compress=True,
+                                                                            save_log=options['save_log'],
+                                                                            sleep_for_verbose=False,
+                                                                            max_iteration=options['max_iteration'],
+                                                                            time_limit=options['time_limit'])
+            naviio.schedule2xlsx(schedule=schedule_updated, fname='C-{}/updated.xlsx'.format(case_id))
+            summary['time_update'] = time.time()-start_time
+
+            summary['status'] = status
+            ## Both durations are the last workday (see Project.duration_expected), rather than the number of days (i.e., Schedule.duration).
+            summary['duration_updated'] = DurationTracker(schedule_updated).last
+            summary['iterations'] = iteration
+        except Exception:
+            traceback.print_exc(file=log)
+
+    return summary
+
+def run_batch(case_ids, duration, batch_id, fdir_batch, workers=None, **options):
+    key = prepare_activity_book()
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {}
+        for case_id in case_ids:
+            fdir_workspace = os.path.sep.join((fdir_batch, 'C-{}'.format(case_id)))
+            run_id = '{}-C-{}'.format(batch_id, case_id)
+            futures[executor.submit(run_case, case_id, duration, key, run_id, fdir_workspace, options)] = case_id
+
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print('  | Case {:>8}: {:13} ({:,} iterations, {:.03f} sec)'.format(summary['case'], summary['status'], summary['iterations'] or 0, (summary['time_init'] or 0)+(summary['time_update'] or 0)))
+
+    summary_df = pd.DataFrame(summaries).set_index('case').loc[case_ids]
+    with RunContext.current().atomic_path(os.path.sep.join((fdir_batch, 'summary.xlsx'))) as fpath:
+        summary_df.to_excel(fpath)
+    return summary_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run init.py and update.py for many cases in parallel.')
+    parser.add_argument('duration', type=int, help='project duration (total days)')
+    parser.add_argument('cases', nargs='+', help='case numbers or glob patterns of case files (e.g., "data/case_00*.xlsx")')
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker processes (default: the number of CPUs)')
+    parser.add_argument('--save-log', action='store_true', help='write the iteration log of each case')
+    parser.add_argument('--max-iteration', type=int, default=None)
+    parser.add_argument('--time-limit', type=float, default=None)
+    args = parser.parse_args()
+
+    case_ids = find_cases(args.cases)
+    batch_id = RunContext.new_run_id()
+    fdir_batch = os.path.sep.join((navipath.root, 'batch', batch_id))
+    os.makedirs(fdir_batch, exist_ok=True)
+
+    print('============================================================')
+    print('Batch run')
+    print('  | Cases  : {}'.format(', '.join(case_ids)))
+    print('  | Workers: {}'.format(args.workers or os.cpu_count()))
+    print('  | fdir   : {}'.format(fdir_batch))
+
+    start_time = time.time()
+    summary_df = run_batch(case_ids, args.duration, batch_id, fdir_batch,
+                           workers=args.workers,
+                           save_log=args.save_log,
+                           max_iteration=args.max_iteration,
+                           time_limit=args.time_limit)
+
+    print('============================================================')
+    print('Summary (total {:.03f} sec)'.format(time.time()-start_time))
+    print(summary_df.drop(columns=['workspace']).to_string())
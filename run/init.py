@@ -12,44 +12,87 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from object import Activity, Grid, Project
-from naviutil import NaviPath, NaviFunc, NaviIO
+from object import Activity, ActivityNetwork, GridTable, Project
+from naviutil import NaviPath, NaviFunc, NaviIO, RunContext, CompiledActivityBook
 navipath = NaviPath()
 navifunc = NaviFunc()
 naviio = NaviIO()
 
+import shutil
 import pickle as pk
 import pandas as pd
-from copy import deepcopy
 from collections import defaultdict
 
 
+def build_activity_book(activity_table):
+    '''
+    Build the activity book of an activity table (i.e., the DataFrame of the ActivityTable template).
+    '''
+
+    columns = {
+        'category': 'category',
+        'major_activity': 'major',
+        'minor_activity': 'minor',
+        'code': 'code',
+        'productivity': 'productivity',
+        'pre_dist': 'pre_dist',
+    }
+
+    parameters_list = activity_table[list(columns)].rename(columns=columns).to_dict('records')
+    activity_book = {}
+    for parameters in parameters_list:
+        parameters['id'] = len(activity_book)
+        activity_book[parameters['code']] = Activity(parameters=parameters)
+
+    return activity_book
+
+def build_activity_network(activity_book, activity_order):
+    '''
+    Set the orders of an activity order (i.e., the DataFrame of the ActivityOrder template) in the activity book,
+    and return the activity network and the activity codes absent in the activity book.
+    '''
+
+    codes = list(activity_book.keys())
+    is_known_predecessor = activity_order['predecessor'].isin(codes)
+    is_known_successor = activity_order['successor'].isin(codes)
+    key_errors = pd.unique(pd.concat((activity_order.loc[~is_known_predecessor, 'predecessor'], activity_order.loc[~is_known_successor, 'successor'])))
+
+    orders = activity_order.loc[is_known_predecessor & is_known_successor, ['predecessor', 'successor']].drop_duplicates()
+    predecessor_ids = pd.Categorical(orders['predecessor'], categories=codes).codes
+    successor_ids = pd.Categorical(orders['successor'], categories=codes).codes
+
+    activity_network = ActivityNetwork.from_edges(codes, predecessor_ids, successor_ids)
+    for activity_code in activity_book:
+        activity_book[activity_code].predecessor = set(activity_network.predecessors(activity_code))
+        activity_book[activity_code].successor = set(activity_network.successors(activity_code))
+
+    return activity_network, key_errors
+
+def report_activity_order(key_errors, cycles):
+    '''
+    Print the activity codes absent in the activity book and the cycles of the ActivityOrder template.
+    '''
+
+    if len(key_errors) > 0:
+        print('Errors on ActivityOrder template')
+        for activity_code in key_errors:
+            print('  | Absent in ActivityBook: {}'.format(activity_code))
+    else:
+        pass
+
+    if cycles:
+        print('Cycles on ActivityOrder template')
+        for cycle in cycles:
+            print('  | Cycle: {}'.format(' <-> '.join(cycle)))
+    else:
+        pass
+
 def init_activity_book():
     global fname_activity_book
 
-    activity_table = pd.read_excel(navipath.activity_table)
+    activity_book = build_activity_book(pd.read_excel(navipath.activity_table))
 
-    activity_book = {}
-    for _, line in activity_table.iterrows():
-        category = line['category']
-        major = line['major_activity']
-        minor = line['minor_activity']
-        code = line['code']
-        productivity = line['productivity']
-        pre_dist = line['pre_dist']
-
-        parameters = {
-            'category': category,
-            'major': major,
-            'minor': minor,
-            'code': code,
-            'productivity': productivity,
-            'pre_dist': pre_dist,
-        }
-        activity_book[code] = Activity(parameters=parameters)
-
-    os.makedirs(navipath.fdir_component, exist_ok=True)
-    with open(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'wb') as f:
+    with RunContext.current().open_atomic(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'wb') as f:
         pk.dump(activity_book, f)
 
     print('============================================================')
@@ -58,113 +101,122 @@ def init_activity_book():
     print('  | fname: {}'.format(fname_activity_book))
 
 def set_orders_in_activity_book():
+    '''
+    Set the orders in the activity book, and return the activity codes absent in the activity book (i.e., the key errors).
+    '''
+
     global fname_activity_book
+    global fname_activity_network
 
     with open(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'rb') as f:
         activity_book = pk.load(f)
 
-    activity_order = pd.read_excel(navipath.activity_order)
-    key_errors = []
-    for _, line in activity_order.iterrows():
-        predecessor_code = line['predecessor']
-        successor_code = line['successor']
-
-        try:
-            predecessor_activity = deepcopy(activity_book[predecessor_code])
-        except KeyError:
-            key_errors.append(predecessor_code)
-            continue
-        try:
-            successor_activity = deepcopy(activity_book[successor_code])
-        except KeyError:
-            key_errors.append(successor_code)
-            continue
-
-        predecessor_activity.add_successor(successor_activity.code)
-        successor_activity.add_predecessor(predecessor_activity.code)
-
-        activity_book[predecessor_code] = predecessor_activity
-        activity_book[successor_code] = successor_activity
-
-    updates = [True]
-    while any(updates) == True:
-        updates = []
-        for activity_code in activity_book:
-            activity = activity_book[activity_code]
-
-            existing_preds = deepcopy(list(set(activity.predecessor)))
-            for pred_code in activity.predecessor:
-                pred_of_pred = list(set(activity_book[pred_code].predecessor))
-                updated_preds = deepcopy(list(set(existing_preds+pred_of_pred)))
-                if set(updated_preds) != set(existing_preds):
-                    activity_book[activity_code].predecessor = updated_preds
-                    updates.append(True)
-            
-            existing_succs = deepcopy(list(set(activity.successor)))
-            for succ_code in activity.successor:
-                succ_of_succ = list(set(activity_book[succ_code].successor))
-                updated_succs = deepcopy(list(set(existing_succs+succ_of_succ)))
-                if set(updated_succs) != set(existing_succs):
-                    activity_book[activity_code].successor = updated_succs
-                    updates.append(True)
-
-    with open(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'wb') as f:
+    activity_network, key_errors = build_activity_network(activity_book, pd.read_excel(navipath.activity_order))
+
+    with RunContext.current().open_atomic(os.path.sep.join((navipath.fdir_component, fname_activity_network)), 'wb') as f:
+        pk.dump(activity_network, f)
+
+    with RunContext.current().open_atomic(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'wb') as f:
         pk.dump(activity_book, f)
 
     print('============================================================')
     print('Set order information to ActivityBook')
     print('  | fdir : {}'.format(navipath.fdir_component))
     print('  | fname: {}'.format(fname_activity_book))
+    print('  | fname: {}'.format(fname_activity_network))
 
-    if key_errors:
-        print('Errors on ActivityOrder template')
-        key_errors = list(set(key_errors))
-        for activity_code in key_errors:
-            print('  | Absent in ActivityBook: {}'.format(activity_code))
-    else:
-        pass
+    report_activity_order(key_errors, activity_network.cycles)
+    return key_errors
 
-def define_works(case_num):
+def compile_activity_book(key, key_errors=()):
     global fname_activity_book
+    global fname_activity_network
 
     with open(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'rb') as f:
         activity_book = pk.load(f)
+    with open(os.path.sep.join((navipath.fdir_component, fname_activity_network)), 'rb') as f:
+        activity_network = pk.load(f)
 
-    case_data = pd.read_excel(navipath.case(case_num))
-    works = defaultdict(list)
-    for idx, line in case_data.iterrows():
-        x = int(line['x'])
-        y = int(line['y'])
-        z = int(line['z'])
-        location = '{}_{}_{}'.format(x, y, z)
+    CompiledActivityBook.build(activity_book, activity_network, key, key_errors=key_errors)
+
+    print('============================================================')
+    print('Compile ActivityBook')
+    print('  | fdir : {}'.format(navipath.fdir_cache))
+    print('  | key  : {}'.format(key))
+
+def restore_activity_book(key):
+    '''
+    Copy the activity book and network of unchanged templates from the cache, instead of parsing the templates again.
+    The key errors and the cycles of the cached templates are reported as if the templates were parsed.
+    '''
+
+    global fname_activity_book
+    global fname_activity_network
+
+    fdir = os.path.sep.join((navipath.fdir_cache, key))
+    for fname_cache, fname in (('activity_book.pk', fname_activity_book), ('activity_network.pk', fname_activity_network)):
+        with RunContext.current().atomic_path(os.path.sep.join((navipath.fdir_component, fname))) as fpath:
+            shutil.copyfile(os.path.sep.join((fdir, fname_cache)), fpath)
+
+    print('============================================================')
+    print('Restore ActivityBook from cache')
+    print('  | fdir : {}'.format(fdir))
+
+    compiled_activity_book = CompiledActivityBook.load(key)
+    report_activity_order(compiled_activity_book.key_errors, compiled_activity_book.cycles)
 
-        try:
-            activity_code = line['code']
-            activity = activity_book[activity_code]
-        except KeyError:
-            continue
+def define_works(case_num, activity_book=None, case_data=None):
+    '''
+    Define the works of each location from the case data (i.e., "data/case_{case_num}.xlsx" unless the DataFrame is given),
+    and return the works as arrays of activity ids with the code table that the ids refer to (i.e., the codes of the activity book).
+    '''
 
-        works[location].append(activity)
+    global fname_activity_book
 
-    return works
+    if activity_book is None:
+        with open(os.path.sep.join((navipath.fdir_component, fname_activity_book)), 'rb') as f:
+            activity_book = pk.load(f)
+    else:
+        pass
 
-def initiate_project(case_num, duration):
-    works = define_works(case_num)
-    grids = []
-    for loc in works:
-        grids.append(Grid(location=loc, works=works[loc]))
+    if case_data is None:
+        case_data = pd.read_excel(navipath.case(case_num))
+    else:
+        pass
+
+    codes = list(activity_book.keys())
+    is_known = case_data['code'].isin(codes)
+    key_errors = case_data.loc[~is_known, 'code'].value_counts(dropna=False, sort=False)
+    case_data = case_data.loc[is_known]
 
-    project = Project(grids=grids, duration=duration)
+    locations = case_data['x'].astype(int).astype(str)+'_'+case_data['y'].astype(int).astype(str)+'_'+case_data['z'].astype(int).astype(str)
+    activity_ids = pd.Series(pd.Categorical(case_data['code'], categories=codes).codes, index=case_data.index)
+    works = defaultdict(list)
+    for location, ids in activity_ids.groupby(locations, sort=False):
+        works[location] = ids.to_numpy(dtype='i4')
+
+    if len(key_errors) > 0:
+        print('Errors on Case data')
+        for activity_code, count in key_errors.items():
+            print('  | Absent in ActivityBook: {} ({:,d} rows)'.format(activity_code, count))
+    else:
+        pass
+
+    return works, codes
+
+def initiate_project(case_num, duration, activity_book=None, case_data=None):
+    works, codes = define_works(case_num, activity_book=activity_book, case_data=case_data)
+    project = Project(grids=GridTable.from_works(works, codes), duration=duration)
     project.summary()
 
-    os.makedirs(navipath.fdir_proj, exist_ok=True)
-    with open(navipath.proj(case_num), 'wb') as f:
+    with RunContext.current().open_atomic(navipath.proj(case_num), 'wb') as f:
         pk.dump(project, f)
 
     print('============================================================')
     print('Init Project')
     print('  | fdir : {}'.format(navipath.fdir_proj))
     print('  | fname: {}'.format(os.path.basename(navipath.proj(case_num))))
+    return project
 
 def export_initial_schedule(case_num):
     with open(navipath.proj(case_num), 'rb') as f:
@@ -177,6 +229,7 @@ def export_initial_schedule(case_num):
 if __name__ == '__main__':
     ## Project Constraints
     fname_activity_book = 'activity_book.pk'
+    fname_activity_network = 'activity_network.pk'
 
     try:
         case_num = str(sys.argv[1])
@@ -191,11 +244,15 @@ if __name__ == '__main__':
         sys.exit()
 
     ## Activity Book
-    init_activity_book()
-    set_orders_in_activity_book()
+    key = CompiledActivityBook.template_key([navipath.activity_table, navipath.activity_order])
+    if CompiledActivityBook.exists(key):
+        restore_activity_book(key)
+    else:
+        init_activity_book()
+        key_errors = set_orders_in_activity_book()
+        compile_activity_book(key, key_errors)
 
     ## Project
-    define_works(case_num)
     initiate_project(case_num, duration)
 
     ## Schedule
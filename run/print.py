@@ -8,7 +8,7 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from naviutil import NaviPath, NaviFunc, NaviIO
+from naviutil import NaviPath, NaviFunc, NaviIO, IterationHistory
 navipath = NaviPath()
 navifunc = NaviFunc()
 naviio = NaviIO()
@@ -16,30 +16,57 @@ naviio = NaviIO()
 import time
 
 
-if __name__ == '__main__':
-    ## Load project
-    activity_book = naviio.import_activity_book()
+def print_record(history, schedule):
+    iteration, stage = history.current
+    constraint = stage.split('-')[-1]
+
+    print('\n'*30+'============================================================')
+    print('Iteration: {:4} / Constraint: {}'.format(iteration, constraint))
+    navifunc.print_work_plan(schedule=schedule)
+
+def replay(history):
+    '''
+    Print every record of the run in order.
+    '''
+
+    print('\n'*30)
+    time.sleep(2)
+    for position in range(len(history)):
+        print_record(history, history.get(position))
+        time.sleep(1)
+
+def browse(history, iteration):
+    '''
+    Print the records from the iteration, moving by the commands:
+        [Enter] or "n": next record, "p": previous record, a number: the first record of the iteration, "q": quit.
+    '''
 
+    schedule = history.seek(iteration)
+    while True:
+        print_record(history, schedule)
+        command = input('  | [n]ext / [p]revious / <iteration> / [q]uit: ').strip()
+
+        if command in ('', 'n'):
+            schedule = history.step(1)
+        elif command == 'p':
+            schedule = history.step(-1)
+        elif command.isdigit():
+            schedule = history.seek(int(command))
+        elif command == 'q':
+            break
+        else:
+            continue
+
+
+if __name__ == '__main__':
     try:
         case_id = str(sys.argv[1])
     except:
         print('Insert project case number: ')
         sys.exit()
 
-    fdir = os.path.sep.join((navipath.fdir_schedule, 'C-{}'.format(case_id)))
-    flist = [fname for fname in os.listdir(fdir) if fname.startswith('I')]
-
-    print('\n'*30)
-    time.sleep(2)
-    for fname in sorted(flist):
-        iteration_part, constraint_part = fname.replace('.xlsx', '').split('_')
-        iteration = iteration_part.split('-')[-1]
-        constraint = constraint_part.split('-')[-1]
-
-        fpath = os.path.sep.join((fdir, fname))
-        schedule = naviio.xlsx2schedule(activity_book, fpath=fpath)
-
-        print('\n'*30+'============================================================')
-        print('Iteration: {:4} / Constraint: {}'.format(iteration, constraint))
-        navifunc.print_work_plan(schedule=schedule)
-        time.sleep(1)
\ No newline at end of file
+    with IterationHistory(navipath.iteration_log(case_id)) as history:
+        if len(sys.argv) > 2:
+            browse(history, iteration=int(sys.argv[2]))
+        else:
+            replay(history)
\ No newline at end of file
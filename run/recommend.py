@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Recommend productivity adjustments when the updated schedule cannot finish within the planned duration (i.e., Project.duration).
+The engine searches the per-activity productivity increases, evaluates each scenario with a ConstraintPropagator on a process pool,
+and returns the cheapest sets (i.e., the least additional productivity) that finish in time.
+
+Usage:
+    python run/recommend.py <case> [duration] [--options 3] [--workers N] [--max-evaluations 500]
+'''
+
+# Configuration
+import os
+import sys
+rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
+sys.path.append(rootpath)
+
+from naviutil import NaviPath, NaviFunc, NaviIO, RunContext
+navipath = NaviPath()
+navifunc = NaviFunc()
+naviio = NaviIO()
+
+import argparse
+import numpy as np
+import pandas as pd
+import pickle as pk
+from concurrent.futures import ProcessPoolExecutor
+
+import update
+
+
+## Evaluator
+def init_evaluator(activity_book, schedule, max_iteration):
+    '''
+    Set the activity book and the normalized schedule of a worker process once.
+    '''
+
+    global evaluator_schedule
+    global evaluator_max_iteration
+
+    update.activity_book = activity_book
+    evaluator_schedule = schedule
+    evaluator_max_iteration = max_iteration
+
+def evaluate(productivity):
+    '''
+    Update the schedule with the productivity scenario and return the expected duration (i.e., the last workday as Project.duration_expected),
+    the stop status, and the activity codes of which productivity is fully used on some day (i.e., the candidates to be increased).
+    '''
+
+    global evaluator_schedule
+    global evaluator_max_iteration
+
+    propagator = update.ConstraintPropagator(evaluator_schedule.copy(), productivity=productivity)
+    schedule = propagator.run(max_iteration=evaluator_max_iteration)
+    if propagator.revisited is not None:
+        status = 'cycle'
+    elif evaluator_max_iteration is not None and propagator.iteration >= evaluator_max_iteration:
+        status = 'max_iteration'
+    else:
+        status = 'converged'
+
+    days = schedule.duration
+    max_counts = propagator.counts[:days].max(axis=0) if days > 0 else np.zeros(len(schedule.codes), dtype='i4')
+    binding = [schedule.codes[activity_id] for activity_id in np.flatnonzero(max_counts >= propagator.productivity)]
+    return days-1, status, binding
+
+
+## Search
+def productivity_scenario(base_productivity, increments):
+    return {activity_code: base_productivity[activity_code]+increment for activity_code, increment in increments.items() if increment > 0}
+
+def scenario_key(increments):
+    return tuple(sorted((activity_code, increment) for activity_code, increment in increments.items() if increment > 0))
+
+def dominates(increments, solution):
+    '''
+    Check whether the increments include the solution (i.e., at least the same increase for every activity of the solution).
+    '''
+
+    return all(increments.get(activity_code, 0) >= increment for activity_code, increment in solution.items())
+
+class ProductivitySearch:
+    '''
+    A class to search the productivity increases that finish the project within the planned duration.
+    The scenarios are evaluated on a process pool in batches, and each scenario is evaluated only once.
+
+    Attributes
+    ----------
+    base_productivity : dict
+        | The current productivity of the activities in the schedule (i.e., the finite ones).
+    capacities : dict
+        | The number of locations of each activity. A larger productivity is never used.
+    evaluations : dict
+        | The evaluated scenarios, i.e., {scenario_key: (expected duration, status, binding activities)}.
+    exhausted : bool
+        | Whether the max_evaluations has been reached (i.e., the scenarios beyond it are not evaluated).
+
+    Methods
+    -------
+    evaluate_batch
+        | Evaluate the scenarios in parallel.
+    ascend
+        | Increase the productivity of every fully used activity by 1 until the project finishes in time.
+    descend
+        | Reduce the increases (the cheapest scenario first) as long as the project finishes in time, avoiding the scenarios that include an excluded (i.e., found) one.
+    '''
+
+    def __init__(self, executor, schedule, activity_book, duration, max_evaluations):
+        self.executor = executor
+        self.duration = duration
+        self.max_evaluations = max_evaluations
+
+        self.base_productivity = {}
+        for activity_code in schedule.codes:
+            try:
+                productivity = float(activity_book[activity_code].productivity)
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            if np.isfinite(productivity):
+                self.base_productivity[activity_code] = int(productivity)
+            else:
+                continue
+
+        self.capacities = {activity_code: int((schedule.cells == schedule.code2id[activity_code]).any(axis=1).sum()) for activity_code in self.base_productivity}
+        self.evaluations = {}
+
+    def evaluate_batch(self, scenarios):
+        keys = []
+        for increments in scenarios:
+            key = scenario_key(increments)
+            if key not in self.evaluations and key not in keys and len(self.evaluations)+len(keys) < self.max_evaluations:
+                keys.append(key)
+            else:
+                continue
+
+        results = self.executor.map(evaluate, [productivity_scenario(self.base_productivity, dict(key)) for key in keys])
+        for key, result in zip(keys, results):
+            self.evaluations[key] = result
+
+        return [self.evaluations.get(scenario_key(increments)) for increments in scenarios]
+
+    @property
+    def exhausted(self):
+        return len(self.evaluations) >= self.max_evaluations
+
+    def feasible(self, result):
+        return result is not None and result[0] <= self.duration
+
+    def ascend(self):
+        increments = {}
+        while True:
+            result = self.evaluate_batch([increments])[0]
+            if result is None:
+                return None
+            elif self.feasible(result):
+                return increments
+            else:
+                pass
+
+            increased = False
+            for activity_code in result[2]:
+                if activity_code in self.base_productivity and self.base_productivity[activity_code]+increments.get(activity_code, 0) < self.capacities[activity_code]:
+                    increments[activity_code] = increments.get(activity_code, 0)+1
+                    increased = True
+                else:
+                    continue
+
+            if not increased:
+                return None
+            else:
+                continue
+
+    def reductions(self, increments):
+        scenarios = []
+        for activity_code, increment in sorted(increments.items()):
+            for step in sorted({increment, (increment+1)//2, 1}, reverse=True):
+                scenario = dict(increments)
+                if step == increment:
+                    del scenario[activity_code]
+                else:
+                    scenario[activity_code] = increment-step
+                scenarios.append(scenario)
+
+        return scenarios
+
+    def feasible_reductions(self, increments):
+        scenarios = self.reductions(increments)
+        results = self.evaluate_batch(scenarios)
+        candidates = [(sum(scenario.values()), result[0], scenario_key(scenario), scenario) for scenario, result in zip(scenarios, results) if self.feasible(result)]
+        return [scenario for _, _, _, scenario in sorted(candidates, key=lambda x:x[:3])]
+
+    def descend(self, increments, excluded=()):
+        while True:
+            candidates = [candidate for candidate in self.feasible_reductions(increments) if not any(dominates(candidate, solution) for solution in excluded)]
+            if candidates:
+                increments = candidates[0]
+            else:
+                return increments
+
+def recommend(activity_book, schedule, duration, num_options=3, workers=None, max_evaluations=500, max_iteration=10000):
+    '''
+    Recommend the cheapest productivity increases (i.e., the least total increase) that finish the project within the planned duration.
+    The search ascends to a feasible scenario, and then descends from the cheapest reductions of it, avoiding the options found before.
+
+    Attributes
+    ----------
+    duration : int
+        | The planned duration of the project.
+    num_options : int
+        | The number of recommended options.
+    max_evaluations : int
+        | The maximum number of evaluated scenarios.
+
+    Returns
+    -------
+    options : list
+        | A list of (total increase, expected duration, {activity_code: productivity}) from the cheapest.
+    baseline : tuple
+        | The (expected duration, status) of the current productivity, or (None, None) if it has not been evaluated within the max_evaluations.
+    exhausted : bool
+        | Whether the search has reached the max_evaluations, so that fewer options (or none) than num_options may have been found.
+    '''
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_evaluator, initargs=(activity_book, schedule, max_iteration)) as executor:
+        search = ProductivitySearch(executor, schedule, activity_book, duration, max_evaluations)
+        result = search.evaluate_batch([{}])[0]
+        if result is None:
+            return [], (None, None), search.exhausted
+        else:
+            expected, status, _ = result
+
+        if expected <= duration:
+            return [], (expected, status), search.exhausted
+        else:
+            pass
+
+        increments = search.ascend()
+        if increments is None:
+            return [], (expected, status), search.exhausted
+        else:
+            pass
+
+        solutions = {}
+        for seed in search.feasible_reductions(increments) or [increments]:
+            if len(solutions) >= num_options:
+                break
+            elif any(dominates(seed, solution) for solution in solutions.values()):
+                continue
+            else:
+                solution = search.descend(seed, excluded=list(solutions.values()))
+                solutions[scenario_key(solution)] = solution
+
+    options = []
+    for key, solution in solutions.items():
+        options.append((sum(solution.values()), search.evaluations[key][0], productivity_scenario(search.base_productivity, solution)))
+
+    options = sorted(options, key=lambda x:(x[0], x[1]))[:num_options]
+    return options, (expected, status), search.exhausted
+
+
+## Report
+def print_recommendation(case_id, activity_book, duration, options, baseline, exhausted, num_options, max_evaluations):
+    '''
+    Print the recommended options of recommend() and export them to "C-{case_id}/recommendations.xlsx".
+    Return whether any option has been found.
+    '''
+
+    expected, status = baseline
+
+    print('============================================================')
+    print('Productivity Recommendation')
+    print('  | Planned : {:,} days'.format(duration))
+    if expected is None:
+        print('  | Expected: unknown (no scenario has been evaluated within {:,} evaluations)'.format(max_evaluations))
+        return False
+    else:
+        print('  | Expected: {:,} days ({})'.format(expected, status))
+
+    if expected <= duration:
+        print('  | No adjustment is needed.')
+        return False
+    elif not options and exhausted:
+        print('  | No feasible option has been found within {:,} evaluations (see --max-evaluations).'.format(max_evaluations))
+        return False
+    elif not options:
+        print('  | No feasible option: the productivity of the fully used activities cannot be increased any further.')
+        return False
+    elif len(options) < num_options and exhausted:
+        print('  | Only {:,} options have been found within {:,} evaluations (see --max-evaluations).'.format(len(options), max_evaluations))
+    else:
+        pass
+
+    records = []
+    for option, (cost, expected_option, productivity) in enumerate(options, start=1):
+        adjustments = ['{}: {} -> {}'.format(activity_code, activity_book[activity_code].productivity, value) for activity_code, value in sorted(productivity.items())]
+        print('Option {}: +{:,} productivity -> {:,} days'.format(option, cost, expected_option))
+        for adjustment in adjustments:
+            print('  | {}'.format(adjustment))
+
+        records.append({'option': option, 'increase': cost, 'duration_expected': expected_option, 'adjustments': ', '.join(adjustments)})
+
+    fpath = os.path.sep.join((navipath.fdir_schedule, 'C-{}'.format(case_id), 'recommendations.xlsx'))
+    with RunContext.current().atomic_path(fpath) as fpath_tmp:
+        pd.DataFrame(records).set_index('option').to_excel(fpath_tmp)
+
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recommend productivity adjustments to finish the project within the planned duration.')
+    parser.add_argument('case', help='project case number')
+    parser.add_argument('duration', type=int, nargs='?', default=None, help='planned duration (default: the duration of the project built by init.py)')
+    parser.add_argument('--options', type=int, default=3, help='the number of recommended options')
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker processes (default: the number of CPUs)')
+    parser.add_argument('--max-evaluations', type=int, default=500)
+    args = parser.parse_args()
+
+    ## Load project
+    activity_book = naviio.import_activity_book()
+    if activity_book is None:
+        sys.exit(1)
+    else:
+        pass
+    update.activity_book = activity_book
+    update.case_id = args.case
+
+    if args.duration is None:
+        with open(navipath.proj(args.case), 'rb') as f:
+            duration = pk.load(f).duration
+    else:
+        duration = args.duration
+
+    schedule = update.import_schedule(args.case)
+    schedule_normalized = update.normallize_duplicated_activity(schedule, save=False)
+
+    ## Recommend
+    options, (expected, status), exhausted = recommend(activity_book, schedule_normalized, duration,
+                                                       num_options=args.options,
+                                                       workers=args.workers,
+                                                       max_evaluations=args.max_evaluations)
+
+    found = print_recommendation(args.case, activity_book, duration, options, (expected, status), exhausted,
+                                 num_options=args.options,
+                                 max_evaluations=args.max_evaluations)
+    if not found and (expected is None or expected > duration):
+        sys.exit(1)
+    else:
+        pass
@@ -7,19 +7,24 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from naviutil import NaviPath
+from naviutil import NaviPath, RunContext
 navipath = NaviPath()
 
 import shutil
 
 
 def do_reset():
-    reset_dirs = [navipath.fdir_component, 
-                  navipath.fdir_proj, 
-                  navipath.fdir_schedule,]
+    '''
+    Remove the outputs (i.e., "proj" and "schedule") of the current run context only.
+    The shared components (e.g., the compiled activity books in "component/cache") are used by the other runs, and are rebuilt by "init.py" when the templates change.
+    '''
+
+    run_context = RunContext.current()
+    reset_dirs = [run_context.fdir_proj, 
+                  run_context.fdir_schedule,]
 
     print('============================================================')
-    print('RESET workspace')
+    print('RESET workspace (run: {})'.format(run_context.run_id))
     for dir in reset_dirs:
         try:
             shutil.rmtree(dir)
@@ -8,19 +8,27 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from naviutil import NaviPath, NaviFunc, NaviIO
+from naviutil import NaviPath, NaviFunc, NaviIO, Schedule, PrecedenceOracle, IterationLog, MetricsLog
 navipath = NaviPath()
 navifunc = NaviFunc()
 naviio = NaviIO()
 
 import time
+import heapq
 import shutil
 import itertools
+import numpy as np
 import pandas as pd
 import pickle as pk
 from copy import deepcopy
 from collections import defaultdict, Counter
 
+## The peak memory is only measured where the resource module is available (i.e., not on Windows).
+try:
+    import resource
+except ImportError:
+    resource = None
+
 
 ## Data Import
 def import_schedule(case_id):
@@ -35,21 +43,25 @@ def import_schedule(case_id):
         sys.exit(1)
 
 ## Duplicated Activity Normalization
-def normallize_duplicated_activity(schedule):
+def normallize_duplicated_activity(schedule, save=True):
     global case_id
 
-    schedule_normalized = defaultdict(dict)
-    for location in schedule:
-        schedule_normalized[location] = {}
+    schedule_normalized = Schedule(locations=schedule.locations, codes=schedule.codes, days=schedule.duration)
+    for idx, location in enumerate(schedule.locations):
+        local_schedule = schedule.local(location)
+        local_schedule = local_schedule[local_schedule != Schedule.EMPTY]
+        _, first_days = np.unique(local_schedule, return_index=True)
+        local_schedule = local_schedule[np.sort(first_days)]
 
-        day = 0
-        for activity_code in schedule[location].values():
-            if activity_code not in schedule_normalized[location].values():
-                schedule_normalized[location][day] = activity_code
-                day += 1
-            else:
-                continue
+        schedule_normalized.cells[idx, :len(local_schedule)] = local_schedule
+        schedule_normalized.lengths[idx] = len(local_schedule)
+
+    if not save:
+        return schedule_normalized
+    else:
+        pass
 
+    ## The schedule directory belongs to the current RunContext, so that only the outputs of this run are removed.
     fname = 'C-{}/normalized.xlsx'.format(case_id)
     fdir = os.path.sep.join((navipath.fdir_schedule, os.path.dirname(fname)))
     if os.path.exists(fdir):
@@ -60,256 +72,151 @@ def normallize_duplicated_activity(schedule):
 
 ## Modify Schedule
 def push_workdays_single_location(schedule, target_location, after):
-    schedule_updated = defaultdict(dict)
-    for location in schedule:
-        if location != target_location:
-            schedule_updated[location] = schedule[location]
-        else:
-            for day, activity_code in schedule[location].items():
-                if day >= after:
-                    schedule_updated[location][day+1] = activity_code
-                else:
-                    schedule_updated[location][day] = activity_code
-            schedule_updated[location][after] = '------'
-    return schedule_updated
+    schedule.shift([target_location], after)
+    return schedule
 
 def push_workdays_single_location_pre_dist(schedule, target_location, after):
-    schedule_updated = defaultdict(dict)
-    for location in schedule:
-        if location == target_location:
-            for day, activity_code in schedule[location].items():
-                if day >= after:
-                    schedule_updated[location][day + 1] = activity_code
-                else:
-                    schedule_updated[location][day] = activity_code
-            schedule_updated[location][after] = '------'
-        else:
-            schedule_updated[location] = schedule[location]
-    return schedule_updated
+    schedule.shift([target_location], after)
+    return schedule
+
+def push_workdays_multiple_locations(schedule, target_locations, after, days=1):
+    schedule.shift(target_locations, after, days=days)
+    return schedule
 
 ## Activity Order Constraint
-def check_activity_order_within_work(local_schedule, activity_code):
+def check_activity_order_within_work(schedule, local_schedule, workday):
     global activity_book
 
-    workday = [day for day in local_schedule.keys() if local_schedule[day] == activity_code][0]
+    precedence_oracle = navifunc.precedence_oracle(activity_book)
+    orders = precedence_oracle.classify(schedule, local_schedule[workday], local_schedule[workday:])
 
     conflict_items = []
-    for day in range(workday, max(local_schedule.keys())+1, 1):
-        try:
-            activity_code2 = local_schedule[day]
-            activity_1 = activity_book[activity_code]
-            activity_2 = activity_book[activity_code2]
-        except KeyError:
-            continue
-        
-        if activity_code2 in activity_1.successor:
-            order = 'fine'
-        elif activity_code2 in activity_1.predecessor:
-            order = 'conflict'
-        else:
-            order = 'irrelevant'
-
-        if order == 'conflict':
-            conflict_items.append((day, activity_code2))
+    for day in np.flatnonzero(orders == PrecedenceOracle.PREDECESSOR)+workday:
+        conflict_items.append((int(day), schedule.codes[local_schedule[day]]))
 
     return conflict_items
 
-def reorder_activity(local_schedule, activity_code, conflict_items):
-    local_schedule_updated = {}
-
-    current = [day for day in local_schedule.keys() if local_schedule[day] == activity_code][0]
+def reorder_activity(local_schedule, current, conflict_items):
     move_to = max([day for day, _ in conflict_items])
 
-    for day in range(0, len(local_schedule), 1):
-        if day < current or day > move_to:
-            local_schedule_updated[day] = local_schedule[day]
-        elif day == current:
-            local_schedule_updated[move_to] = local_schedule[day]
-        else:
-            local_schedule_updated[day-1] = local_schedule[day]
+    activity_id = local_schedule[current]
+    local_schedule[current:move_to] = local_schedule[current+1:move_to+1]
+    local_schedule[move_to] = activity_id
 
-    return {d: a for d, a in sorted(local_schedule_updated.items(), key=lambda x:x[0])}
+def update_order_in_local_schedule(schedule, location, verbose_local=False, verbose_conflict=False):
+    '''
+    Move each activity after its latest conflicting predecessor until no conflict remains.
+    The activities before the current day are not affected by the reordering, so the search resumes from the current day.
+    '''
+
+    local_schedule = schedule.edit(location)
+
+    day = 0
+    while day < len(local_schedule):
+        conflict_items = check_activity_order_within_work(schedule, local_schedule, day)
 
-def update_order_in_local_schedule(local_schedule, verbose_local=False, verbose_conflict=False):
-    for day, activity_code in sorted(local_schedule.items(), key=lambda x:x[0]):
-        conflict_items = check_activity_order_within_work(local_schedule, activity_code)
-        
         if verbose_local:
-            print('{:2}: {}'.format(day, activity_code))
+            print('{:2}: {}'.format(day, schedule.codes[local_schedule[day]]))
         else:
             pass
 
         if conflict_items:
             if verbose_conflict:
                 for conflicted_day, conflicted_activity_code in conflict_items:
-                    print('  | Conflicts at {}({}) <-> {}({})'.format(activity_code, day, conflicted_activity_code, conflicted_day))
+                    print('  | Conflicts at {}({}) <-> {}({})'.format(schedule.codes[local_schedule[day]], day, conflicted_activity_code, conflicted_day))
             else:
                 pass
 
-            local_schedule_updated = deepcopy(reorder_activity(local_schedule, activity_code, conflict_items))
-            return local_schedule_updated
+            reorder_activity(local_schedule, day, conflict_items)
         else:
-            continue
-
-    return local_schedule
+            day += 1
 
 def activity_order_constraint(schedule, verbose_local=False, verbose_conflict=False):
-    schedule_updated = deepcopy(schedule)
+    schedule_updated = schedule.copy()
 
-    iteration = 0
-    for location in schedule.keys():
-        local_schedule_original = deepcopy(schedule[location])
-
-        while True:
-            iteration += 1
-            local_schedule_updated = deepcopy(update_order_in_local_schedule(local_schedule=local_schedule_original, verbose_local=verbose_local, verbose_conflict=verbose_conflict))
-            if navifunc.compare_local_schedule(local_schedule_original, local_schedule_updated) == 'same':
-                schedule_updated[location] = deepcopy(local_schedule_updated)
-                break
-            else:
-                local_schedule_original = deepcopy(local_schedule_updated)
+    for location in schedule_updated:
+        update_order_in_local_schedule(schedule_updated, location, verbose_local=verbose_local, verbose_conflict=verbose_conflict)
 
     return schedule_updated
 
 
 ## Activity Predecessor Distance Constraint
-def find_influence_locations(location_list, current_location, activity_code):
-    influenced_locations = []
+def get_pre_dist(activity_code):
+    global activity_book
 
     try:
-        pre_dist = activity_book[activity_code].pre_dist
-        if pre_dist == 'NA':
-            return []
-        else:
-            # for comparing_location in schedule:
-            #     if comparing_location == current_location:
-            #         continue
-            #     else:
-            #         for location in current_location:
-            x, y, z = current_location.split("_")
-            pre_dist1 = pre_dist
-            pre_dist2 = pre_dist
-            pre_dist_z1 = 1
-            pre_dist_z2 = int(-1)
-            x = int(x)
-            y = int(y)
-            z = int(z)
-            pre_dist_location_x_list = []
-            pre_dist_location_y_list = []
-            pre_dist_location_z_list = [z]
-            while pre_dist1 > 0:
-                pred_dist_x1 = x + pre_dist1
-                pre_dist_location_x_list.append(pred_dist_x1)
-                pred_dist_y1 = y + pre_dist1
-                pre_dist_location_y_list.append(pred_dist_y1)
-                pre_dist1 = pre_dist1 - 1
-
-            while pre_dist2 >= 0:
-                pred_dist_x2 = x - pre_dist2
-                pred_dist_y2 = y - pre_dist2
-                if pred_dist_x2 > 0:
-                    pre_dist_location_x_list.append(pred_dist_x2)
-                if pred_dist_y2 > 0:
-                    pre_dist_location_y_list.append(pred_dist_y2)
-                pre_dist2 = pre_dist2 - 1
-
-            # if 'D' in check_pre_dist_act:
-            #     pred_dist_z = z + pre_dist_z1
-            #     pre_dist_location_z_list.append(pred_dist_z)
-            # elif 'S' in check_pre_dist_act:
-            #     pred_dist_z = z + pre_dist_z2
-            #     pre_dist_location_z_list.append(pred_dist_z)
-
-        # making influence grid
-        # 특정 작업의 영향거리 내 Location만들기1
-
-        a_influence_locations = []
-        for x in pre_dist_location_x_list:
-            x = str(x)
-            for y in pre_dist_location_y_list:
-                y = str(y)
-                for z in pre_dist_location_z_list:
-                    z = str(z)
-                    influence_x_y_z = []
-                    influence_x_y_z.append(x)
-                    influence_x_y_z.append(y)
-                    influence_x_y_z.append(z)
-                    influence_location = '_'.join(influence_x_y_z)
-                    a_influence_locations.append(influence_location)
-
-        # 자신의 그리드 제거
-        if current_location in a_influence_locations:
-            a_influence_locations.remove(current_location)
-
-        # 존재하는 그리드만 남기기
-        # influenced_locations = []
-        for location in schedule.keys():
-            if location in a_influence_locations:
-                influenced_locations.append(location)
-            else:
-                continue
+        return int(activity_book[activity_code].pre_dist)
+    except (KeyError, TypeError, ValueError):
+        return None
 
+def find_influence_locations(schedule, current_location, activity_code):
+    global activity_book
 
-    except KeyError:
-        pass
-
-    return influenced_locations
+    pre_dist = get_pre_dist(activity_code)
+    if pre_dist is None:
+        return []
+    else:
+        neighbourhood_index = navifunc.neighbourhood_index(activity_book, schedule)
+        neighbours = neighbourhood_index.neighbours(schedule.location2idx[current_location], pre_dist)
+        return [schedule.locations[idx] for idx in neighbours]
 
 def check_pre_dist(schedule, location, day, activity_code):
     global activity_book
-    target_locations = []
-    location_list = list(schedule.keys())
-    influenced_locations = find_influence_locations(location_list=location_list, current_location=location, activity_code=activity_code)
 
-    if influenced_locations:
-        pass
+    pre_dist = get_pre_dist(activity_code)
+    if pre_dist is None:
+        return []
+    else:
+        neighbourhood_index = navifunc.neighbourhood_index(activity_book, schedule)
+        neighbours = neighbourhood_index.neighbours(schedule.location2idx[location], pre_dist)
+
+    ## 영향거리 내 작업 중 현재 작업의 선행작업이 있으면 현재 작업을 다음날로 미룹니다.
+    activity_id = schedule.code2id[activity_code]
+    existing_activity_ids = schedule.column(day)[neighbours]
+    orders = navifunc.precedence_oracle(activity_book).classify(schedule, activity_id, existing_activity_ids)
+    if np.any((orders & PrecedenceOracle.PREDECESSOR).astype(bool) & (existing_activity_ids != activity_id)):
+        return set([location])
     else:
         return []
 
-    existing_activity_codes = []
-    for influenced_location in influenced_locations:
-        try:
-            existing_activity_code = schedule[influenced_location][day]
-            if existing_activity_code == '------':
-                continue
-            elif existing_activity_code == activity_code:
-                continue
-            else:
-                existing_activity_codes.append((existing_activity_code, influenced_location))
-        except KeyError:
-            continue
+def check_pre_dist_day(schedule, day):
+    '''
+    Return the indices of locations that violate the pre_dist constraint on the day, as a sparse lookup over the day column.
+    '''
 
-    if not existing_activity_codes:
+    global activity_book
 
-        return []
-    else:
-        # target_locations = []
-        for existing_activity_code, influenced_location in existing_activity_codes:
+    neighbourhood_index = navifunc.neighbourhood_index(activity_book, schedule)
+    precedence_oracle = navifunc.precedence_oracle(activity_book)
+    pre_dists = np.array([-1 if get_pre_dist(activity_code) is None else get_pre_dist(activity_code) for activity_code in schedule.codes]+[-1])
 
-            ## 두 activity_code 사이의 순서를 확인하는 코드입니다. 이걸 활용하시면 선행/후행 작업을 판단할 수 있습니다.
-            ## activity_code1이 activity_code2보다 선행되어야 하는 작업이면 FINE, 반대라면 CONFLICT가 도출됩니다.
-            order_check = navifunc.order_bw_activity(activity_book=activity_book, activity_code1=activity_code, activity_code2=existing_activity_code)
-            if order_check == 'PASS':
-                continue
-            elif order_check == 'TO_BE_MOVED':
-                target_locations.append(location)
-            else:
-                continue
-            ##
+    column = schedule.column(day)
+    violated = np.zeros(len(column), dtype=bool)
+    for pre_dist in neighbourhood_index.pre_dists:
+        sources, targets = neighbourhood_index.pairs(pre_dist)
+        within = pre_dists[column[sources]] == pre_dist
+        sources, targets = sources[within], targets[within]
 
-        target_locations = set(target_locations)
-        return target_locations
+        orders = precedence_oracle.relation[precedence_oracle.index(schedule)[column[sources]], precedence_oracle.index(schedule)[column[targets]]]
+        conflicts = (orders & PrecedenceOracle.PREDECESSOR).astype(bool) & (column[sources] != column[targets])
+        violated[sources[conflicts]] = True
+
+    return np.flatnonzero(violated)
 
 def activity_predecessor_completion_constraint(schedule):
-    schedule_updated = deepcopy(schedule)
-    daily_work_plan = navifunc.build_daily_work_plan(schedule_updated)
+    schedule_updated = schedule.copy()
 
     for location in sorted(schedule_updated.keys()):
-        for day, activity_code in sorted(schedule_updated[location].items(), key=lambda x:x[0]):
+        for day, activity_id in enumerate(schedule_updated.local(location)):
+            if activity_id == Schedule.EMPTY:
+                continue
+            else:
+                activity_code = schedule_updated.codes[activity_id]
+
             target_locations = check_pre_dist(schedule=schedule_updated, location=location, day=day, activity_code=activity_code)
             if target_locations:
                 for target_location in target_locations:
-                    schedule_updated = deepcopy(push_workdays_single_location_pre_dist(schedule=schedule_updated, target_location=target_location, after=day))
+                    schedule_updated = push_workdays_single_location_pre_dist(schedule=schedule_updated, target_location=target_location, after=day)
                     break
                 else:
                     continue
@@ -328,20 +235,19 @@ def activity_predecessor_completion_constraint(schedule):
 def activity_productivity_constraint(schedule):
     global activity_book
 
-    daily_work_plan = navifunc.build_daily_work_plan(schedule)
-    schedule_updated = deepcopy(schedule)
-    for day in sorted(daily_work_plan.keys(), reverse=False):
-        activity_counter = defaultdict(list)
-        for location, activity_code in daily_work_plan[day].items():
-            activity_counter[activity_code].append(location)
-            pass
+    schedule_updated = schedule.copy()
+    for day in range(schedule.duration):
+        column = schedule.column(day)
+        activity_ids, first_locations, counts = np.unique(column[column != Schedule.EMPTY], return_index=True, return_counts=True)
 
-        for activity_code, location_list in activity_counter.items():
-            count = len(location_list)
+        for order in np.argsort(first_locations, kind='stable'):
+            activity_id = activity_ids[order]
+            activity_code = schedule.codes[activity_id]
+            count = int(counts[order])
             if navifunc.check_productivity_overload(activity_book, activity_code, count) == 'overloaded':
                 num_overloaded = (count-activity_book[activity_code].productivity)
-                for target_location in location_list[:num_overloaded]:
-                    schedule_updated = deepcopy(push_workdays_single_location(schedule=schedule_updated, target_location=target_location, after=day))
+                location_list = [schedule.locations[idx] for idx in np.flatnonzero(column == activity_id)]
+                schedule_updated = push_workdays_multiple_locations(schedule=schedule_updated, target_locations=location_list[:num_overloaded], after=day)
                 break
             else:
                 continue
@@ -387,87 +293,590 @@ def compress_schedule(schedule):
         return schedule_updated
 
 
-## Update schedule
-def update(schedule_original, do_order, do_pre_dist, do_productivity, do_compress, save_log, sleep_for_verbose):
-    global case_id
-
-    times = []
-    iteration = 0
-    running_time = 0
-    schedule_updated = deepcopy(schedule_original)
+## Constraint Propagation
+def peak_memory():
+    '''
+    Return the peak resident memory of the process in KB (None if the resource module is unavailable).
+    '''
 
-    while True:
-        print('\r  | Iteration: {:,d}'.format(iteration), end='')
-        start_time = time.time()
-        schedule_before = deepcopy(schedule_updated)
-        
-        ## Activity Order Constraint
+    if resource is None:
+        return None
+    elif sys.platform == 'darwin':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//1024
+    else:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class ConstraintPropagator:
+    '''
+    A worklist-driven engine that repeats the order, pre_dist, and productivity stages until no stage changes the schedule.
+    By default, each stage repairs only the first violation per round in the same manner as the stage functions above, so that the result is the same as the former fixed-point loop.
+    With drain=True, each stage drains its queue: it repairs every queued violation in order, and the cells touched by the repairs are queued to be checked again in the same call.
+    The drained rounds are much fewer, but the schedule may differ from the fixed point (e.g., a shorter duration).
+
+    Attributes
+    ----------
+    schedule : Schedule
+        | The schedule to be updated in place.
+    iteration : int
+        | The number of rounds (i.e., order -> pre_dist -> productivity) that changed the schedule.
+    drain : bool
+        | Whether each stage repairs all queued violations (True) or only the first one (False) per round.
+    deadline : float
+        | The time.perf_counter() at which the stages stop draining (None for no limit).
+    neighbourhood_index : NeighbourhoodIndex
+        | The influence locations of the schedule locations.
+    pre_dist_queue : list
+        | A heap of (location rank, day) cells of which the pre_dist constraint should be checked again.
+    productivity_queue : list
+        | A heap of (day, activity id) pairs of which the productivity constraint should be checked again.
+    fingerprints : dict
+        | The iteration at which each schedule fingerprint was reached.
+    revisited : int
+        | The former iteration of which the schedule has been reached again (None if the schedule has not returned to an earlier state).
+    best_schedule : Schedule
+        | The best schedule seen so far, which has the least violations and then the shortest duration.
+    best_score : tuple
+        | The (violations, duration) of the best schedule.
+    best_iteration : int
+        | The iteration at which the best schedule was reached.
+    hooks : list
+        | The functions called with the metrics record of each stage and round (nothing is measured without hooks).
+    cells_moved : int
+        | The number of cells that have been changed by the stages.
+
+    Methods
+    -------
+    order_stage
+        | Reorder the activities of the locations in the order queue.
+    pre_dist_stage
+        | Repair the cells that violate the pre_dist constraint.
+    productivity_stage
+        | Repair the (day, activity) pairs that violate the productivity constraint.
+    count_violations
+        | Count the remaining violations of the constraints.
+    add_hook
+        | Register a function that receives the metrics records.
+    step
+        | Run a round of the stages.
+    run
+        | Run the rounds until the schedule does not change (or returns to an earlier state).
+    '''
+
+    def __init__(self, schedule, do_order=True, do_pre_dist=True, do_productivity=True, productivity=None, drain=False):
+        '''
+        Attributes
+        ----------
+        productivity : dict
+            | A dictionary of which keys are activity codes and values are the productivity that overrides the activity book (e.g., a recommendation scenario).
+        drain : bool
+            | Whether each stage repairs all queued violations in a call. (default : False)
+        '''
+
+        global activity_book
+
+        self.schedule = schedule
+        self.iteration = 0
+        self.drain = drain
+        self.deadline = None
+        self.fingerprints = {schedule.fingerprint: 0}
+        self.revisited = None
+        self.stages = []
         if do_order:
-            schedule_updated = deepcopy(activity_order_constraint(schedule_updated, verbose_local=False, verbose_conflict=False))
-            if save_log:
-                naviio.schedule2xlsx(schedule_updated, fname='C-{}/I-{:04d}_01-order.xlsx'.format(case_id, iteration), verbose=False)
+            self.stages.append(('01-order', self.order_stage))
+        if do_pre_dist:
+            self.stages.append(('02-predist', self.pre_dist_stage))
+        if do_productivity:
+            self.stages.append(('03-productivity', self.productivity_stage))
+
+        self.sorted_idx = sorted(range(len(schedule.locations)), key=lambda idx:schedule.locations[idx])
+        self.ranks = np.empty(len(self.sorted_idx), dtype='i4')
+        self.ranks[self.sorted_idx] = np.arange(len(self.sorted_idx))
+        self.neighbourhood_index = navifunc.neighbourhood_index(activity_book, schedule)
+        self.max_pre_dist = max(self.neighbourhood_index.pre_dists, default=0)
+
+        self.productivity = np.full(len(schedule.codes), np.inf)
+        for activity_id, activity_code in enumerate(schedule.codes):
+            try:
+                if productivity is not None and activity_code in productivity:
+                    self.productivity[activity_id] = float(productivity[activity_code])
+                else:
+                    self.productivity[activity_id] = float(activity_book[activity_code].productivity)
+            except (KeyError, TypeError, ValueError):
+                continue
+        self.pre_dists = np.array([-1 if get_pre_dist(activity_code) is None else get_pre_dist(activity_code) for activity_code in schedule.codes]+[-1])
+
+        self.counts = np.zeros((max(schedule.duration, 1), len(schedule.codes)), dtype='i4')
+        for idx in range(len(schedule.locations)):
+            local_schedule = schedule.cells[idx, :schedule.lengths[idx]]
+            days = np.flatnonzero(local_schedule != Schedule.EMPTY)
+            np.add.at(self.counts, (days, local_schedule[days]), 1)
+
+        self.order_queue = list(range(len(schedule.locations)))
+
+        self.pre_dist_queue = []
+        for day in range(schedule.duration):
+            for idx in check_pre_dist_day(schedule, day):
+                self.pre_dist_queue.append((int(self.ranks[idx]), day))
+        heapq.heapify(self.pre_dist_queue)
+        self.pre_dist_pending = set(self.pre_dist_queue)
+
+        overloaded_days, overloaded_ids = np.nonzero(self.counts > self.productivity)
+        self.productivity_queue = [(int(day), int(activity_id)) for day, activity_id in zip(overloaded_days, overloaded_ids)]
+        heapq.heapify(self.productivity_queue)
+        self.productivity_pending = set(self.productivity_queue)
+
+        self.best_schedule = schedule.copy()
+        self.best_score = (np.inf, schedule.duration)
+        self.best_iteration = 0
+
+        self.hooks = []
+        self.cells_moved = 0
+
+    def touch(self, idx, start, local_schedule_before):
+        '''
+        Update the activity counts and the queues after the local schedule of a location has been changed from the "start" day.
+        '''
+
+        local_schedule_after = self.schedule.cells[idx, start:self.schedule.lengths[idx]]
+        width = max(len(local_schedule_before), len(local_schedule_after))
+        before = np.full(width, Schedule.EMPTY, dtype='i4')
+        before[:len(local_schedule_before)] = local_schedule_before
+        after = np.full(width, Schedule.EMPTY, dtype='i4')
+        after[:len(local_schedule_after)] = local_schedule_after
+
+        changed_days = np.flatnonzero(before != after)
+        if len(changed_days) == 0:
+            return
+        else:
+            self.cells_moved += len(changed_days)
+
+        if start+width > self.counts.shape[0]:
+            extension = np.zeros((max(start+width, self.counts.shape[0]*2)-self.counts.shape[0], self.counts.shape[1]), dtype='i4')
+            self.counts = np.vstack((self.counts, extension))
+
+        removed = changed_days[before[changed_days] != Schedule.EMPTY]
+        np.add.at(self.counts, (start+removed, before[removed]), -1)
+        added = changed_days[after[changed_days] != Schedule.EMPTY]
+        np.add.at(self.counts, (start+added, after[added]), 1)
+
+        for day in start+added:
+            activity_id = self.schedule.cells[idx, day]
+            if self.counts[day, activity_id] > self.productivity[activity_id]:
+                self.push_productivity(int(day), int(activity_id))
+
+        neighbours = self.neighbourhood_index.reverse_neighbours(idx, self.max_pre_dist)
+        for day in start+changed_days:
+            self.push_pre_dist(int(self.ranks[idx]), int(day))
+            for neighbour in neighbours[self.schedule.lengths[neighbours] > day]:
+                self.push_pre_dist(int(self.ranks[neighbour]), int(day))
+
+    def push_pre_dist(self, rank, day):
+        if (rank, day) not in self.pre_dist_pending:
+            self.pre_dist_pending.add((rank, day))
+            heapq.heappush(self.pre_dist_queue, (rank, day))
+
+    def push_productivity(self, day, activity_id):
+        if (day, activity_id) not in self.productivity_pending:
+            self.productivity_pending.add((day, activity_id))
+            heapq.heappush(self.productivity_queue, (day, activity_id))
+
+    def shift(self, idxs, after):
+        local_schedules_before = [self.schedule.cells[idx, after:self.schedule.lengths[idx]].copy() for idx in idxs]
+        self.schedule.shift([self.schedule.locations[idx] for idx in idxs], after)
+        for idx, local_schedule_before in zip(idxs, local_schedules_before):
+            self.touch(idx, after, local_schedule_before)
+
+    def order_stage(self):
+        '''
+        Inserting a gap keeps the relative order of activities in a location, so only the locations that have never been reordered are in the queue.
+        '''
+
+        snapshot = self.schedule.snapshot()
+        for idx in self.order_queue:
+            update_order_in_local_schedule(self.schedule, self.schedule.locations[idx])
+
+        changed_locations = set(self.schedule.changed_locations(snapshot))
+        saved_rows = self.schedule.trail[snapshot.position:]
+        self.schedule.release(snapshot)
+
+        for idx, local_schedule_before in saved_rows:
+            if idx in changed_locations:
+                self.touch(idx, 0, local_schedule_before)
             else:
-                pass
-                # continue
+                continue
+
+        self.order_queue = []
+        return len(changed_locations) > 0
+
+    def stop_draining(self):
+        '''
+        Return whether a stage should stop after a repair, i.e., without drain or after the deadline.
+        '''
+
+        return not self.drain or (self.deadline is not None and time.perf_counter() >= self.deadline)
+
+    def pre_dist_stage(self):
+        repaired = False
+        while self.pre_dist_queue and not (repaired and self.stop_draining()):
+            rank, day = heapq.heappop(self.pre_dist_queue)
+            self.pre_dist_pending.discard((rank, day))
+
+            idx = self.sorted_idx[rank]
+            if day >= self.schedule.lengths[idx] or self.schedule.cells[idx, day] == Schedule.EMPTY:
+                continue
+            else:
+                location = self.schedule.locations[idx]
+                activity_code = self.schedule.codes[self.schedule.cells[idx, day]]
+
+            target_locations = check_pre_dist(schedule=self.schedule, location=location, day=day, activity_code=activity_code)
+            if target_locations:
+                self.shift([idx], day)
+                repaired = True
+            else:
+                continue
+
+        return repaired
+
+    def productivity_stage(self):
+        repaired = False
+        while self.productivity_queue and not (repaired and self.stop_draining()):
+            day = self.productivity_queue[0][0]
+            entries = []
+            while self.productivity_queue and self.productivity_queue[0][0] == day:
+                entries.append(heapq.heappop(self.productivity_queue))
+                self.productivity_pending.discard(entries[-1])
+
+            column = self.schedule.column(day)
+            overloaded = []
+            for _, activity_id in entries:
+                if self.counts[day, activity_id] > self.productivity[activity_id]:
+                    location_list = np.flatnonzero(column == activity_id)
+                    overloaded.append((location_list[0], activity_id, location_list))
+                else:
+                    continue
+
+            if not overloaded:
+                continue
+            else:
+                overloaded.sort(key=lambda x:x[0])
+
+            for _, activity_id, _ in overloaded[1:]:
+                self.push_productivity(day, activity_id)
+
+            _, activity_id, location_list = overloaded[0]
+            num_overloaded = int(self.counts[day, activity_id]-self.productivity[activity_id])
+            self.shift(location_list[:num_overloaded], day)
+            repaired = True
+
+        return repaired
+
+    def count_violations(self):
+        '''
+        Count the cells that violate the pre_dist constraint and the (day, activity) pairs that violate the productivity constraint.
+        Every violating cell is in the queues, so only the queued cells are checked.
+        The order violations are unknown (i.e., infinite) until the order stage has been run.
+        '''
+
+        if any(stage == '01-order' for stage, _ in self.stages) and self.order_queue:
+            return np.inf
+        else:
+            violations = 0
+
+        if any(stage == '02-predist' for stage, _ in self.stages) and self.pre_dist_pending:
+            ranks, days = np.array(list(self.pre_dist_pending), dtype='i8').T
+            idxs = np.asarray(self.sorted_idx)[ranks]
+            filled = days < self.schedule.lengths[idxs]
+            idxs, days = idxs[filled], days[filled]
+            activity_ids = self.schedule.cells[idxs, days]
+
+            precedence_oracle = navifunc.precedence_oracle(activity_book)
+            index = precedence_oracle.index(self.schedule)
+            violated = np.zeros(len(idxs), dtype=bool)
+            for pre_dist in self.neighbourhood_index.pre_dists:
+                selected = np.flatnonzero(self.pre_dists[activity_ids] == pre_dist)
+                positions, neighbours = self.neighbourhood_index.gather(idxs[selected], pre_dist)
+                positions = selected[positions]
+                neighbour_ids = self.schedule.cells[neighbours, days[positions]]
+                orders = precedence_oracle.relation[index[activity_ids[positions]], index[neighbour_ids]]
+                conflicts = (orders & PrecedenceOracle.PREDECESSOR).astype(bool) & (neighbour_ids != activity_ids[positions])
+                violated[positions[conflicts]] = True
+            violations += int(violated.sum())
         else:
             pass
 
-        ## Activity Predecessor Completion Constraint
-        if do_pre_dist:
-            schedule_updated = deepcopy(activity_predecessor_completion_constraint(schedule_updated))
-            if save_log:
-                naviio.schedule2xlsx(schedule_updated, fname='C-{}/I-{:04d}_02-predist.xlsx'.format(case_id, iteration), verbose=False)
+        if any(stage == '03-productivity' for stage, _ in self.stages):
+            violations += sum(1 for day, activity_id in self.productivity_pending if self.counts[day, activity_id] > self.productivity[activity_id])
+        else:
+            pass
+
+        return violations
+
+    def add_hook(self, hook):
+        '''
+        Register a function that is called with a dictionary (i.e., a metrics record) after each stage and each round.
+
+        A "stage" record has the iteration, stage, time (sec), cells_moved,
+        and the number of cells (pending_pre_dist) and (day, activity) pairs (pending_productivity) queued to be checked.
+        A "round" record has the iteration, changed, time (sec), cells_moved, violations (None if unknown),
+        duration, locations, cells (i.e., the sum of the local schedule lengths), and peak_memory (KB, None if unavailable).
+        '''
+
+        self.hooks.append(hook)
+
+    def emit(self, record):
+        for hook in self.hooks:
+            hook(record)
+
+    def measure_stage(self, stage, do_stage):
+        start_time = time.perf_counter()
+        cells_moved = self.cells_moved
+        result = do_stage()
+        self.emit({
+            'record': 'stage',
+            'iteration': self.iteration,
+            'stage': stage,
+            'time': time.perf_counter()-start_time,
+            'cells_moved': self.cells_moved-cells_moved,
+            'pending_pre_dist': len(self.pre_dist_pending),
+            'pending_productivity': len(self.productivity_pending),
+        })
+        return result
+
+    def measure_round(self, iteration, changed, start_time, cells_moved, violations):
+        self.emit({
+            'record': 'round',
+            'iteration': iteration,
+            'changed': changed,
+            'time': time.perf_counter()-start_time,
+            'cells_moved': self.cells_moved-cells_moved,
+            'violations': int(violations) if np.isfinite(violations) else None,
+            'duration': int(self.schedule.duration),
+            'locations': len(self.schedule.locations),
+            'cells': int(self.schedule.lengths.sum()),
+            'peak_memory': peak_memory(),
+        })
+
+    def step(self, on_stage=None):
+        '''
+        Run a round of the stages and return whether the schedule has been changed.
+
+        Attributes
+        ----------
+        on_stage : function
+            | A function called after each stage with (iteration, stage, schedule).
+        '''
+
+        if self.hooks:
+            iteration, start_time, cells_moved = self.iteration, time.perf_counter(), self.cells_moved
+        else:
+            pass
+
+        schedule_before = self.schedule.snapshot()
+        for stage, do_stage in self.stages:
+            if self.hooks:
+                self.measure_stage(stage, do_stage)
+            else:
+                do_stage()
+
+            if on_stage is not None:
+                on_stage(self.iteration, stage, self.schedule)
             else:
                 pass
-                # continue
+
+        changed = navifunc.compare_schedule(schedule_before, self.schedule) == 'different'
+        self.schedule.release(schedule_before)
+
+        if changed:
+            self.iteration += 1
+            fingerprint = self.schedule.fingerprint
+            if fingerprint in self.fingerprints:
+                self.revisited = self.fingerprints[fingerprint]
+            else:
+                self.fingerprints[fingerprint] = self.iteration
+
+            score = (self.count_violations(), self.schedule.duration)
+            if score < self.best_score:
+                self.best_schedule = self.schedule.copy()
+                self.best_score = score
+                self.best_iteration = self.iteration
+            else:
+                pass
+        else:
+            score = (self.count_violations(), self.schedule.duration)
+            self.best_schedule = self.schedule
+            self.best_score = score
+            self.best_iteration = self.iteration
+
+        if self.hooks:
+            self.measure_round(iteration, changed, start_time, cells_moved, score[0])
         else:
             pass
 
-        ## Activity Productivity Constraint
-        if do_productivity:
-            schedule_updated = deepcopy(activity_productivity_constraint(schedule_updated))
-            if save_log:
-                naviio.schedule2xlsx(schedule_updated, fname='C-{}/I-{:04d}_03-productivity.xlsx'.format(case_id, iteration), verbose=False)
+        return changed
+
+    def run(self, on_stage=None, max_iteration=None):
+        '''
+        Run the rounds until the schedule does not change, returns to an earlier state, or reaches the max_iteration.
+        '''
+
+        while self.step(on_stage=on_stage):
+            if self.revisited is not None or (max_iteration is not None and self.iteration >= max_iteration):
+                break
+            else:
+                continue
+
+        return self.schedule
+
+
+## Update schedule
+def update(schedule_original, do_order, do_pre_dist, do_productivity, do_compress, save_log, sleep_for_verbose, **options):
+    '''
+    Update the schedule with a ConstraintPropagator and return the updated schedule.
+    The options (e.g., max_iteration and time_limit) are those of update_with_status(), which also returns the stop status and the number of iterations.
+    '''
+
+    schedule_updated, _, _ = update_with_status(schedule_original, do_order, do_pre_dist, do_productivity, do_compress, save_log, sleep_for_verbose, **options)
+    return schedule_updated
+
+def update_with_status(schedule_original, do_order, do_pre_dist, do_productivity, do_compress, save_log, sleep_for_verbose, max_iteration=None, time_limit=None, hooks=None, save_metrics=False, drain=False, verbose=False):
+    '''
+    Update the schedule with a ConstraintPropagator, and return the updated schedule with the stop status and the number of iterations.
+    Note that compress_schedule() keeps the schedule as it is, so it is applied once after the propagation.
+
+    Attributes
+    ----------
+    sleep_for_verbose : bool
+        | Whether to sleep for a second after each round (with verbose) to follow the progress.
+    max_iteration : int
+        | The maximum number of iterations (None for no limit).
+    time_limit : float
+        | The maximum running time in seconds (None for no limit).
+    hooks : list
+        | The functions called with the metrics records of each stage and round (see ConstraintPropagator.add_hook).
+    save_metrics : bool
+        | Whether the metrics records are written in "C-{case_id}/metrics.jsonl" of the schedule directory.
+    drain : bool
+        | Whether each stage repairs all queued violations in a round (True), or only the first one as the former fixed-point loop (False, default).
+    verbose : bool
+        | Whether to print the progress of each round.
+
+    Returns
+    -------
+    schedule_updated : Schedule
+        | The converged schedule, or the best schedule seen so far if the update has been stopped.
+    status : str
+        | 'converged', 'cycle' (the schedule has returned to an earlier state), 'max_iteration', or 'time_limit'.
+    iteration : int
+        | The number of iterations that changed the schedule.
+    '''
+
+    global case_id
+
+    if save_log:
+        iteration_log = IterationLog(navipath.iteration_log(case_id))
+        save_stage = iteration_log.write
+    else:
+        iteration_log = None
+        save_stage = None
+
+    if save_metrics:
+        metrics_log = MetricsLog(navipath.metrics_log(case_id))
+        hooks = list(hooks or [])+[metrics_log]
+    else:
+        metrics_log = None
+
+    ## The iteration log is flushed even if the update is interrupted.
+    try:
+        times = []
+        running_time = 0
+        propagator = ConstraintPropagator(schedule_original.copy(), do_order=do_order, do_pre_dist=do_pre_dist, do_productivity=do_productivity, drain=drain)
+        for hook in hooks or []:
+            propagator.add_hook(hook)
+
+        if time_limit is not None:
+            propagator.deadline = time.perf_counter()+time_limit
+        else:
+            pass
+
+        while True:
+            if verbose:
+                print('\r  | Iteration: {:,d}'.format(propagator.iteration), end='')
             else:
                 pass
-                # continue
+
+            if max_iteration is not None and propagator.iteration >= max_iteration:
+                status = 'max_iteration'
+                break
+            elif time_limit is not None and running_time >= time_limit:
+                status = 'time_limit'
+                break
+            else:
+                start_time = time.time()
+
+            if propagator.step(on_stage=save_stage):
+                if verbose and sleep_for_verbose:
+                    time.sleep(1)
+                else:
+                    pass
+                end_time = time.time()
+                iteration_time = end_time - start_time
+                running_time += iteration_time
+                times.append((propagator.iteration, iteration_time))
+                if verbose:
+                    print(' (Running time: {:.03f} sec/iter & {:,d} sec/total)'.format(iteration_time, int(running_time)), end='')
+                else:
+                    pass
+
+                if propagator.revisited is not None:
+                    status = 'cycle'
+                    break
+                else:
+                    continue
+            else:
+                status = 'converged'
+                break
+
+        schedule_updated = propagator.best_schedule
+        if status != 'converged':
+            print('\n  | Stopped by {} at iteration {:,d} (best: iteration {:,d} with {} violations & {:,d} days)'.format(
+                status, propagator.iteration, propagator.best_iteration, propagator.best_score[0], propagator.best_score[1]), end='')
         else:
             pass
 
         ## Compress empty workday
         if do_compress:
-            schedule_updated = deepcopy(compress_schedule(schedule_updated))
+            if propagator.hooks:
+                schedule_updated = propagator.measure_stage('04-compressed', lambda: compress_schedule(schedule_updated))
+            else:
+                schedule_updated = compress_schedule(schedule_updated)
             if save_log:
-                naviio.schedule2xlsx(schedule_updated, fname='C-{}/I-{:04d}_04-compressed.xlsx'.format(case_id, iteration), verbose=False)
+                save_stage(propagator.iteration, '04-compressed', schedule_updated)
             else:
                 pass
-                # continue
+        else:
+            pass
+    finally:
+        if save_log:
+            iteration_log.close()
         else:
             pass
 
-        schedule_after = deepcopy(schedule_updated)
-        if navifunc.compare_schedule(schedule_before, schedule_after) == 'same':
-            break
+        if save_metrics:
+            metrics_log.close()
         else:
-            iteration += 1
-            if sleep_for_verbose:
-                time.sleep(1)
-            else:
-                pass
-            end_time = time.time()
-            iteration_time = end_time - start_time
-            running_time += iteration_time
-            times.append((iteration, iteration_time))
-            print(' (Running time: {:.03f} sec/iter & {:,d} sec/total)'.format(iteration_time, int(running_time)), end='')
-            continue
+            pass
 
-    print('\n  | Total running time: {:.03f} sec'.format(sum([t for _, t in times])))
-    return schedule_updated
+    print('\n  | Total running time: {:.03f} sec ({:,d} iterations)'.format(sum([t for _, t in times]), propagator.iteration))
+    return schedule_updated, status, propagator.iteration
 
 
 if __name__ == '__main__':
     ## Load project
     activity_book = naviio.import_activity_book()
+    if activity_book is None:
+        sys.exit(1)
+    else:
+        pass
 
     try:
         case_id = str(sys.argv[1])
@@ -481,13 +890,15 @@ if __name__ == '__main__':
     ## Update schedule
     print('============================================================')
     print('Update schedule')
-    schedule_updated = update(schedule_original=schedule_normalized, 
-                              do_order=True, 
-                              do_pre_dist=True, 
-                              do_productivity=True,
-                              do_compress=True,
-                              save_log=True,
-                              sleep_for_verbose=True)
+    schedule_updated, status, iteration = update_with_status(schedule_original=schedule_normalized, 
+                                                             do_order=True, 
+                                                             do_pre_dist=True, 
+                                                             do_productivity=True,
+                                                             do_compress=True,
+                                                             save_log=True,
+                                                             sleep_for_verbose=True,
+                                                             save_metrics='--metrics' in sys.argv,
+                                                             verbose=True)
 
     ## Export schedule
     try:
@@ -495,6 +906,11 @@ if __name__ == '__main__':
     except:
         pass
 
+    if '--xlsx' in sys.argv:
+        naviio.iteration_log2xlsx(case_id)
+    else:
+        pass
+
     ## Print schedule
     print('============================================================')
     print('Initial schedule')
@@ -502,4 +918,23 @@ if __name__ == '__main__':
 
     print('============================================================')
     print('Updated schedule')
-    navifunc.print_work_plan(schedule=schedule_updated)
\ No newline at end of file
+    navifunc.print_work_plan(schedule=schedule_updated)
+
+    ## Check the planned duration
+    if os.path.isfile(navipath.proj(case_id)):
+        with open(navipath.proj(case_id), 'rb') as f:
+            project = pk.load(f)
+
+        project.schedule = schedule_updated
+        if project.is_delayed():
+            import recommend
+
+            print('============================================================')
+            print('Productivity adjustment required')
+            print('  | The updated schedule cannot finish within the planned duration: {:,} days (planned), {:,} days (expected)'.format(project.duration, project.duration_expected))
+            options, baseline, exhausted = recommend.recommend(activity_book, schedule_normalized, project.duration)
+            recommend.print_recommendation(case_id, activity_book, project.duration, options, baseline, exhausted, num_options=3, max_evaluations=500)
+        else:
+            pass
+    else:
+        pass
\ No newline at end of file
@@ -13,7 +13,7 @@ import pickle as pk
 import pandas as pd
 from collections import defaultdict
 
-from naviutil import NaviPath, NaviIO, NaviFunc
+from naviutil import NaviPath, NaviIO, NaviFunc, NeighbourhoodIndex
 navipath = NaviPath()
 naviio = NaviIO()
 navifunc = NaviFunc()
@@ -32,21 +32,6 @@ def calculate_activity_work_plan(schedule):
 
     return work_plan
 
-def find_workdays(activity_list, major_code):
-    workdays = []
-    for activity, day in activity_list.items():
-        if major_code in activity:
-            workdays.append(day)
-
-    try:
-        day_start = min(workdays)
-        day_end = max(workdays)
-    except ValueError:
-        day_start = None
-        day_end = None
-
-    return day_start, day_end
-
 def find_upper_location(location):
     x, y, z = location.split('_')
     upper_z = str(int(z) + 1)
@@ -97,72 +82,12 @@ check_pre_dist_act = schedule[temp_location][day]
 checked_dist = activity_pre_dist_dic[check_pre_dist_act] #첫날 첫번째 작업의 선행완료거리값
 
 #finding grids inside influence of act
-location_to_check = []
-location_to_check.append(temp_location)
-
-for location in location_to_check:
-    x, y, z = location.split("_")
-    pre_dist1 = checked_dist
-    pre_dist2 = checked_dist
-    pre_dist_z1 = 1
-    pre_dist_z2 = int(-1)
-    x = int(x)
-    y = int(y)
-    z = int(z)
-    pre_dist_location_x_list = []
-    pre_dist_location_y_list = []
-    pre_dist_location_z_list = [z]
-    while pre_dist1 > 0:
-        pred_dist_x1 = x + pre_dist1
-        pre_dist_location_x_list.append(pred_dist_x1)
-        pred_dist_y1 = y + pre_dist1
-        pre_dist_location_y_list.append(pred_dist_y1)
-        pre_dist1 = pre_dist1 - 1
-
-    while pre_dist2 >= 0:
-        pred_dist_x2 = x - pre_dist2
-        pred_dist_y2 = y - pre_dist2
-        if pred_dist_x2 > 0:
-            pre_dist_location_x_list.append(pred_dist_x2)
-        if pred_dist_y2 > 0:
-            pre_dist_location_y_list.append(pred_dist_y2)
-        pre_dist2 = pre_dist2 - 1
-
-    # if 'D' in check_pre_dist_act:
-    #     pred_dist_z = z + pre_dist_z1
-    #     pre_dist_location_z_list.append(pred_dist_z)
-    # elif 'S' in check_pre_dist_act:
-    #     pred_dist_z = z + pre_dist_z2
-    #     pre_dist_location_z_list.append(pred_dist_z)
-
-#making influence grid
-#특정 작업의 영향거리 내 Location만들기1
-
-influence_locations=[]
-for x in pre_dist_location_x_list:
-    x=str(x)
-    for y in pre_dist_location_y_list:
-        y=str(y)
-        for z in pre_dist_location_z_list:
-            z=str(z)
-            influence_x_y_z = []
-            influence_x_y_z.append(x)
-            influence_x_y_z.append(y)
-            influence_x_y_z.append(z)
-            influence_location = '_'.join(influence_x_y_z)
-            influence_locations.append(influence_location)
-
-# 자신의 그리드 제거
-if temp_location in influence_locations:
-    influence_locations.remove(temp_location)
+#특정 작업의 영향거리 내 Location만들기 (see NeighbourhoodIndex: the same floor within the pre_dist in x and y, excluding its own grid)
+neighbourhood_index = NeighbourhoodIndex.from_locations(schedule.locations, [checked_dist])
+influence_idxs = neighbourhood_index.neighbours(schedule.location2idx[temp_location], int(checked_dist))
 
 # 존재하는 그리드만 남기기
-existing_influence_location=[]
-for location in schedule.keys():
-    if location in influence_locations:
-        existing_influence_location.append(location)
-    else:
-        continue
+existing_influence_location = [schedule.locations[idx] for idx in influence_idxs]
 
 ###############################################################################
 #영향내 그리드의 작업 확인
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark the scaling of the program with synthetic cases of growing sizes (see "synthetic_case.py").
+It times "initiate_project" of "run/init.py", each constraint stage of "run/update.py", and the full "update()",
+and writes the results as JSON, including the scaling exponents (i.e., the slope of log(time) over log(rows)) between the sizes.
+
+Usage:
+    python test/benchmark.py [--sizes 3x3x1,6x6x2,10x10x3] [--activities 10] [--repeat 1] [--output benchmark.json]
+'''
+
+# Configuration
+import os
+import sys
+rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
+sys.path.append(rootpath)
+sys.path.append(os.path.sep.join((rootpath, 'run')))
+sys.path.append(os.path.sep.join((rootpath, 'test')))
+
+from naviutil import NaviFunc, RunContext
+navifunc = NaviFunc()
+
+import io
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+from contextlib import redirect_stdout
+from collections import defaultdict
+
+import init
+import update
+from synthetic_case import generate_case
+
+
+def benchmark_case(size, activities_per_grid, order_density, pre_dist_density, seed, max_iteration, time_limit):
+    x, y, floors = size
+    activity_table, activity_order, case_data = generate_case(x=x, y=y, floors=floors,
+                                                              activities_per_grid=activities_per_grid,
+                                                              order_density=order_density,
+                                                              pre_dist_density=pre_dist_density,
+                                                              seed=seed)
+
+    result = {
+        'size': '{}x{}x{}'.format(x, y, floors),
+        'grids': x*y*floors+1,
+        'rows': len(case_data),
+        'activities': len(activity_table),
+        'orders': len(activity_order),
+    }
+
+    case_num = 'benchmark-{}'.format(result['size'])
+    with tempfile.TemporaryDirectory() as fdir, RunContext(run_id=case_num, fdir=fdir), redirect_stdout(io.StringIO()):
+        activity_book = init.build_activity_book(activity_table)
+        init.build_activity_network(activity_book, activity_order)
+        update.activity_book = activity_book
+        update.case_id = case_num
+
+        ## Project
+        start_time = time.perf_counter()
+        project = init.initiate_project(case_num, duration=0, activity_book=activity_book, case_data=case_data)
+        result['time_initiate_project'] = time.perf_counter()-start_time
+
+        schedule = update.normallize_duplicated_activity(navifunc.grids2schedule(grids=project.sorted_grids), save=False)
+        result['duration_initial'] = schedule.duration
+
+        ## Constraint stages
+        records = []
+        start_time = time.perf_counter()
+        propagator = update.ConstraintPropagator(schedule.copy())
+        result['time_propagator_init'] = time.perf_counter()-start_time
+
+        propagator.add_hook(records.append)
+        propagator.run(max_iteration=max_iteration)
+
+        stages = defaultdict(lambda: {'time': 0.0, 'calls': 0, 'cells_moved': 0})
+        for record in records:
+            if record['record'] == 'stage':
+                stages[record['stage']]['time'] += record['time']
+                stages[record['stage']]['calls'] += 1
+                stages[record['stage']]['cells_moved'] += record['cells_moved']
+            else:
+                continue
+
+        time_rounds = sum(record['time'] for record in records if record['record'] == 'round')
+        result['stages'] = dict(stages)
+        result['time_round_overhead'] = time_rounds-sum(stage['time'] for stage in stages.values())
+        result['peak_memory'] = max((record['peak_memory'] or 0 for record in records if record['record'] == 'round'), default=None)
+
+        ## Full update
+        start_time = time.perf_counter()
+        schedule_updated, status, iteration = update.update_with_status(schedule_original=schedule,
+                                                                        do_order=True,
+                                                                        do_pre_dist=True,
+                                                                        do_productivity=True,
+                                                                        do_compress=True,
+                                                                        save_log=False,
+                                                                        sleep_for_verbose=False,
+                                                                        max_iteration=max_iteration,
+                                                                        time_limit=time_limit)
+        result['time_update'] = time.perf_counter()-start_time
+        result['status'] = status
+        result['iterations'] = iteration
+        result['duration_updated'] = schedule_updated.duration
+
+    return result
+
+def scaling_exponents(results, metrics):
+    '''
+    Return the slope of log(time) over log(rows) between each pair of consecutive sizes, e.g., 1 for a linear scaling and 2 for a quadratic one.
+    '''
+
+    exponents = []
+    for before, after in zip(results[:-1], results[1:]):
+        exponent = {'from': before['size'], 'to': after['size']}
+        for metric in metrics:
+            time_before, time_after = before.get(metric), after.get(metric)
+            if time_before and time_after and after['rows'] != before['rows']:
+                exponent[metric] = float(np.log(time_after/time_before)/np.log(after['rows']/before['rows']))
+            else:
+                exponent[metric] = None
+
+        exponents.append(exponent)
+
+    return exponents
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the scaling of the program with synthetic cases.')
+    parser.add_argument('--sizes', default='3x3x1,6x6x2,10x10x3', help='comma-separated sizes of the site (x x y x floors)')
+    parser.add_argument('--activities', type=int, default=10, help='the number of activities of each grid')
+    parser.add_argument('--order-density', type=float, default=0.3)
+    parser.add_argument('--pre-dist-density', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='the number of runs of each size (the fastest one is reported)')
+    parser.add_argument('--max-iteration', type=int, default=None)
+    parser.add_argument('--time-limit', type=float, default=None)
+    parser.add_argument('--output', default=None, help='the JSON file of the results (default: stdout)')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(value) for value in size.split('x')) for size in args.sizes.split(',')]
+
+    results = []
+    for size in sizes:
+        runs = [benchmark_case(size, args.activities, args.order_density, args.pre_dist_density, args.seed, args.max_iteration, args.time_limit) for _ in range(args.repeat)]
+        result = min(runs, key=lambda run:run['time_update'])
+        results.append(result)
+        print('  | {:>10}: {:>8,} rows, init {:.03f} sec, update {:.03f} sec ({}, {:,} iterations)'.format(
+            result['size'], result['rows'], result['time_initiate_project'], result['time_update'], result['status'], result['iterations']), file=sys.stderr)
+
+    stages = sorted({stage for result in results for stage in result['stages']})
+    for result in results:
+        for stage in stages:
+            result['time_{}'.format(stage)] = result['stages'].get(stage, {}).get('time')
+
+    metrics = ['time_initiate_project', 'time_update']+['time_{}'.format(stage) for stage in stages]
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+        'scaling': scaling_exponents(results, metrics),
+    }
+
+    if args.output:
+        with RunContext.current().open_atomic(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -11,7 +11,7 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from naviutil import NaviPath, NaviFunc, NaviIO
+from naviutil import NaviPath, NaviFunc, NaviIO, LocationArray
 navipath = NaviPath()
 navifunc = NaviFunc()
 naviio = NaviIO()
@@ -62,13 +62,13 @@ def find_influence_locations(location_list, current_location, activity_code):
         if pre_dist == 'NA':
             return []
         else:
-            for comparing_location in schedule:
-                if comparing_location == current_location:
+            location_array = LocationArray.from_locations(location_list)
+            current = [int(value) for value in current_location.split('_')]
+            for idx in location_array.within(current, pre_dist):
+                if location_list[idx] == current_location:
                     continue
                 else:
-                    distance = navifunc.euclidean_distance(current_location.split('_'), comparing_location.split('_'))
-                    if distance <= pre_dist:
-                        influenced_locations.append(comparing_location)
+                    influenced_locations.append(location_list[idx])
     except KeyError:
         # print('Please add {} to activity_table.xlsx and run init.py again!!'.format(activity_code))
         pass
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check the updated schedules of the cases against the baseline outputs (i.e., "test/baseline/C-{case}_updated.xlsx").
+Each case runs "init.py" and "update.py" end-to-end in a temporary RunContext.
+The update with its default options (i.e., the former fixed-point loop) should reproduce the baseline "updated.xlsx" exactly,
+and the drained update (drain=True) should leave no violations.
+
+Usage:
+    python test/regression_update.py [<case> ...]
+
+    e.g., python test/regression_update.py 009 01 10 001
+'''
+
+# Configuration
+import os
+import sys
+rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
+sys.path.append(rootpath)
+sys.path.append(os.path.sep.join((rootpath, 'run')))
+
+from naviutil import NaviPath, NaviIO, RunContext
+navipath = NaviPath()
+naviio = NaviIO()
+
+import io
+import tempfile
+import pandas as pd
+from contextlib import redirect_stdout
+
+import init
+import update
+
+
+fdir_baseline = os.path.sep.join((rootpath, 'test', 'baseline'))
+cases = ['009', '01', '10', '001']
+
+
+def run_case(case_num, activity_book):
+    '''
+    Run a case end-to-end and return the updated schedule (as the DataFrame of "updated.xlsx")
+    with the number of violations left by the drained update.
+    '''
+
+    with tempfile.TemporaryDirectory() as fdir, RunContext(run_id='regression-{}'.format(case_num), fdir=fdir), redirect_stdout(io.StringIO()):
+        init.initiate_project(case_num, duration=0, activity_book=activity_book)
+        init.export_initial_schedule(case_num)
+
+        update.activity_book = activity_book
+        update.case_id = case_num
+        schedule = update.import_schedule(case_num)
+        schedule_normalized = update.normallize_duplicated_activity(schedule, save=False)
+
+        schedule_updated = update.update(schedule_original=schedule_normalized,
+                                         do_order=True,
+                                         do_pre_dist=True,
+                                         do_productivity=True,
+                                         do_compress=True,
+                                         save_log=False,
+                                         sleep_for_verbose=False)
+        naviio.schedule2xlsx(schedule=schedule_updated, fname='C-{}/updated.xlsx'.format(case_num))
+        updated_df = pd.read_excel(os.path.sep.join((navipath.fdir_schedule, 'C-{}'.format(case_num), 'updated.xlsx')), index_col=0)
+
+        propagator = update.ConstraintPropagator(schedule_normalized.copy(), drain=True)
+        propagator.run()
+        violations = propagator.count_violations()
+
+    return updated_df, violations
+
+def check_case(case_num, activity_book):
+    baseline_df = pd.read_excel(os.path.sep.join((fdir_baseline, 'C-{}_updated.xlsx'.format(case_num))), index_col=0)
+    updated_df, violations = run_case(case_num, activity_book)
+
+    is_same = updated_df.equals(baseline_df)
+    print('  | Case {:>4}: {} (baseline), {:,} violations (drained)'.format(case_num, 'same' if is_same else 'DIFFERENT', violations))
+    if not is_same:
+        diff = updated_df.compare(baseline_df, result_names=('updated', 'baseline')) if updated_df.shape == baseline_df.shape else None
+        if diff is not None:
+            print(diff.to_string())
+        else:
+            print('    shape: {} (updated), {} (baseline)'.format(updated_df.shape, baseline_df.shape))
+    else:
+        pass
+
+    return is_same and violations == 0
+
+
+if __name__ == '__main__':
+    case_nums = sys.argv[1:] or cases
+
+    activity_book = init.build_activity_book(pd.read_excel(navipath.activity_table))
+    init.build_activity_network(activity_book, pd.read_excel(navipath.activity_order))
+
+    print('============================================================')
+    print('Regression of updated schedules')
+    results = [check_case(case_num, activity_book) for case_num in case_nums]
+
+    if all(results):
+        print('OK')
+    else:
+        print('FAILED: {:,} of {:,} cases'.format(results.count(False), len(results)))
+        sys.exit(1)
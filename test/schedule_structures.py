@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check the data structures of the Schedule with random edits against the plain dict of dicts (i.e., schedule[location][day] = activity_code):
+the write-through local schedules (ScheduleRow), snapshot/rollback/release, the fingerprint of revisited schedules,
+the keyframe and delta records of the IterationLog (with locations added during the log), DurationTracker, and ActivityIndex.
+
+Usage:
+    python test/schedule_structures.py [--seed 0] [--rounds 200]
+'''
+
+# Configuration
+import os
+import sys
+rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
+sys.path.append(rootpath)
+
+from naviutil import Schedule, IterationLog, IterationHistory, ActivityIndex, DurationTracker, RunContext
+
+import random
+import argparse
+import tempfile
+from copy import deepcopy
+
+
+codes = ['A10010', 'A10020', 'B10010', 'B10020', 'C10010']
+
+
+def random_schedule(rng, num_locations=6, days=8):
+    schedule = {}
+    for x in range(num_locations):
+        schedule['{}_0_0'.format(x)] = {day: rng.choice(codes) for day in range(days) if rng.random() < 0.7}
+
+    return schedule
+
+def random_edit(rng, schedule, expected):
+    '''
+    Apply a random edit to both the Schedule and the expected dict of dicts.
+    '''
+
+    location = rng.choice(schedule.locations)
+    edit = rng.choice(('set', 'delete', 'shift', 'replace'))
+    if edit == 'set':
+        day = rng.randrange(12)
+        activity_code = rng.choice(codes)
+        schedule[location][day] = activity_code
+        expected[location][day] = activity_code
+    elif edit == 'delete' and expected[location]:
+        day = rng.choice(list(expected[location]))
+        del schedule[location][day]
+        del expected[location][day]
+    elif edit == 'shift':
+        after = rng.randrange(6)
+        schedule.shift([location], after, days=1)
+        local_schedule = expected[location]
+        last = max(max(local_schedule)+1, after) if local_schedule else after
+        shifted = {(day+1 if day >= after else day): activity_code for day, activity_code in local_schedule.items()}
+        shifted[after] = Schedule.GAP_CODE
+        expected[location] = {day: activity_code for day, activity_code in shifted.items() if day <= last}
+    else:
+        local_schedule = {day: rng.choice(codes) for day in range(rng.randrange(1, 6))}
+        schedule[location] = local_schedule
+        expected[location] = dict(local_schedule)
+
+def as_dict(schedule):
+    return {location: dict(local_schedule) for location, local_schedule in schedule.to_dict().items()}
+
+
+def check_schedule_row(rng):
+    expected = random_schedule(rng)
+    schedule = Schedule.from_dict(expected)
+
+    for _ in range(50):
+        random_edit(rng, schedule, expected)
+        assert as_dict(schedule) == expected
+
+    location = schedule.locations[0]
+    local_schedule = schedule[location].copy()
+    local_schedule[99] = codes[0]
+    assert 99 not in schedule[location], 'ScheduleRow.copy() should not write through'
+
+    exported = schedule.to_dict()
+    exported[location][99] = codes[0]
+    assert schedule.get(location, 99) is None, 'Schedule.to_dict() should not write through'
+
+def check_snapshot(rng):
+    expected = random_schedule(rng)
+    schedule = Schedule.from_dict(expected)
+    fingerprint = schedule.fingerprint
+
+    snapshot = schedule.snapshot()
+    edited = deepcopy(expected)
+    for _ in range(rng.randrange(1, 20)):
+        random_edit(rng, schedule, edited)
+
+    changed = {schedule.locations[idx] for idx in schedule.changed_locations(snapshot)}
+    assert changed == {location for location in expected if expected[location] != edited[location]}
+    assert as_dict(schedule.materialize(snapshot)) == expected
+    assert as_dict(schedule) == edited
+
+    ## The snapshot remains available after a rollback.
+    schedule.rollback(snapshot)
+    assert as_dict(schedule) == expected
+    assert schedule.fingerprint == fingerprint
+
+    random_edit(rng, schedule, deepcopy(expected))
+    schedule.rollback(snapshot)
+    assert as_dict(schedule) == expected
+
+    schedule.release(snapshot)
+    assert not schedule.snapshots and not schedule.trail
+
+    ## Nested snapshots are rolled back to each state, including the locations added after a snapshot.
+    outer = schedule.snapshot()
+    random_edit(rng, schedule, deepcopy(expected))
+    middle_state = as_dict(schedule)
+    inner = schedule.snapshot()
+    schedule.set('99_0_0', 0, codes[0])
+    random_edit(rng, schedule, as_dict(schedule))
+    schedule.rollback(inner)
+    assert as_dict(schedule) == middle_state and '99_0_0' not in schedule
+    schedule.rollback(outer)
+    assert as_dict(schedule) == expected
+
+def check_fingerprint(rng):
+    expected = random_schedule(rng)
+    schedule = Schedule.from_dict(expected)
+    fingerprint = schedule.fingerprint
+
+    ## A schedule that returns to an earlier state has the same fingerprint, whatever the edits in between.
+    location = rng.choice(schedule.locations)
+    day = rng.randrange(8)
+    before = schedule.get(location, day)
+    schedule.set(location, day, codes[0] if before != codes[0] else codes[1])
+    assert schedule.fingerprint != fingerprint
+    schedule.set(location, day, before)
+    assert schedule.fingerprint == fingerprint
+
+    edited = deepcopy(expected)
+    for _ in range(10):
+        random_edit(rng, schedule, edited)
+
+    assert schedule.fingerprint == Schedule.from_dict(edited, codes=schedule.codes[1:]).fingerprint
+    schedule[location] = {}
+    for location_edited in schedule.locations:
+        schedule[location_edited] = expected[location_edited]
+
+    assert schedule.fingerprint == fingerprint
+
+def check_iteration_log(rng, background):
+    expected = random_schedule(rng)
+    schedule = Schedule.from_dict(expected)
+
+    records = []
+    with tempfile.TemporaryDirectory() as fdir, RunContext(run_id='schedule-structures', fdir=fdir):
+        fpath = os.path.sep.join((fdir, 'iterations.navilog'))
+        with IterationLog(fpath, background=background, keyframe_interval=4) as iteration_log:
+            for iteration in range(12):
+                for stage in ('01-order', '02-predist'):
+                    random_edit(rng, schedule, expected)
+                    if rng.random() < 0.1:
+                        location = '{}_1_0'.format(len(schedule.locations))
+                        schedule.set(location, 0, rng.choice(codes))
+                        expected[location] = {0: schedule.get(location, 0)}
+                    else:
+                        pass
+
+                    iteration_log.write(iteration, stage, schedule)
+                    records.append((iteration, stage, deepcopy(expected)))
+
+        assert [(iteration, stage, as_dict(schedule)) for iteration, stage, schedule in IterationLog.read(fpath)] == records
+
+        ## The records are decoded in any order from the nearest keyframe.
+        with IterationHistory(fpath) as history:
+            for position in rng.sample(range(len(records)), len(records)):
+                assert as_dict(history.get(position)) == records[position][2]
+
+        ## The log is also read without the index.
+        os.remove(fpath+'.idx')
+        with IterationHistory(fpath) as history:
+            assert as_dict(history.get(len(records)-1)) == records[-1][2]
+
+def check_derived_indices(rng):
+    expected = random_schedule(rng)
+    schedule = Schedule.from_dict(expected)
+    activity_index = ActivityIndex(schedule)
+    duration_tracker = DurationTracker(schedule)
+
+    for _ in range(30):
+        random_edit(rng, schedule, expected)
+        if rng.random() < 0.1:
+            schedule.set('{}_2_0'.format(len(schedule.locations)), rng.randrange(10), rng.choice(codes))
+            expected = as_dict(schedule)
+        else:
+            pass
+
+        last_days = [max(local_schedule) for local_schedule in expected.values() if local_schedule]
+        assert duration_tracker.last == max(last_days, default=0)
+
+        for activity_code in codes:
+            cells = sorted(((location, day) for location, local_schedule in expected.items() for day, code in local_schedule.items() if code == activity_code), key=lambda x:(x[1], schedule.location2idx[x[0]]))
+            assert activity_index.search(activity_code) == cells
+            assert activity_index.count(activity_code) == len(cells)
+            assert activity_index.start(activity_code) == (min(day for _, day in cells) if cells else None)
+            assert activity_index.finish(activity_code) == (max(day for _, day in cells) if cells else None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the data structures of the Schedule with random edits.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    checks = [
+        ('ScheduleRow', check_schedule_row),
+        ('Snapshot', check_snapshot),
+        ('Fingerprint', check_fingerprint),
+        ('IterationLog (background)', lambda rng: check_iteration_log(rng, background=True)),
+        ('IterationLog (foreground)', lambda rng: check_iteration_log(rng, background=False)),
+        ('ActivityIndex & DurationTracker', check_derived_indices),
+    ]
+
+    print('============================================================')
+    print('Schedule structures (seed: {}, rounds: {})'.format(args.seed, args.rounds))
+    for name, check in checks:
+        rng = random.Random(args.seed)
+        rounds = args.rounds if not name.startswith('IterationLog') else max(args.rounds//20, 1)
+        for _ in range(rounds):
+            check(rng)
+
+        print('  | {:<32}: OK ({:,} rounds)'.format(name, rounds))
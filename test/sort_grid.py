@@ -7,7 +7,7 @@ import sys
 rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
 sys.path.append(rootpath)
 
-from naviutil import NaviPath
+from naviutil import NaviPath, LocationArray
 navipath = NaviPath()
 
 import numpy as np
@@ -20,12 +20,6 @@ def load_project(case_num):
     with open(navipath.proj(case_num), 'rb') as f:
         return pk.load(f)
 
-def euclidean_distance(x, y):
-    x_arr = np.array(x)
-    y_arr = np.array(y)
-    dist = np.linalg.norm(y_arr-x_arr)
-    return dist
-
 def sort_grids(project):
     sorted_by_work_len = sorted(project.grids, key=lambda x:len(x.works), reverse=True)
 
@@ -46,10 +40,12 @@ def sort_grids(project):
             except IndexError:
                 last_grid = grids_same_worklen[0]
 
-            grids_same_worklen = sorted(grids_same_worklen, key=lambda x:euclidean_distance(x.location_3d, last_grid.location_3d), reverse=False)
+            distances = LocationArray.from_grids(grids_same_worklen).distance(last_grid.location_3d)
+            order = np.argsort(distances, kind='stable')
+            grids_same_worklen = [grids_same_worklen[idx] for idx in order]
             print('  ----------------------------------------')
             print('  | Last grid : {}'.format(last_grid.location_3d))
-            print('  | Most close: {} (dist: {:.03f})'.format(grids_same_worklen[0].location_3d, euclidean_distance(last_grid.location_3d, grids_same_worklen[0].location_3d)))
+            print('  | Most close: {} (dist: {:.03f})'.format(grids_same_worklen[0].location_3d, distances[order[0]]))
             sorted_by_dist.append(grids_same_worklen[0])
             grids_same_worklen.pop(0)
 
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Generate a synthetic case of a large site, since the case data (e.g., "case_10.xlsx") only models a few grids.
+The activities are grouped into trades of which steps follow each other, and each grid takes a sequence of the trades.
+
+Usage:
+    python test/synthetic_case.py <case> [--x 10] [--y 10] [--floors 3] [--activities 10] [--order-density 0.3] [--pre-dist-density 0.5] [--seed 0]
+
+    The case data is written in "data/case_{case}.xlsx", and the templates in "template/activity_table_{case}.xlsx" and "template/activity_order_{case}.xlsx".
+'''
+
+# Configuration
+import os
+import sys
+rootpath = os.path.sep.join(os.path.dirname(os.path.abspath(__file__)).split(os.path.sep)[:-1])
+sys.path.append(rootpath)
+
+from naviutil import NaviPath
+navipath = NaviPath()
+
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def generate_case(x=10, y=10, floors=3, activities_per_grid=10, num_trades=None, steps_per_trade=5, order_density=0.3, pre_dist_density=0.5, max_pre_dist=5, max_productivity=10, seed=0):
+    '''
+    Generate the templates and the case data of a synthetic site.
+
+    Attributes
+    ----------
+    x, y : int
+        | The extent of the site (i.e., the number of grids along each axis).
+    floors : int
+        | The number of floors (i.e., z).
+    activities_per_grid : int
+        | The number of activities of each grid.
+    num_trades : int
+        | The number of trades (default: enough trades that the grids take different sequences).
+    steps_per_trade : int
+        | The number of activities of each trade, which follow each other.
+    order_density : float
+        | The probability that a trade precedes a later trade (0 for independent trades, 1 for a total order).
+    pre_dist_density : float
+        | The probability that an activity has a positive pre_dist.
+    max_pre_dist, max_productivity : int
+        | The maximum pre_dist and productivity of an activity.
+
+    Returns
+    -------
+    activity_table : DataFrame
+        | The ActivityTable template.
+    activity_order : DataFrame
+        | The ActivityOrder template.
+    case_data : DataFrame
+        | The case data.
+    '''
+
+    rng = np.random.default_rng(seed)
+    if num_trades is None:
+        num_trades = max(2, -(-2*activities_per_grid//steps_per_trade))
+    else:
+        pass
+
+    ## Activity table
+    trades = ['S{:03d}'.format(trade+1) for trade in range(num_trades)]
+    sequence = ['{}{:02d}'.format(major, step+1) for major in trades for step in range(steps_per_trade)]
+    milestones = [
+        {'category': 'milestone', 'major_activity': 'Milestone', 'minor_activity': 'project_Start', 'code': 'M00001', 'productivity': 1, 'pre_dist': 0},
+        {'category': 'milestone', 'major_activity': 'Milestone', 'minor_activity': 'project_completion', 'code': 'M00009', 'productivity': 1, 'pre_dist': 0},
+    ]
+
+    has_pre_dist = rng.random(len(sequence)) < pre_dist_density
+    activity_table = pd.DataFrame(milestones+[{
+        'category': 'synthetic',
+        'major_activity': activity_code[:4],
+        'minor_activity': 'trade{}-step{}'.format(int(activity_code[1:4]), int(activity_code[4:])),
+        'code': activity_code,
+        'productivity': int(productivity),
+        'pre_dist': int(pre_dist) if pre_dist_exists else 0,
+        } for activity_code, productivity, pre_dist, pre_dist_exists in zip(sequence,
+                                                                          rng.integers(1, max_productivity+1, len(sequence)),
+                                                                          rng.integers(1, max_pre_dist+1, len(sequence)),
+                                                                          has_pre_dist)])
+
+    ## Activity order
+    orders = []
+    for major in trades:
+        steps = ['{}{:02d}'.format(major, step+1) for step in range(steps_per_trade)]
+        orders.append(('M00001', steps[0]))
+        orders.extend(zip(steps[:-1], steps[1:]))
+        orders.append((steps[-1], 'M00009'))
+
+    predecessors, successors = np.nonzero(np.triu(rng.random((num_trades, num_trades)) < order_density, k=1))
+    for predecessor, successor in zip(predecessors, successors):
+        orders.append(('{}{:02d}'.format(trades[predecessor], steps_per_trade), '{}{:02d}'.format(trades[successor], 1)))
+
+    activity_order = pd.DataFrame(orders, columns=['predecessor', 'successor'])
+
+    ## Case data
+    activity_codes = activity_table.set_index('code')
+    rows = [(0, 0, 0, 'M00009'), (0, 0, 0, 'M00001')]
+    starts = rng.integers(0, max(len(sequence)-activities_per_grid, 0)+1, size=(x, y, floors))
+    for grid_x in range(x):
+        for grid_y in range(y):
+            for grid_z in range(floors):
+                start = starts[grid_x, grid_y, grid_z]
+                for activity_code in sequence[start:start+activities_per_grid]:
+                    rows.append((grid_x+1, grid_y+1, grid_z, activity_code))
+
+    case_data = pd.DataFrame(rows, columns=['x', 'y', 'z', 'code'])
+    case_data.insert(3, 'major_activity', activity_codes.loc[case_data['code'], 'major_activity'].values)
+    case_data['minor_activity'] = activity_codes.loc[case_data['code'], 'minor_activity'].values
+    return activity_table, activity_order, case_data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic case of a large site.')
+    parser.add_argument('case', help='case number of the synthetic case')
+    parser.add_argument('--x', type=int, default=10)
+    parser.add_argument('--y', type=int, default=10)
+    parser.add_argument('--floors', type=int, default=3)
+    parser.add_argument('--activities', type=int, default=10, help='the number of activities of each grid')
+    parser.add_argument('--steps', type=int, default=5, help='the number of activities of each trade')
+    parser.add_argument('--order-density', type=float, default=0.3)
+    parser.add_argument('--pre-dist-density', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    activity_table, activity_order, case_data = generate_case(x=args.x, y=args.y, floors=args.floors,
+                                                              activities_per_grid=args.activities,
+                                                              steps_per_trade=args.steps,
+                                                              order_density=args.order_density,
+                                                              pre_dist_density=args.pre_dist_density,
+                                                              seed=args.seed)
+
+    fpath_table = os.path.sep.join((navipath.fdir_template, 'activity_table_{}.xlsx'.format(args.case)))
+    fpath_order = os.path.sep.join((navipath.fdir_template, 'activity_order_{}.xlsx'.format(args.case)))
+    activity_table.to_excel(fpath_table, index=False)
+    activity_order.to_excel(fpath_order, index=False)
+    case_data.to_excel(navipath.case(args.case), index=False)
+
+    print('============================================================')
+    print('Synthetic case')
+    print('  | Grids     : {:,} ({} x {} x {})'.format(args.x*args.y*args.floors, args.x, args.y, args.floors))
+    print('  | Activities: {:,} ({:,} rows)'.format(len(activity_table), len(case_data)))
+    print('  | Orders    : {:,}'.format(len(activity_order)))
+    print('  | fname     : {}'.format(navipath.case(args.case)))
+    print('  | fname     : {}'.format(fpath_table))
+    print('  | fname     : {}'.format(fpath_order))